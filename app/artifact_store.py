@@ -0,0 +1,269 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+DEFAULT_ARTIFACTS_DIR = os.path.join(".cache", "artifacts")
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for uploads, rendered images, DOT sources and output documents.
+
+    Bytes are kept once per SHA-256 digest under root/blobs; named references tie a digest
+    to a scope (a job id, a session, ...) so identical uploads and renders are stored once
+    however many jobs use them. Expired scopes and the least recently used ones beyond the
+    size limit are removed by cleanup, together with blobs nothing refers to any more.
+
+    Small artifacts are also kept in an in-memory LRU tier, so serving a recent download
+    does not touch the disk.
+
+    Args:
+        root (str): Folder for blobs and the SQLite index. Created if missing.
+        ttl_seconds (float): References unused for longer than this are removed by cleanup; 0 keeps them.
+        max_bytes (int): Total blob size above which cleanup evicts least recently used scopes.
+        memory_bytes (int): Size of the in-memory tier; 0 disables it.
+        memory_item_bytes (int): Largest artifact kept in the memory tier.
+    """
+
+    def __init__(self, root=DEFAULT_ARTIFACTS_DIR, ttl_seconds=3 * 24 * 3600, max_bytes=2 * 1024 ** 3,
+                 memory_bytes=64 * 1024 ** 2, memory_item_bytes=4 * 1024 ** 2):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.memory_item_bytes = memory_item_bytes
+        self._memory = OrderedDict()  # digest -> bytes
+        self._memory_size = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "scope TEXT NOT NULL, name TEXT NOT NULL, digest TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_access REAL NOT NULL, PRIMARY KEY (scope, name))"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_artifacts_digest ON artifacts(digest)")
+            self._conn.commit()
+
+    def blob_path(self, digest):
+        """Return the file path of a blob; two-character fan-out keeps folders small."""
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def put(self, data, scope, name):
+        """
+        Store bytes under scope/name, replacing any earlier artifact with that name.
+
+        Args:
+            data (bytes): Content to store.
+            scope (str): Owner of the artifact, e.g. a job id.
+            name (str): Name within the scope, e.g. "input.docx".
+
+        Returns:
+            str: Hex SHA-256 digest of the content.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        self._write_blob(digest, data)
+
+        now = time.time()
+        with self._lock:
+            # A cleanup may have removed the blob between the write and this reference
+            self._write_blob(digest, data)
+            previous = self._conn.execute(
+                "SELECT digest FROM artifacts WHERE scope = ? AND name = ?", (scope, name)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO artifacts (scope, name, digest, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, name, digest, len(data), now, now),
+            )
+            self._conn.commit()
+            if previous and previous[0] != digest:
+                self._remove_unreferenced([previous[0]])
+            self._remember(digest, data)
+        return digest
+
+    def _write_blob(self, digest, data):
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            return
+        # Unique temp name and rename, so concurrent writers of the same content never clash
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _remember(self, digest, data):
+        if not self.memory_bytes or len(data) > self.memory_item_bytes:
+            return
+        if digest in self._memory:
+            self._memory.move_to_end(digest)
+            return
+        self._memory[digest] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _lookup(self, scope, name):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT digest FROM artifacts WHERE scope = ? AND name = ?", (scope, name)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE artifacts SET last_access = ? WHERE scope = ? AND name = ?",
+                               (time.time(), scope, name))
+            self._conn.commit()
+        return row[0]
+
+    def get(self, scope, name):
+        """
+        Read an artifact, from the memory tier when possible.
+
+        Returns:
+            bytes or None: The content, or None if there is no such artifact.
+        """
+        digest = self._lookup(scope, name)
+        if digest is None:
+            return None
+        with self._lock:
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+                return data
+        try:
+            with open(self.blob_path(digest), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self._remember(digest, data)
+        return data
+
+    def open(self, scope, name):
+        """
+        Open an artifact for streaming reads without loading it into memory.
+
+        Returns:
+            file object or None: Binary file positioned at the start, or None if there is no such artifact.
+        """
+        digest = self._lookup(scope, name)
+        if digest is None:
+            return None
+        try:
+            return open(self.blob_path(digest), "rb")
+        except FileNotFoundError:
+            return None
+
+    def path(self, scope, name):
+        """Return the blob path of an artifact for callers that need a file, or None if it does not exist."""
+        digest = self._lookup(scope, name)
+        return self.blob_path(digest) if digest else None
+
+    def delete_scope(self, scope):
+        """Drop every artifact of a scope; blobs still used elsewhere are kept."""
+        with self._lock:
+            digests = [row[0] for row in self._conn.execute(
+                "SELECT DISTINCT digest FROM artifacts WHERE scope = ?", (scope,))]
+            self._conn.execute("DELETE FROM artifacts WHERE scope = ?", (scope,))
+            self._conn.commit()
+            self._remove_unreferenced(digests)
+
+    def _remove_unreferenced(self, digests):
+        # Called with the lock held
+        for digest in digests:
+            if self._conn.execute("SELECT 1 FROM artifacts WHERE digest = ? LIMIT 1", (digest,)).fetchone():
+                continue
+            data = self._memory.pop(digest, None)
+            if data is not None:
+                self._memory_size -= len(data)
+            try:
+                os.remove(self.blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def cleanup(self, keep=()):
+        """
+        Remove expired scopes, then least recently used scopes until blobs fit in max_bytes.
+
+        Args:
+            keep (iterable of str): Scopes still in use (e.g. running jobs), never removed.
+
+        Returns:
+            dict: {"scopes": removed scope count, "bytes": stored bytes afterwards}.
+        """
+        keep = set(keep)
+        with self._lock:
+            if self.ttl_seconds:
+                expired = [row[0] for row in self._conn.execute(
+                    "SELECT scope FROM artifacts GROUP BY scope HAVING MAX(last_access) < ?",
+                    (time.time() - self.ttl_seconds,))]
+            else:
+                expired = []
+            by_age = [row[0] for row in self._conn.execute(
+                "SELECT scope FROM artifacts GROUP BY scope ORDER BY MAX(last_access)")]
+
+        removed = [scope for scope in expired if scope not in keep]
+        for scope in removed:
+            self.delete_scope(scope)
+
+        total = self.stats()["bytes"]
+        for scope in by_age:
+            if total <= self.max_bytes:
+                break
+            if scope in keep or scope in removed:
+                continue
+            self.delete_scope(scope)
+            removed.append(scope)
+            total = self.stats()["bytes"]
+        return {"scopes": len(removed), "bytes": total}
+
+    def stats(self):
+        """
+        Summarize the store.
+
+        Returns:
+            dict: scopes, artifacts, distinct blobs, stored bytes and memory tier bytes.
+        """
+        with self._lock:
+            scopes, artifacts = self._conn.execute(
+                "SELECT COUNT(DISTINCT scope), COUNT(*) FROM artifacts"
+            ).fetchone()
+            blobs, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM (SELECT digest, MAX(size) AS size "
+                "FROM artifacts GROUP BY digest)"
+            ).fetchone()
+            return {"scopes": scopes, "artifacts": artifacts, "blobs": blobs, "bytes": total,
+                    "memory_bytes": self._memory_size}
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_artifact_store():
+    """
+    Return the process-wide artifact store, configured from the environment on first use.
+
+    - ARTIFACTS_DIR: Folder for blobs and the index (default .cache/artifacts)
+    - ARTIFACT_TTL_HOURS: Hours an unused scope is kept (default 72)
+    - ARTIFACT_MAX_MB: Total size before least recently used scopes are evicted (default 2048)
+    - ARTIFACT_MEMORY_MB: Size of the in-memory tier for small artifacts (default 64; 0 disables it)
+    """
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = ArtifactStore(
+                root=os.getenv("ARTIFACTS_DIR", DEFAULT_ARTIFACTS_DIR),
+                ttl_seconds=float(os.getenv("ARTIFACT_TTL_HOURS", "72")) * 3600,
+                max_bytes=int(float(os.getenv("ARTIFACT_MAX_MB", "2048")) * 1024 * 1024),
+                memory_bytes=int(float(os.getenv("ARTIFACT_MEMORY_MB", "64")) * 1024 * 1024),
+            )
+        return _default_store
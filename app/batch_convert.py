@@ -0,0 +1,414 @@
+"""
+Headless batch conversion of design documents.
+
+Usage:
+    python -m app.batch_convert INPUT_DIR --targets ServiceNow Salesforce --output converted/
+
+Every .docx under INPUT_DIR is converted to each target technology on a pool of
+worker processes. Finished (document, target) pairs are appended to a JSON-lines
+manifest in the output folder, so re-running the same command after an interruption
+only converts what is still missing.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+from app.diagram_index import DiagramIndex
+from app.diagram_pipeline import DIAGRAM_MODES, convert_diagrams, prepare_images
+from app.formatter import insert_images_to_docx
+from app.image_utils import extract_images_from_docx
+from app.llm_client import create_openai_client
+from app.parser import parse_docx
+from app.section_store import SectionStore, convert_similar
+from app.transformer import convert_sections_concurrently, detect_technology_from_text, is_failed_conversion
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# One client, diagram index and section store per worker process; none can be shared across processes
+_worker_client = None
+_worker_diagram_index = None
+_worker_section_store = None
+
+
+def _get_worker_client():
+    global _worker_client
+    if _worker_client is None:
+        _worker_client = create_openai_client()
+    return _worker_client
+
+
+def _get_worker_diagram_index():
+    global _worker_diagram_index
+    if _worker_diagram_index is None:
+        _worker_diagram_index = DiagramIndex()
+    return _worker_diagram_index
+
+
+def _get_worker_section_store():
+    global _worker_section_store
+    if _worker_section_store is None:
+        _worker_section_store = SectionStore()
+    return _worker_section_store
+
+
+def file_sha256(path):
+    """
+    Hash a file's bytes so edited documents are not mistaken for finished ones.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        str: Hex SHA-256 digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path):
+    """
+    Read the manifest journal and collect the (document hash, target) pairs already done.
+
+    Args:
+        manifest_path (str): Path to the manifest.jsonl file.
+
+    Returns:
+        set of tuple: (sha256, target_tech) pairs with status "done".
+    """
+    done = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+            if entry.get("status") == "done":
+                done.add((entry["sha256"], entry["target_tech"]))
+    return done
+
+
+def manifest_outputs(manifest_path):
+    """
+    Collect the converted documents the manifest has recorded, as real paths.
+
+    Args:
+        manifest_path (str): Path to the manifest.jsonl file.
+
+    Returns:
+        set of str: Output paths of every journaled conversion.
+    """
+    outputs = set()
+    if not os.path.exists(manifest_path):
+        return outputs
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("output"):
+                outputs.add(os.path.realpath(entry["output"]))
+    return outputs
+
+
+def append_manifest(manifest_path, entry):
+    """Append one entry to the manifest and flush it to disk immediately."""
+    with open(manifest_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def output_path_for(output_dir, docx_path, target_tech, input_dir=None):
+    """
+    Build the output file path for one converted document.
+
+    The document's folder relative to input_dir is mirrored under output_dir, so
+    same-named documents in different subfolders never overwrite each other.
+
+    Args:
+        output_dir (str): Folder for the converted documents.
+        docx_path (str): Path to the source .docx file.
+        target_tech (str): Target technology of the conversion.
+        input_dir (str, optional): Folder the documents were found in.
+
+    Returns:
+        str: Path of the converted .docx file.
+    """
+    base_name = os.path.splitext(os.path.basename(docx_path))[0]
+    safe_tech = target_tech.replace(" ", "_")
+    folder = output_dir
+    if input_dir is not None:
+        relative = os.path.relpath(os.path.dirname(os.path.abspath(docx_path)), os.path.abspath(input_dir))
+        if relative != os.curdir and not relative.startswith(os.pardir):
+            folder = os.path.join(output_dir, relative)
+    return os.path.join(folder, f"{base_name}_{safe_tech}.docx")
+
+
+def convert_document(docx_path, target_techs, output_dir, include_diagrams=True, section_workers=4,
+                     diagram_mode="two_step", ocr_first=False, input_dir=None):
+    """
+    Convert one document to several target technologies. Runs inside a worker process.
+
+    The document is parsed, its source technology detected and its images extracted and
+    prepared once; the targets are then converted concurrently, each written to its own
+    .docx file.
+
+    Args:
+        docx_path (str): Path to the source .docx file.
+        target_techs (list of str): Target technologies still missing for this document.
+        output_dir (str): Folder for the converted documents.
+        include_diagrams (bool): Whether to convert embedded diagrams as well.
+        section_workers (int): Concurrent section conversions within each target.
+        diagram_mode (str): "two_step" or "direct" diagram conversion, see convert_diagram.
+        ocr_first (bool): OCR diagrams first and skip the vision call where the text is enough.
+        input_dir (str, optional): Batch input folder, whose subfolders are mirrored under output_dir.
+
+    Returns:
+        list of dict: One result per target with status, output path, section count and timings,
+                      in the order of target_techs. A target with sections whose conversion
+                      failed is "failed", so a resumed run converts it again.
+    """
+    client = _get_worker_client()
+
+    sections = parse_docx(docx_path)
+    full_text = "\n".join(sec.get("content", "") for sec in sections)
+    source_tech = detect_technology_from_text(full_text, client)
+    images = prepare_images(extract_images_from_docx(docx_path), with_payload=True,
+                            ocr=ocr_first) if include_diagrams else []
+
+    store = _get_worker_section_store()
+
+    def convert_target(target_tech):
+        started = time.time()
+        try:
+            # Unchanged sections come from the section store; only the rest is sent to the API
+            texts = store.lookup(sections, source_tech, target_tech)
+            pending = [i for i in range(len(sections)) if i not in texts]
+            # Near-duplicates of earlier sections are reused or sent as a short edit request
+            similar, similar_stats = convert_similar(store, [sections[i] for i in pending], source_tech, target_tech,
+                                                     client, max_workers=section_workers)
+            for position, text in similar.items():
+                texts[pending[position]] = text
+            exact_reused = len(sections) - len(pending)
+            pending = [index for position, index in enumerate(pending) if position not in similar]
+
+            def on_section_done(position, title, text):
+                texts[pending[position]] = text
+                store.save(sections[pending[position]], source_tech, target_tech, text)
+
+            convert_sections_concurrently(
+                [sections[i] for i in pending], source_tech, target_tech, client,
+                max_workers=section_workers, on_section_done=on_section_done,
+            )
+            converted = {}
+            for index, section in enumerate(sections):
+                converted[section.get("title", "Untitled")] = texts[index]
+
+            diagram_results = convert_diagrams(
+                images, source_tech, target_tech, client, index=_get_worker_diagram_index(), mode=diagram_mode,
+                ocr_first=ocr_first,
+            ) if images else []
+            diagram_images = [r["image"] for r in diagram_results if r["image"]]
+
+            output_path = output_path_for(output_dir, docx_path, target_tech, input_dir)
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            insert_images_to_docx(output_path, converted, diagram_images)
+
+            # Sections that came back as API errors leave the document unfinished; the store keeps the
+            # good ones, so the next run only sends these again
+            failed_sections = sum(1 for index in range(len(sections)) if is_failed_conversion(texts.get(index)))
+            if failed_sections:
+                return {
+                    "status": "failed",
+                    "target_tech": target_tech,
+                    "source_tech": source_tech,
+                    "output": output_path,
+                    "error": f"{failed_sections} of {len(sections)} section(s) failed to convert",
+                    "sections": len(sections),
+                    "seconds": round(time.time() - started, 3),
+                }
+
+            return {
+                "status": "done",
+                "target_tech": target_tech,
+                "source_tech": source_tech,
+                "output": output_path,
+                "sections": len(sections),
+                "reused_sections": exact_reused,
+                "near_duplicate_sections": similar_stats["reused"],
+                "revised_sections": similar_stats["revised"],
+                "diagrams": len(diagram_images),
+                "seconds": round(time.time() - started, 3),
+            }
+        except Exception as e:
+            return {
+                "status": "failed",
+                "target_tech": target_tech,
+                "source_tech": source_tech,
+                "error": str(e),
+                "sections": len(sections),
+                "seconds": round(time.time() - started, 3),
+            }
+
+    # Targets share the parsed sections and prepared images and mostly wait on the API
+    with ThreadPoolExecutor(max_workers=max(1, len(target_techs))) as pool:
+        return list(pool.map(convert_target, target_techs))
+
+
+def find_documents(input_dir, exclude_dir=None):
+    """
+    Return every .docx file under input_dir, skipping Word lock files.
+
+    Args:
+        input_dir (str): Folder to search.
+        exclude_dir (str, optional): Folder not to descend into, e.g. an output folder inside input_dir,
+                                     so converted documents are never picked up as new inputs.
+
+    Returns:
+        list of str: Sorted document paths.
+    """
+    excluded = os.path.realpath(exclude_dir) if exclude_dir else None
+    documents = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = [name for name in dirs if os.path.realpath(os.path.join(root, name)) != excluded]
+        for name in sorted(files):
+            if name.lower().endswith(".docx") and not name.startswith("~$"):
+                documents.append(os.path.join(root, name))
+    return sorted(documents)
+
+
+def run_batch(input_dir, target_techs, output_dir, workers=None, include_diagrams=True, section_workers=4,
+              diagram_mode="two_step", ocr_first=False):
+    """
+    Convert every document under input_dir to each target technology, resuming from the manifest.
+
+    Args:
+        input_dir (str): Folder containing source .docx files.
+        target_techs (list of str): Target technologies to produce for each document.
+        output_dir (str): Folder for converted documents and the manifest.
+        workers (int, optional): Number of worker processes. Defaults to the CPU count.
+        include_diagrams (bool): Whether to convert embedded diagrams as well.
+        section_workers (int): Concurrent section conversions per document.
+        diagram_mode (str): "two_step" or "direct" diagram conversion, see convert_diagram.
+        ocr_first (bool): OCR diagrams first and skip the vision call where the text is enough.
+
+    Returns:
+        dict: Throughput summary for this run.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    done = load_manifest(manifest_path)
+    # Outputs written next to their inputs (output_dir == input_dir) must not be converted again
+    outputs = manifest_outputs(manifest_path)
+
+    # Work out which targets are still missing for each document
+    pending = []
+    skipped = 0
+    for docx_path in find_documents(input_dir, exclude_dir=output_dir):
+        if os.path.realpath(docx_path) in outputs:
+            continue
+        sha = file_sha256(docx_path)
+        missing = [t for t in target_techs if (sha, t) not in done]
+        skipped += len(target_techs) - len(missing)
+        if missing:
+            pending.append((docx_path, sha, missing))
+
+    print(f"{len(pending)} document(s) to convert, {skipped} conversion(s) already done.")
+
+    started = time.time()
+    converted_docs = 0
+    converted_sections = 0
+    failures = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(convert_document, docx_path, missing, output_dir, include_diagrams, section_workers,
+                            diagram_mode, ocr_first, input_dir):
+                (docx_path, sha, missing)
+            for docx_path, sha, missing in pending
+        }
+        for future in as_completed(futures):
+            docx_path, sha, missing = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [{"status": "failed", "target_tech": t, "error": str(e), "sections": 0} for t in missing]
+
+            for result in results:
+                append_manifest(manifest_path, {"document": docx_path, "sha256": sha, **result})
+                if result["status"] == "done":
+                    converted_docs += 1
+                    converted_sections += result["sections"]
+                    print(f"✔ {docx_path} -> {result['target_tech']} ({result['seconds']}s)")
+                else:
+                    failures += 1
+                    print(f"✘ {docx_path} -> {result['target_tech']}: {result.get('error')}")
+
+    elapsed = time.time() - started
+    summary = {
+        "documents_converted": converted_docs,
+        "sections_converted": converted_sections,
+        "failures": failures,
+        "skipped": skipped,
+        "seconds": round(elapsed, 2),
+        "docs_per_min": round(converted_docs / elapsed * 60, 2) if elapsed else 0.0,
+        "sections_per_sec": round(converted_sections / elapsed, 2) if elapsed else 0.0,
+    }
+    print(
+        f"\nConverted {converted_docs} document(s) / {converted_sections} section(s) in {summary['seconds']}s "
+        f"— {summary['docs_per_min']} docs/min, {summary['sections_per_sec']} sections/sec, "
+        f"{failures} failure(s), {skipped} skipped."
+    )
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a folder of design documents to other technologies.")
+    parser.add_argument("input_dir", help="Folder containing source .docx design documents")
+    parser.add_argument("--targets", nargs="+", required=True, help="Target technologies, e.g. ServiceNow SAP")
+    parser.add_argument("--output", default="converted", help="Output folder (also holds the resume manifest)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--section-workers", type=int, default=4, help="Concurrent sections per document")
+    parser.add_argument("--no-diagrams", action="store_true", help="Skip diagram extraction and regeneration")
+    parser.add_argument("--diagram-mode", choices=DIAGRAM_MODES, default="two_step",
+                        help="two_step: describe then generate DOT; direct: image to DOT in one call")
+    parser.add_argument("--ocr-first", action="store_true",
+                        help="OCR diagrams first and skip the vision call when their text is enough to redraw them")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(name)s: %(message)s")
+    load_dotenv()
+    if not os.getenv("OPENAI_API_KEY"):
+        print("OPENAI_API_KEY is not set.", file=sys.stderr)
+        return 1
+
+    summary = run_batch(
+        args.input_dir, args.targets, args.output,
+        workers=args.workers,
+        include_diagrams=not args.no_diagrams,
+        section_workers=args.section_workers,
+        diagram_mode=args.diagram_mode,
+        ocr_first=args.ocr_first,
+    )
+    return 1 if summary["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,20 @@
-import pytesseract
-from PIL import Image
-import io
-import uuid
-import graphviz
+import hashlib
+import logging
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from docx import Document
 
+from app.artifact_store import get_artifact_store
+from app.dot_utils import DotSyntaxError, normalize_dot, repair_dot
+from app.metrics import metrics, propagate, span, timed
+from app.model_router import get_router
+from app.ocr import TESSERACT_CONFIG, preprocess_for_ocr
+
+logger = logging.getLogger(__name__)
+
 def extract_images_from_docx(docx_path):
     doc = Document(docx_path)
     images = []
@@ -18,13 +28,32 @@ def extract_images_from_docx(docx_path):
     return images
 
 def extract_text_from_image(image_bytes):
+    # pytesseract is slow to import and only needed here, so it loads on first use
+    import pytesseract
+
     try:
-        img = Image.open(io.BytesIO(image_bytes))
-        return pytesseract.image_to_string(img)
+        return pytesseract.image_to_string(preprocess_for_ocr(image_bytes), config=TESSERACT_CONFIG)
     except Exception as e:
         return f"OCR failed: {e}"
 
-def regenerate_diagram_from_text(text_description, final_target_tech, client):
+@timed("dot.generate")
+def generate_dot_from_text(text_description, final_target_tech, client, route=None):
+    """
+    Ask the model to turn a diagram description into Graphviz DOT source.
+
+    The output is validated and repaired locally; the model is asked again only with
+    the specific parse error if local repair is not enough. DOT that is cut off or cannot
+    be repaired is generated again on the escalated route.
+
+    Args:
+        text_description (str): Prose description of the diagram.
+        final_target_tech (str): Target technology the diagram should be drawn for.
+        client (OpenAI): Initialized OpenAI client instance.
+        route (dict, optional): Model route; by default chosen from the size of the description.
+
+    Returns:
+        str: DOT source, or None if generation failed or the output could not be repaired.
+    """
     prompt = (
         f"The following is a diagram description for a system built using {final_target_tech}:\n\n"
         f"{text_description}\n\n"
@@ -32,42 +61,162 @@ def regenerate_diagram_from_text(text_description, final_target_tech, client):
         f"Do not include any comments, code fences, or explanations. Only return valid DOT."
     )
 
+    router = get_router()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        dot_code, _ = router.complete(
+            client, route or router.route_dot(text_description),
+            validate=lambda text: _repaired_dot(text, client),
             messages=[{"role": "user", "content": prompt}],
             temperature=0.4,
-            max_tokens=400,
         )
-        dot_code = response.choices[0].message.content.strip()
+        return dot_code
+
+    except Exception as e:
+        logger.warning("Diagram generation failed: %s", e)
+        metrics.inc("diagram_failures_total", reason="dot_generation")
+        return None
 
-        # Debugging
-        print("---- DOT CODE GENERATED ----")
-        print(dot_code)
-        print("----------------------------")
+def _repaired_dot(raw_text, client):
+    # Valid DOT, or None so the router escalates
+    try:
+        return repair_dot(raw_text, client)
+    except DotSyntaxError:
+        return None
 
-        # Remove any ```dot or ``` wrappers
-        if dot_code.startswith("```"):
-            lines = dot_code.splitlines()
-            lines = [line for line in lines if not line.strip().startswith("```")]
-            dot_code = "\n".join(lines)
+def clean_dot_code(dot_code):
+    """
+    Validate model output as DOT, applying local repairs only (no API call).
 
-        # Validate DOT
-        if not ("digraph" in dot_code or "graph" in dot_code):
-            raise ValueError("Invalid DOT format: missing 'graph' or 'digraph' keyword.")
+    Args:
+        dot_code (str): Raw DOT text returned by the model.
 
-        return render_dot_to_image(dot_code)
+    Returns:
+        str: The normalized DOT source.
 
-    except Exception as e:
-        print(f"Diagram generation failed: {e}")
+    Raises:
+        DotSyntaxError: If the text is not repairable DOT (a ValueError subclass).
+    """
+    return normalize_dot(dot_code)[0]
+
+def regenerate_diagram_from_text(text_description, final_target_tech, client, output_format="png"):
+    """
+    Generate DOT source for a diagram description and render it in memory.
+
+    Returns:
+        bytes: Rendered image bytes, or None if generation or rendering failed.
+    """
+    dot_code = generate_dot_from_text(text_description, final_target_tech, client)
+    if dot_code is None:
         return None
+    return render_dot_bytes(dot_code, output_format=output_format)
+
+# Rendered images keyed by a hash of (engine, format, DOT source); oldest entries are evicted first
+_render_cache = OrderedDict()
+_render_cache_bytes = 0
+_render_cache_lock = threading.Lock()
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def _render_cache_key(dot_code, output_format, engine):
+    return hashlib.sha256(f"{engine}\0{output_format}\0{dot_code}".encode("utf-8")).hexdigest()
+
+def _cache_rendered(key, image_bytes):
+    global _render_cache_bytes
+    with _render_cache_lock:
+        if key in _render_cache:
+            return
+        _render_cache[key] = image_bytes
+        _render_cache_bytes += len(image_bytes)
+        while _render_cache_bytes > RENDER_CACHE_MAX_BYTES and len(_render_cache) > 1:
+            _, evicted = _render_cache.popitem(last=False)
+            _render_cache_bytes -= len(evicted)
+
+def render_dot_bytes(dot_code, output_format="png", engine="dot", timeout=20):
+    """
+    Render DOT source to image bytes by piping it through Graphviz, without touching disk.
+
+    Results are cached in memory by DOT content hash, so repeated diagrams are instant.
+
+    Args:
+        dot_code (str): Graphviz DOT source.
+        output_format (str): Graphviz output format, e.g. "png" or "svg".
+        engine (str): Graphviz layout engine executable.
+        timeout (float): Seconds before a render is killed.
+
+    Returns:
+        bytes: Rendered image, or None if rendering failed or timed out.
+    """
+    key = _render_cache_key(dot_code, output_format, engine)
+    with _render_cache_lock:
+        if key in _render_cache:
+            _render_cache.move_to_end(key)
+            metrics.record_cache("render", True)
+            return _render_cache[key]
+    metrics.record_cache("render", False)
 
-def render_dot_to_image(dot_code):
     try:
-        dot = graphviz.Source(dot_code)
-        filename = f"generated_diagram_{uuid.uuid4().hex[:8]}"
-        output_path = dot.render(filename, format="png", cleanup=True)
-        return output_path
+        with span("dot.render", engine=engine, format=output_format):
+            result = subprocess.run(
+                [engine, f"-T{output_format}"],
+                input=dot_code.encode("utf-8"),
+                capture_output=True,
+                timeout=timeout,
+                check=True,
+            )
+    except subprocess.TimeoutExpired:
+        logger.warning("Graphviz rendering timed out after %ss", timeout)
+        metrics.inc("render_failures_total", engine=engine, reason="timeout")
+        return None
+    except subprocess.CalledProcessError as e:
+        logger.warning("Graphviz rendering failed: %s", e.stderr.decode("utf-8", errors="replace").strip())
+        metrics.inc("render_failures_total", engine=engine, reason="invalid_dot")
+        return None
     except Exception as e:
-        print(f"Graphviz rendering failed: {e}")
-        return None
\ No newline at end of file
+        logger.warning("Graphviz rendering failed: %s", e)
+        metrics.inc("render_failures_total", engine=engine, reason="error")
+        return None
+
+    _cache_rendered(key, result.stdout)
+    return result.stdout
+
+def render_many(dot_codes, output_format="png", engine="dot", timeout=20, max_workers=4):
+    """
+    Render several DOT sources in parallel.
+
+    Every render runs in its own Graphviz process; a small thread pool only waits on them,
+    so renders proceed in parallel across processes. Identical sources are rendered once.
+
+    Args:
+        dot_codes (list of str): DOT sources; None entries are skipped.
+        output_format (str): Graphviz output format.
+        engine (str): Graphviz layout engine executable.
+        timeout (float): Seconds before each render is killed.
+        max_workers (int): Maximum number of concurrent Graphviz processes.
+
+    Returns:
+        list: Image bytes (or None on failure) for each input, in the same order.
+    """
+    unique_codes = list(dict.fromkeys(code for code in dot_codes if code))
+    if not unique_codes:
+        return [None] * len(dot_codes)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(unique_codes)))) as executor:
+        rendered = dict(zip(
+            unique_codes,
+            executor.map(propagate(lambda code: render_dot_bytes(code, output_format, engine, timeout)), unique_codes),
+        ))
+    return [rendered.get(code) if code else None for code in dot_codes]
+
+def render_dot_to_image(dot_code):
+    """
+    Render DOT source to a PNG file and return its path.
+
+    Kept for callers that need a file. The image is kept in the artifact store by content
+    hash, so repeated renders share one file and old ones expire with the store's TTL.
+    Prefer render_dot_bytes.
+    """
+    image_bytes = render_dot_bytes(dot_code)
+    if image_bytes is None:
+        return None
+    store = get_artifact_store()
+    digest = store.put(image_bytes, "renders", f"{hashlib.sha256(image_bytes).hexdigest()}.png")
+    return store.blob_path(digest)
@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import threading
+import time
+
+from app.image_utils import hamming_distance
+
+DEFAULT_INDEX_PATH = os.path.join(".cache", "diagram_index.sqlite")
+
+
+class DiagramIndex:
+    """
+    Persistent index of diagrams that were already converted.
+
+    Each entry stores the diagram description and DOT source produced for one source and
+    target technology and conversion mode, keyed by the SHA-256 of the image bytes, so an
+    identical diagram in any later document can reuse them instead of calling the vision
+    model again. A diagram that only matches by perceptual hash (the same picture resized
+    or re-encoded) is checked by its OCR labels: diagrams drawn from one template share
+    their layout but not their component names. When both it and the stored entry have
+    labels, they must be identical and the hashes within max_distance. When either has
+    none (Tesseract is missing or the image has no readable text), only hashes within
+    unlabelled_distance match, which re-encoding noise stays inside but a changed box
+    label usually does not. Modes are kept apart so their output quality can be compared,
+    and DOT redrawn from OCR text is never served to a run that asked for a vision
+    conversion.
+
+    Args:
+        path (str): Path to the SQLite file. Parent folders are created if missing.
+        max_distance (int): Largest Hamming distance between perceptual hashes for a near match
+                            confirmed by labels.
+        unlabelled_distance (int): Largest Hamming distance for a near match without labels to compare.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, max_distance=6, unlabelled_distance=2):
+        self.path = path
+        self.max_distance = max_distance
+        self.unlabelled_distance = unlabelled_distance
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            # Entries of the earlier layout were keyed by perceptual hash alone and cannot be trusted
+            self._conn.execute("DROP TABLE IF EXISTS diagram_conversions")
+            # Hashes are stored as hex text because SQLite integers are signed 64-bit
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS diagram_results ("
+                "content_hash TEXT NOT NULL, source_tech TEXT NOT NULL, target_tech TEXT NOT NULL, "
+                "mode TEXT NOT NULL, phash TEXT NOT NULL, labels TEXT, description TEXT, "
+                "dot_code TEXT NOT NULL, created REAL NOT NULL, "
+                "PRIMARY KEY (content_hash, source_tech, target_tech, mode))"
+            )
+            self._conn.commit()
+
+    def lookup(self, content_hash, phash, source_tech, target_tech, mode="two_step", labels=None,
+               read_labels=None):
+        """
+        Find a stored conversion of the same diagram.
+
+        Args:
+            content_hash (str): Hex SHA-256 of the image bytes.
+            phash (int): Perceptual hash of the image.
+            source_tech (str): Source technology of the document.
+            target_tech (str): Target technology the diagram is being converted to.
+            mode (str): Conversion mode ("two_step", "direct" or "ocr") the result must come from.
+            labels (set of str, optional): OCR labels of the image, if already read.
+            read_labels (callable, optional): Returns the OCR labels when called; only used when
+                                              labels is None and a near match has labels to compare.
+
+        Returns:
+            dict or None: {"description", "dot_code", "distance", "exact"} for an identical image, or
+                          for the closest near match (see the class description); None if there is neither.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT description, dot_code FROM diagram_results "
+                "WHERE content_hash = ? AND source_tech = ? AND target_tech = ? AND mode = ?",
+                (content_hash, source_tech, target_tech, mode),
+            ).fetchone()
+            rows = [] if row else self._conn.execute(
+                "SELECT phash, labels, description, dot_code FROM diagram_results "
+                "WHERE source_tech = ? AND target_tech = ? AND mode = ?",
+                (source_tech, target_tech, mode),
+            ).fetchall()
+
+        best = None
+        if row:
+            best = {"description": row[0], "dot_code": row[1], "distance": 0, "exact": True}
+        else:
+            near = sorted(
+                (distance, stored_labels, description, dot_code)
+                for distance, stored_labels, description, dot_code in (
+                    (hamming_distance(phash, int(stored_hash, 16)), stored_labels, description, dot_code)
+                    for stored_hash, stored_labels, description, dot_code in rows
+                )
+                if distance <= self.max_distance
+            )
+            if labels is None and read_labels is not None and any(stored for _, stored, _, _ in near):
+                # OCR only runs when there is a labelled near match to compare with
+                labels = read_labels()
+            key = _labels_key(labels) if labels else None
+            for distance, stored_labels, description, dot_code in near:
+                if key and stored_labels:
+                    matched = stored_labels == key
+                else:
+                    matched = distance <= self.unlabelled_distance
+                if matched:
+                    best = {"description": description, "dot_code": dot_code, "distance": distance, "exact": False}
+                    break
+
+        with self._lock:
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return best
+
+    def add(self, content_hash, phash, source_tech, target_tech, description, dot_code, mode="two_step",
+            labels=None):
+        """
+        Store the conversion result for a diagram.
+
+        Args:
+            content_hash (str): Hex SHA-256 of the image bytes.
+            phash (int): Perceptual hash of the image.
+            source_tech (str): Source technology of the document.
+            target_tech (str): Target technology the diagram was converted to.
+            description (str): Description returned by the vision model.
+            dot_code (str): Generated Graphviz DOT source.
+            mode (str): Conversion mode ("two_step", "direct" or "ocr") that produced the result.
+            labels (set of str, optional): OCR labels of the image. Without them a near match
+                                           needs a hash within unlabelled_distance.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO diagram_results "
+                "(content_hash, source_tech, target_tech, mode, phash, labels, description, dot_code, created) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (content_hash, source_tech, target_tech, mode, format(phash, "x"),
+                 _labels_key(labels) if labels else None, description, dot_code, time.time()),
+            )
+            self._conn.commit()
+
+
+def _labels_key(labels):
+    # Order-independent text form of a label set, compared for equality
+    return "\n".join(sorted(labels))
@@ -0,0 +1,261 @@
+import hashlib
+import logging
+
+from app.diagram_handler import generate_dot_from_text, render_many
+from app.dot_utils import repair_dot
+from app.image_utils import (
+    analyze_and_convert_diagram,
+    convert_diagram_to_dot,
+    diagram_complexity,
+    is_decorative_image,
+    perceptual_hash,
+    prepare_image_payload,
+)
+from app.metrics import metrics, timed
+from app.model_router import get_router
+from app.ocr import diagram_labels, is_rich_ocr_text, ocr_diagram_stats, ocr_image, ocr_images
+
+logger = logging.getLogger(__name__)
+
+
+DIAGRAM_MODES = ("two_step", "direct")
+
+
+def _convert_two_step(image_bytes, source_tech, target_tech, client, image_payload, route):
+    # Vision call for a prose description, then a text call that turns it into DOT
+    description = analyze_and_convert_diagram(
+        image_bytes, source_tech, target_tech, client, image_payload=image_payload, route=route
+    )
+    if not description:
+        # Nothing to draw from: an empty description would only produce a made-up diagram
+        metrics.inc("diagram_failures_total", reason="empty_description")
+        return None, None
+    return description, generate_dot_from_text(description, target_tech, client)
+
+
+def _convert_from_ocr(ocr_text, source_tech, target_tech, client):
+    # Text-only path: the labels read locally stand in for the vision model's description
+    lines = [line.strip() for line in ocr_text.splitlines() if line.strip()]
+    description = (
+        f"A {source_tech} diagram. Its boxes, labels and connectors, as read from the image "
+        f"line by line:\n" + "\n".join(lines)
+    )
+    return description, generate_dot_from_text(description, target_tech, client)
+
+
+def _convert_direct(image_bytes, source_tech, target_tech, client, image_payload, route):
+    # One vision call returning structured description + DOT; None if the DOT cannot be repaired
+    try:
+        result = convert_diagram_to_dot(image_bytes, source_tech, target_tech, client, image_payload=image_payload,
+                                        route=route)
+        return result["description"], repair_dot(result["dot"], client)
+    except Exception as e:
+        logger.warning("Direct diagram conversion failed, falling back to two-step: %s", e)
+        metrics.record_retry("diagram_two_step_fallback")
+        return None, None
+
+
+@timed("diagram.convert")
+def convert_diagram(image_bytes, source_tech, target_tech, client, index=None, mode="two_step", phash=None,
+                    image_payload=None, ocr_text=None):
+    """
+    Convert one diagram image into target-technology DOT source, reusing prior work when possible.
+
+    Args:
+        image_bytes (bytes): Image data in bytes.
+        source_tech (str): Source technology name.
+        target_tech (str): Target technology name.
+        client (OpenAI): Initialized OpenAI client instance.
+        index (DiagramIndex, optional): Index of earlier conversions.
+        mode (str): "two_step" (describe, then generate DOT) or "direct" (image to DOT in
+                    one structured call, falling back to two_step if the DOT fails validation).
+        phash (int, optional): Perceptual hash of the image, if already computed.
+        image_payload (dict, optional): Result of prepare_image_payload, if already computed.
+        ocr_text (str, optional): OCR text of the image. When it names enough boxes to redraw the
+                                  diagram, DOT is generated from it and the vision call is skipped.
+
+    Returns:
+        dict: {"description", "dot_code", "reused", "payload_stats", "mode"}; dot_code is None if
+              generation failed, payload_stats (see prepare_image_payload) is None when nothing
+              was sent, and mode is the path that actually produced the result ("ocr" when
+              the vision call was skipped).
+    """
+    if mode not in DIAGRAM_MODES:
+        raise ValueError(f"Unknown diagram mode: {mode}")
+
+    if phash is None:
+        phash = perceptual_hash(image_bytes)
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    # Labels confirm a near perceptual-hash match. Without OCR up front, the image is read only when a
+    # labelled near match needs comparing or when its result is stored; the read is done at most once
+    labels = diagram_labels(ocr_text) if ocr_text is not None else None
+    read = {}
+
+    def read_labels():
+        if "labels" not in read:
+            read["labels"] = diagram_labels(ocr_image(image_bytes))
+        return read["labels"]
+
+    def lookup(lookup_mode):
+        return index.lookup(content_hash, phash, source_tech, target_tech, mode=lookup_mode, labels=labels,
+                            read_labels=read_labels)
+
+    def store(description, dot_code, store_mode):
+        index.add(content_hash, phash, source_tech, target_tech, description, dot_code, mode=store_mode,
+                  labels=labels if labels is not None else read_labels())
+
+    if index is not None:
+        match = lookup(mode)
+        metrics.record_cache("diagram_index", bool(match))
+        if match:
+            return {"description": match["description"], "dot_code": match["dot_code"], "reused": True,
+                    "payload_stats": None, "mode": mode}
+
+    if ocr_text and is_rich_ocr_text(ocr_text):
+        # OCR-built DOT is filed under its own mode, so runs without OCR never get it as a vision result
+        if index is not None:
+            match = lookup("ocr")
+            metrics.record_cache("diagram_index", bool(match))
+            if match:
+                return {"description": match["description"], "dot_code": match["dot_code"], "reused": True,
+                        "payload_stats": None, "mode": "ocr"}
+        description, dot_code = _convert_from_ocr(ocr_text, source_tech, target_tech, client)
+        metrics.inc("diagram_ocr_total", result="used" if dot_code else "fallback")
+        if dot_code:
+            if index is not None:
+                store(description, dot_code, "ocr")
+            return {"description": description, "dot_code": dot_code, "reused": False,
+                    "payload_stats": None, "mode": "ocr"}
+    elif ocr_text is not None:
+        metrics.inc("diagram_ocr_total", result="too_sparse")
+
+    if image_payload is None:
+        image_payload = prepare_image_payload(image_bytes)
+    # Model and detail level follow how busy the diagram is; OCR labels, when read, refine that
+    complexity = diagram_complexity(image_bytes)
+    if ocr_text:
+        complexity["labels"] = ocr_diagram_stats(ocr_text)["labels"]
+    router = get_router()
+    used_mode = mode
+    description, dot_code = None, None
+    if mode == "direct":
+        route = router.route_diagram(complexity, image_payload, direct=True)
+        description, dot_code = _convert_direct(image_bytes, source_tech, target_tech, client, image_payload, route)
+    if dot_code is None:
+        used_mode = "two_step"
+        route = router.route_diagram(complexity, image_payload)
+        description, dot_code = _convert_two_step(image_bytes, source_tech, target_tech, client, image_payload,
+                                                  route)
+
+    if dot_code and index is not None:
+        # Filed under the path that produced it: a two-step fallback is never served as a direct result
+        store(description, dot_code, used_mode)
+    return {"description": description, "dot_code": dot_code, "reused": False,
+            "payload_stats": image_payload["stats"], "mode": used_mode}
+
+
+def prepare_images(images, with_payload=False, ocr=False):
+    """
+    Do the target-independent work for extracted images once.
+
+    Decorative images are flagged and diagrams get their perceptual hash and, optionally,
+    their OCR text and vision payload, so converting to several targets never repeats it.
+
+    Args:
+        images (list of tuple): (image_bytes, image_name) pairs from extract_images_from_docx.
+        with_payload (bool): Also prepare the vision payload of every diagram that needs one.
+        ocr (bool): OCR every diagram in parallel worker processes.
+
+    Returns:
+        list of dict: One entry per image with "name", "image", "decorative", "phash", "payload" and
+                      "ocr_text" (None when not prepared, "" when OCR found nothing); accepted by
+                      convert_diagrams in place of the tuples.
+    """
+    prepared = []
+    for image_bytes, image_name in images:
+        decorative = is_decorative_image(image_bytes)
+        prepared.append({
+            "name": image_name,
+            "image": image_bytes,
+            "decorative": decorative,
+            "phash": None if decorative else perceptual_hash(image_bytes),
+            "payload": None,
+            "ocr_text": None,
+        })
+    if ocr:
+        _add_ocr_text(prepared)
+    if with_payload:
+        for item in prepared:
+            # Diagrams that OCR alone can redraw never reach the vision API
+            if not item["decorative"] and not (item["ocr_text"] and is_rich_ocr_text(item["ocr_text"])):
+                item["payload"] = prepare_image_payload(item["image"])
+    return prepared
+
+
+def _add_ocr_text(prepared):
+    todo = [item for item in prepared if not item["decorative"] and item["ocr_text"] is None]
+    for item, text in zip(todo, ocr_images([item["image"] for item in todo])):
+        item["ocr_text"] = text or ""
+
+
+def convert_diagrams(images, source_tech, target_tech, client, index=None, on_diagram=None, render_workers=4,
+                     mode="two_step", ocr_first=False):
+    """
+    Convert every diagram extracted from a document and render the results in memory.
+
+    Decorative images (logos, icons, separators) are skipped without any API call, and
+    diagrams already seen in this or an earlier document reuse the stored conversion.
+    Once all DOT sources are known they are rendered in parallel.
+
+    Args:
+        images (list): (image_bytes, image_name) pairs from extract_images_from_docx, or the
+                       output of prepare_images to reuse work shared between targets.
+        source_tech (str): Source technology name.
+        target_tech (str): Target technology name.
+        client (OpenAI): Initialized OpenAI client instance.
+        index (DiagramIndex, optional): Index of earlier conversions shared across documents.
+        on_diagram (callable, optional): Called with each result dict once it is rendered.
+        render_workers (int): Maximum number of concurrent Graphviz renders.
+        mode (str): Diagram conversion mode for every image, see convert_diagram.
+        ocr_first (bool): OCR the diagrams first and skip the vision call for those whose text
+                          is enough to redraw them; otherwise every diagram goes to the vision model.
+
+    Returns:
+        list of dict: One result per image with keys "name", "status" ("converted", "reused",
+                      "skipped" or "failed"), "description", "dot_code", "payload_stats", "mode"
+                      and "image" (rendered PNG bytes or None).
+    """
+    if images and not isinstance(images[0], dict):
+        images = prepare_images(images, ocr=ocr_first)
+    elif ocr_first:
+        _add_ocr_text(images)
+
+    results = []
+    for item in images:
+        result = {"name": item["name"], "status": "skipped", "description": None,
+                  "dot_code": None, "payload_stats": None, "mode": None, "image": None}
+
+        if not item["decorative"]:
+            try:
+                converted = convert_diagram(item["image"], source_tech, target_tech, client, index=index, mode=mode,
+                                            phash=item["phash"], image_payload=item["payload"],
+                                            ocr_text=item["ocr_text"] if ocr_first else None)
+                result["description"] = converted["description"]
+                result["dot_code"] = converted["dot_code"]
+                result["payload_stats"] = converted["payload_stats"]
+                result["mode"] = converted["mode"]
+                result["status"] = "reused" if converted["reused"] else "converted"
+            except Exception as e:
+                result["status"] = "failed"
+                result["description"] = f"Diagram conversion failed: {e}"
+
+        results.append(result)
+
+    rendered = render_many([r["dot_code"] for r in results], max_workers=render_workers)
+    for result, image in zip(results, rendered):
+        result["image"] = image
+        if result["status"] in ("converted", "reused") and image is None:
+            result["status"] = "failed"
+        if on_diagram:
+            on_diagram(result)
+    return results
@@ -0,0 +1,580 @@
+"""
+Local validation and repair of Graphviz DOT produced by the model.
+
+normalize_dot fixes the usual defects of model output without any API call: code
+fences and surrounding prose, unbalanced braces, unquoted labels and multi-word node
+names, edge operators that do not match the graph type and repeated node
+declarations. The result is checked by a small DOT parser; only when that still fails
+does repair_dot go back to the model, sending just the DOT and the parse error.
+"""
+import re
+
+from app.metrics import metrics
+from app.model_router import get_router
+
+EDGE_OPS = ("->", "--")
+_KEYWORDS = {"strict", "graph", "digraph", "subgraph", "node", "edge"}
+_ID_RE = re.compile(r"[^\W\d]\w*")
+_NUMERAL_RE = re.compile(r"-?(?:\.\d+|\d+(?:\.\d*)?)")
+_PLAIN_ID_RE = re.compile(r"^(?:[^\W\d]\w*|-?(?:\.\d+|\d+(?:\.\d*)?))$")
+_GRAPH_START_RE = re.compile(r"(?:\bstrict\s+)?\b(?:di)?graph\b[^{;\n]*\{", re.IGNORECASE)
+_FENCE_RE = re.compile(r"```[^\n]*\n(.*?)(?:```|$)", re.DOTALL)
+_EDGE_SPLIT_RE = re.compile(r"\s*(->|--)\s*")
+_DOT_PUNCTUATION = set("{}[];=\"<>") | {"->", "--"}
+
+
+class DotSyntaxError(ValueError):
+    """
+    Raised when DOT source cannot be parsed.
+
+    Attributes:
+        reason (str): The error without its line prefix.
+        line (int or None): 1-based line of the error, if known.
+        dot (str or None): The (locally repaired) DOT source that failed to parse.
+    """
+
+    def __init__(self, message, line=None, dot=None):
+        super().__init__(f"line {line}: {message}" if line else message)
+        self.reason = message
+        self.line = line
+        self.dot = dot
+
+
+def _tokenize(text):
+    # Tokens are (kind, text, line) with kind "id", "edgeop" or the punctuation character itself
+    tokens = []
+    i, line, length = 0, 1, len(text)
+    while i < length:
+        ch = text[i]
+        if ch == "\n":
+            line += 1
+            i += 1
+        elif ch.isspace():
+            i += 1
+        elif text.startswith("//", i) or (ch == "#" and (i == 0 or text[i - 1] == "\n")):
+            end = text.find("\n", i)
+            i = length if end < 0 else end
+        elif text.startswith("/*", i):
+            end = text.find("*/", i + 2)
+            if end < 0:
+                raise DotSyntaxError("unterminated comment", line)
+            line += text.count("\n", i, end)
+            i = end + 2
+        elif ch == '"':
+            j = i + 1
+            while j < length and text[j] != '"':
+                j += 2 if text[j] == "\\" else 1
+            if j >= length:
+                raise DotSyntaxError("unterminated string", line)
+            tokens.append(("id", text[i:j + 1], line))
+            line += text.count("\n", i, j)
+            i = j + 1
+        elif ch == "<":
+            depth, j = 0, i
+            while j < length:
+                depth += {"<": 1, ">": -1}.get(text[j], 0)
+                if depth == 0:
+                    break
+                j += 1
+            if j >= length:
+                raise DotSyntaxError("unterminated HTML label", line)
+            tokens.append(("id", text[i:j + 1], line))
+            line += text.count("\n", i, j)
+            i = j + 1
+        elif text.startswith(EDGE_OPS, i):
+            tokens.append(("edgeop", text[i:i + 2], line))
+            i += 2
+        elif ch in "{}[];,=:+":
+            tokens.append((ch, ch, line))
+            i += 1
+        else:
+            match = _NUMERAL_RE.match(text, i) or _ID_RE.match(text, i)
+            if not match:
+                raise DotSyntaxError(f"unexpected character {ch!r}", line)
+            tokens.append(("id", match.group(0), line))
+            i = match.end()
+    return tokens
+
+
+class _Parser:
+    # Recursive-descent parser for the DOT grammar; builds a small statement tree
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else ("eof", "end of input", None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def error(self, expected):
+        kind, text, line = self.peek()
+        if line is None and self.tokens:
+            line = self.tokens[-1][2]
+        raise DotSyntaxError(f"expected {expected} but found {text!r}", line)
+
+    def expect(self, kind):
+        if self.peek()[0] != kind:
+            self.error(repr(kind))
+        return self.next()
+
+    def is_keyword(self, word, offset=0):
+        kind, text, _ = self.peek(offset)
+        return kind == "id" and text.lower() == word
+
+    def identifier(self):
+        if self.peek()[0] != "id" or self.peek()[1].lower() in _KEYWORDS:
+            self.error("an identifier")
+        text = self.next()[1]
+        # "a" + "b" concatenates quoted strings
+        while self.peek()[0] == "+" and text.startswith('"') and self.peek(1)[1].startswith('"'):
+            self.next()
+            text = text[:-1] + self.next()[1][1:]
+        return text
+
+    def graph(self):
+        graph = {"strict": False, "directed": False, "id": None}
+        if self.is_keyword("strict"):
+            self.next()
+            graph["strict"] = True
+        if self.is_keyword("digraph"):
+            graph["directed"] = True
+        elif not self.is_keyword("graph"):
+            self.error("'graph' or 'digraph'")
+        self.next()
+        if self.peek()[0] == "id":
+            graph["id"] = self.identifier()
+        graph["stmts"] = self.block()
+        if self.peek()[0] != "eof":
+            self.error("end of input")
+        return graph
+
+    def block(self):
+        self.expect("{")
+        stmts = []
+        while self.peek()[0] != "}":
+            if self.peek()[0] == "eof":
+                self.error("'}'")
+            stmts.append(self.statement())
+            while self.peek()[0] in (";", ","):
+                self.next()
+        self.next()
+        return stmts
+
+    def attr_list(self):
+        attrs = []
+        while self.peek()[0] == "[":
+            self.next()
+            while self.peek()[0] != "]":
+                key = self.identifier()
+                value = None
+                if self.peek()[0] == "=":
+                    self.next()
+                    value = self.identifier()
+                attrs.append((key, value))
+                while self.peek()[0] in (";", ","):
+                    self.next()
+            self.next()
+        return attrs
+
+    def subgraph(self):
+        name = None
+        if self.is_keyword("subgraph"):
+            self.next()
+            if self.peek()[0] == "id":
+                name = self.identifier()
+        return {"kind": "subgraph", "id": name, "stmts": self.block()}
+
+    def node_id(self):
+        text = self.identifier()
+        while self.peek()[0] == ":":
+            self.next()
+            text += ":" + self.identifier()
+        return text
+
+    def statement(self):
+        kind, text, _ = self.peek()
+        if kind == "id" and text.lower() in ("graph", "node", "edge"):
+            self.next()
+            return {"kind": "attr", "target": text.lower(), "attrs": self.attr_list()}
+        if kind == "id" and text.lower() not in _KEYWORDS and self.peek(1)[0] == "=":
+            key = self.identifier()
+            self.next()
+            return {"kind": "assign", "key": key, "value": self.identifier()}
+
+        if kind == "{" or self.is_keyword("subgraph"):
+            first = self.subgraph()
+        else:
+            first = self.node_id()
+        endpoints = [first]
+        while self.peek()[0] == "edgeop":
+            self.next()
+            endpoints.append(self.subgraph() if self.peek()[0] == "{" or self.is_keyword("subgraph")
+                             else self.node_id())
+        if len(endpoints) > 1:
+            return {"kind": "edge", "endpoints": endpoints, "attrs": self.attr_list()}
+        if isinstance(first, dict):
+            return first
+        return {"kind": "node", "id": first, "attrs": self.attr_list()}
+
+
+def parse_dot(dot_code):
+    """
+    Parse DOT source into a statement tree.
+
+    Args:
+        dot_code (str): Graphviz DOT source.
+
+    Returns:
+        dict: {"strict", "directed", "id", "stmts"}; statements are dicts with a "kind" of
+              "attr", "assign", "node", "edge" or "subgraph".
+
+    Raises:
+        DotSyntaxError: If the source is not valid DOT.
+    """
+    return _Parser(_tokenize(dot_code)).graph()
+
+
+def _format_attrs(attrs):
+    if not attrs:
+        return ""
+    return " [" + ", ".join(key if value is None else f"{key}={value}" for key, value in attrs) + "]"
+
+
+def _format_statements(stmts, edge_op, indent):
+    lines = []
+    pad = "    " * indent
+    for stmt in stmts:
+        kind = stmt["kind"]
+        if kind == "attr":
+            lines.append(f"{pad}{stmt['target']}{_format_attrs(stmt['attrs'])};")
+        elif kind == "assign":
+            lines.append(f"{pad}{stmt['key']}={stmt['value']};")
+        elif kind == "node":
+            lines.append(f"{pad}{stmt['id']}{_format_attrs(stmt['attrs'])};")
+        elif kind == "subgraph":
+            lines.extend(_format_subgraph(stmt, edge_op, indent))
+        else:
+            parts = []
+            for endpoint in stmt["endpoints"]:
+                if isinstance(endpoint, dict):
+                    body = " ".join(line.strip() for line in _format_statements(endpoint["stmts"], edge_op, 0))
+                    head = f"subgraph {endpoint['id']} " if endpoint["id"] else ""
+                    parts.append(f"{head}{{ {body} }}")
+                else:
+                    parts.append(endpoint)
+            lines.append(f"{pad}{f' {edge_op} '.join(parts)}{_format_attrs(stmt['attrs'])};")
+    return lines
+
+
+def _format_subgraph(stmt, edge_op, indent):
+    pad = "    " * indent
+    head = f"subgraph {stmt['id']} " if stmt["id"] else ""
+    return [f"{pad}{head}{{", *_format_statements(stmt["stmts"], edge_op, indent + 1), f"{pad}}}"]
+
+
+def serialize_dot(graph):
+    """
+    Write a statement tree from parse_dot back out as DOT source.
+
+    Edge operators always match the graph type, whatever the original source used.
+
+    Args:
+        graph (dict): Parsed graph.
+
+    Returns:
+        str: DOT source.
+    """
+    head = ("strict " if graph["strict"] else "") + ("digraph" if graph["directed"] else "graph")
+    if graph["id"]:
+        head += f" {graph['id']}"
+    edge_op = "->" if graph["directed"] else "--"
+    return "\n".join([f"{head} {{", *_format_statements(graph["stmts"], edge_op, 1), "}"]) + "\n"
+
+
+def _dedupe_nodes(stmts):
+    # Repeated declarations of a node within one scope are merged into the first one
+    first_declaration = {}
+    result = []
+    for stmt in stmts:
+        if stmt["kind"] == "subgraph":
+            stmt["stmts"] = _dedupe_nodes(stmt["stmts"])
+        elif stmt["kind"] == "node":
+            key = stmt["id"].strip('"')
+            if key in first_declaration:
+                merged = dict(first_declaration[key]["attrs"])
+                merged.update(stmt["attrs"])
+                first_declaration[key]["attrs"] = list(merged.items())
+                continue
+            first_declaration[key] = stmt
+        result.append(stmt)
+    return result
+
+
+def _quote(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] == "'":
+        text = text[1:-1]
+    return '"' + re.sub(r'(?<!\\)"', r'\"', text) + '"'
+
+
+def _split_outside_quotes(text, separators):
+    # Split on any of the separator characters outside quoted strings and HTML labels
+    parts, current, quoted, depth = [], [], False, 0
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quoted:
+            current.append(ch)
+            if ch == "\\" and i + 1 < len(text):
+                current.append(text[i + 1])
+                i += 1
+            elif ch == '"':
+                quoted = False
+        elif ch == '"':
+            quoted = True
+            current.append(ch)
+        elif ch == "<":
+            depth += 1
+            current.append(ch)
+        elif ch == ">" and depth and (i == 0 or text[i - 1] != "-"):
+            depth -= 1
+            current.append(ch)
+        elif ch in separators and not depth:
+            parts.append("".join(current))
+            parts.append(ch)
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    parts.append("".join(current))
+    return parts
+
+
+def _extract_graph(text, fixes):
+    # Keep only the graph: drop fences and prose around it, balance its braces
+    fenced = [block for block in _FENCE_RE.findall(text) if _GRAPH_START_RE.search(block)]
+    if fenced:
+        text = fenced[0]
+        fixes.append("removed code fences")
+
+    start = _GRAPH_START_RE.search(text)
+    if not start:
+        raise DotSyntaxError("no 'graph' or 'digraph' declaration found", dot=text)
+    if text[:start.start()].strip():
+        fixes.append("removed text before the graph")
+
+    parts = _split_outside_quotes(text[start.start():], "{}")
+    kept, depth, end = [], 0, None
+    for index, part in enumerate(parts):
+        if part == "{":
+            depth += 1
+        elif part == "}":
+            if depth == 1 and "}" in parts[index + 1:]:
+                # Closing the graph early while more statements follow: a stray brace
+                fixes.append("removed an unmatched '}'")
+                continue
+            depth -= 1
+            if depth == 0:
+                kept.append(part)
+                end = index
+                break
+        kept.append(part)
+
+    trailing = "".join(parts[end + 1:]).strip() if end is not None else ""
+    if trailing:
+        fixes.append("removed text after the graph")
+    if depth > 0:
+        kept.append("\n" + "}" * depth)
+        fixes.append(f"added {depth} missing '}}'")
+    return "".join(kept)
+
+
+def _is_prose_line(line):
+    stripped = line.strip()
+    if not stripped or stripped.startswith(("//", "/*", "*", "#")):
+        return False
+    if any(p in stripped for p in _DOT_PUNCTUATION):
+        return False
+    words = stripped.split()
+    if len(words) < 2:
+        return False
+    if stripped.endswith((".", ":", "!", "?")):
+        return True
+    # A run of bare IDs ("a b c d e") is a valid statement list; prose has words DOT cannot parse
+    return len(words) >= 5 and any(not _PLAIN_ID_RE.match(word) for word in words)
+
+
+def _quote_attribute_values(text, fixes):
+    # Quote unquoted attribute values such as label=Order Service (v2)
+    result, position = [], 0
+    for segment in re.finditer(r"\[([^\[\]]*)\]", text):
+        inner = segment.group(1)
+        if '"' in inner and inner.count('"') % 2:
+            continue
+        items = []
+        for part in _split_outside_quotes(inner, ",;"):
+            if part in (",", ";"):
+                continue
+            if "=" not in part and items and part.strip() and "=" in items[-1]:
+                # A comma inside an unquoted value split it in two
+                items[-1] += "," + part
+            elif part.strip():
+                items.append(part)
+        rewritten = []
+        for item in items:
+            key, sep, value = item.partition("=")
+            value = value.strip()
+            if sep and value and value[0] not in '"<' and (not _PLAIN_ID_RE.match(value)
+                                                          or value.lower() in _KEYWORDS):
+                rewritten.append(f"{key.strip()}={_quote(value)}")
+                fixes.append(f"quoted attribute value {value!r}")
+            else:
+                rewritten.append(item.strip() if not sep else f"{key.strip()}={value}")
+        result.append(text[position:segment.start()] + "[" + ", ".join(rewritten) + "]")
+        position = segment.end()
+    result.append(text[position:])
+    return "".join(result)
+
+
+def _quote_node_names(text, fixes):
+    # Quote multi-word or punctuated node names in node and edge statements
+    lines = []
+    for line in text.split("\n"):
+        if "{" in line or "}" in line:
+            lines.append(line)
+            continue
+        statements = []
+        for part in _split_outside_quotes(line, ";"):
+            if part == ";":
+                statements.append(part)
+                continue
+            head, bracket, attrs = part.partition("[")
+            if (not head.strip() or "=" in head or head.split()[0].lower() in _KEYWORDS
+                    or any(ch in _EDGE_SPLIT_RE.sub(" ", head) for ch in "],<>")):
+                statements.append(part)
+                continue
+            operands = _EDGE_SPLIT_RE.split(head.strip())
+            if len(operands) == 1 and not bracket:
+                # Bare IDs without an edge or attribute list are a statement list ("a b c"), not one name
+                statements.append(part)
+                continue
+            for index in range(0, len(operands), 2):
+                name = operands[index].strip()
+                if name and name[0] not in '"<' and not re.match(r"^(?:[^\W\d]\w*|-?[\d.]+)(?::\w+)*$", name):
+                    operands[index] = _quote(name)
+                    fixes.append(f"quoted node name {name!r}")
+            indent = head[:len(head) - len(head.lstrip())]
+            trailing = " " if bracket and head.endswith(" ") else ""
+            statements.append(indent + " ".join(operands) + trailing + bracket + attrs)
+        lines.append("".join(statements))
+    return "\n".join(lines)
+
+
+def normalize_dot(raw_text):
+    """
+    Clean model output into valid, normalized DOT without any API call.
+
+    Strips code fences and prose, balances braces, quotes labels and node names that
+    contain special characters, matches edge operators to the graph type and merges
+    repeated node declarations.
+
+    Args:
+        raw_text (str): Raw model output expected to contain a DOT graph.
+
+    Returns:
+        tuple: (DOT source, list of str describing the fixes applied).
+
+    Raises:
+        DotSyntaxError: If the source is still invalid after local repairs; its dot
+                        attribute holds the partially repaired source.
+    """
+    fixes = []
+    text = _extract_graph(raw_text.strip(), fixes)
+
+    lines = text.split("\n")
+    kept = [line for line in lines if not _is_prose_line(line)]
+    if len(kept) != len(lines):
+        fixes.append(f"removed {len(lines) - len(kept)} prose line(s)")
+    text = "\n".join(kept)
+
+    text = _quote_attribute_values(text, fixes)
+    text = _quote_node_names(text, fixes)
+
+    try:
+        graph = parse_dot(text)
+    except DotSyntaxError as e:
+        raise DotSyntaxError(e.reason, e.line, dot=text) from None
+
+    node_count = _count_statements(graph["stmts"], "node")
+    graph["stmts"] = _dedupe_nodes(graph["stmts"])
+    if _count_statements(graph["stmts"], "node") != node_count:
+        fixes.append("merged repeated node declarations")
+    if _has_wrong_edge_op(text, graph["directed"]):
+        fixes.append("corrected edge operators")
+    return serialize_dot(graph), fixes
+
+
+def _count_statements(stmts, kind):
+    return sum(_count_statements(s["stmts"], kind) if s["kind"] == "subgraph" else s["kind"] == kind
+               for s in stmts)
+
+
+def _has_wrong_edge_op(text, directed):
+    wrong = "--" if directed else "->"
+    return any(kind == "edgeop" and op == wrong for kind, op, _ in _tokenize(text))
+
+
+def repair_dot(raw_text, client=None, max_model_attempts=1):
+    """
+    Validate and repair DOT, locally first and with a targeted model call only if needed.
+
+    The model call sends only the locally repaired DOT and the parse error, never the
+    original diagram or description.
+
+    Args:
+        raw_text (str): Raw model output expected to contain a DOT graph.
+        client (OpenAI, optional): Client for the repair call; without one, only local repairs run.
+                                   The model router picks the model from the size of the DOT.
+        max_model_attempts (int): Maximum number of repair calls.
+
+    Returns:
+        str: Valid DOT source.
+
+    Raises:
+        DotSyntaxError: If the DOT could not be repaired.
+    """
+    text = raw_text
+    for attempt in range(max_model_attempts + 1):
+        try:
+            dot_code, fixes = normalize_dot(text)
+            metrics.inc("dot_validations_total", result="repaired" if fixes else "valid")
+            return dot_code
+        except DotSyntaxError as e:
+            if client is None or attempt == max_model_attempts:
+                metrics.inc("dot_validations_total", result="invalid")
+                raise
+            error = e
+        metrics.record_retry("dot_model_repair")
+        text = _repair_with_model(error.dot or text, str(error), client)
+    raise DotSyntaxError("DOT repair failed")
+
+
+def _repair_with_model(dot_code, error, client):
+    prompt = (
+        f"This Graphviz DOT source fails to parse with the error: {error}\n\n"
+        f"{dot_code}\n\n"
+        f"Fix only that error and return the corrected DOT source, with no comments, code fences or explanations."
+    )
+    router = get_router()
+    response = router.call(
+        client, router.route_dot_repair(dot_code),
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+    )
+    return response.choices[0].message.content or ""
@@ -1,9 +1,14 @@
 import re
 from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
 from docx.shared import Inches
 import os
+import tempfile
 from io import BytesIO
 
+from app.metrics import timed
+
 def clean_text_for_docx(text: str) -> str:
     text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)  # **bold**
     text = re.sub(r'__(.*?)__', r'\1', text)      # __bold__
@@ -32,32 +37,77 @@ def remove_repeated_title(title: str, content: str) -> str:
             break
     return '\n'.join(lines[skip_lines:]).lstrip('\n\r ')
 
-def save_to_docx(sections: dict, filename: str):
-    doc = Document()
-    for title, content in sections.items():
-        content = remove_repeated_title(title, content)
-        content = clean_text_for_docx(content)
-        doc.add_heading(title, level=1)
-        lines = content.split('\n')
-        for line in lines:
-            stripped = line.strip()
-            if stripped.startswith('- '):
-                doc.add_paragraph(stripped[2:], style='ListBullet')
-            elif re.match(r'^\d+\.\s', stripped):
-                # Treat as numbered list item
-                doc.add_paragraph(stripped, style='ListNumber')
-            elif stripped == '':
-                doc.add_paragraph('')
-            else:
-                doc.add_paragraph(stripped)
-    doc.save(filename)
+# Characters XML 1.0 cannot hold; model output occasionally contains them
+_INVALID_XML_CHARS = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_NUMBERED_LINE = re.compile(r'^\d+\.\s')
 
-def insert_images_to_docx(filename, sections_dict, image_list):
+def _paragraph_element(text, style_id=None):
+    # Build a <w:p> directly instead of going through doc.add_paragraph for every line
+    p = OxmlElement('w:p')
+    if style_id:
+        p_pr = OxmlElement('w:pPr')
+        p_style = OxmlElement('w:pStyle')
+        p_style.set(qn('w:val'), style_id)
+        p_pr.append(p_style)
+        p.append(p_pr)
+    if text:
+        run = OxmlElement('w:r')
+        t = OxmlElement('w:t')
+        t.text = _INVALID_XML_CHARS.sub('', text)
+        t.set(qn('xml:space'), 'preserve')
+        run.append(t)
+        p.append(run)
+    return p
+
+def _section_paragraphs(title, content):
+    # Heading plus one paragraph per line, with bullet and numbered lines as list paragraphs
+    yield _paragraph_element(title, 'Heading1')
+    content = clean_text_for_docx(remove_repeated_title(title, content or ''))
+    for line in content.split('\n'):
+        stripped = line.strip()
+        if stripped.startswith('- '):
+            yield _paragraph_element(stripped[2:], 'ListBullet')
+        elif _NUMBERED_LINE.match(stripped):
+            yield _paragraph_element(stripped, 'ListNumber')
+        else:
+            yield _paragraph_element(stripped)
+
+def _image_stream(image):
+    # Accept file paths, raw bytes and file-like objects
+    if isinstance(image, str):
+        if not os.path.exists(image):
+            return None
+        with open(image, 'rb') as f:
+            return f.read()
+    if isinstance(image, BytesIO):
+        return image.getvalue()
+    if isinstance(image, (bytes, bytearray)):
+        return bytes(image)
+    return None
+
+@timed("docx.write")
+def build_docx(sections_dict, image_list=None) -> bytes:
+    """
+    Build the converted document in memory and return it as .docx bytes.
+
+    Section text goes through the same cleanup as before: repeated titles and markdown
+    emphasis are removed and "- " / "1. " lines become list paragraphs. All paragraphs are
+    inserted into the body in one pass. Identical images are stored once in the package
+    and every occurrence references that single part.
+
+    Args:
+        sections_dict (dict): Section titles mapped to converted text, in document order.
+        image_list (list, optional): Diagram images as bytes, BytesIO or file paths.
+
+    Returns:
+        bytes: The .docx file content, ready for st.download_button or writing to disk.
+    """
     doc = Document()
-    # Add sections first
+    body = doc.element.body
+    sect_pr = body.find(qn('w:sectPr'))
     for title, content in sections_dict.items():
-        doc.add_heading(title, level=1)
-        doc.add_paragraph(content)
+        for p in _section_paragraphs(title, content):
+            sect_pr.addprevious(p)
 
     if image_list:
         doc.add_page_break()
@@ -65,15 +115,42 @@ def insert_images_to_docx(filename, sections_dict, image_list):
 
         for i, image in enumerate(image_list):
             try:
-                if isinstance(image, str) and os.path.exists(image):
-                    doc.add_paragraph(os.path.basename(image))
-                    doc.add_picture(image, width=Inches(5.5))
-                elif isinstance(image, (bytes, BytesIO)):
-                    if isinstance(image, bytes):
-                        image = BytesIO(image)
-                    doc.add_paragraph(f"Diagram {i + 1}")
-                    doc.add_picture(image, width=Inches(5.5))
+                blob = _image_stream(image)
+                if blob is None:
+                    continue
+                caption = os.path.basename(image) if isinstance(image, str) else f"Diagram {i + 1}"
+                doc.add_paragraph(caption)
+                # python-docx looks image parts up by SHA-1, so repeated diagrams share one part
+                doc.add_picture(BytesIO(blob), width=Inches(5.5))
             except Exception as e:
                 doc.add_paragraph(f"[Failed to add image {i+1}: {e}]")
 
-    doc.save(filename)
+    output = BytesIO()
+    doc.save(output)
+    return output.getvalue()
+
+def insert_images_to_docx(filename, sections_dict, image_list):
+    """
+    Write the converted document with its diagrams to a file; see build_docx.
+
+    The file is written to a unique temporary name in the same folder and renamed, so a
+    concurrent reader never sees a partial document and concurrent writers of the same
+    output never clobber each other's temporary file.
+
+    Returns:
+        bytes: The .docx file content that was written.
+    """
+    data = build_docx(sections_dict, image_list)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(filename) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return data
+
+def save_to_docx(sections: dict, filename: str):
+    """Write converted sections without diagrams to a .docx file; see build_docx."""
+    return insert_images_to_docx(filename, sections, None)
@@ -1,70 +1,389 @@
 import base64
+import hashlib
 import io
-import uuid
+import json
+import math
 from docx import Document
-from PIL import Image
+from PIL import Image, ImageFilter
 
+from app.metrics import timed
+from app.model_router import get_router
 
-def extract_images_from_docx(docx_path):
+
+@timed("image.extract")
+def extract_images_from_docx(docx_path, dedupe=True):
         """
         Extract images from a DOCX file.
 
+        Identical image blobs (e.g. a logo repeated on many pages) are returned only once.
+
         Args:
             docx_path (str): Path to the DOCX file.
+            dedupe (bool): Drop images whose bytes exactly match an earlier image.
 
         Returns:
             list of tuples: Each tuple contains (image_bytes, image_name).
         """
         doc = Document(docx_path)
         image_list = []
+        seen_hashes = set()
 
         for rel in doc.part._rels:
             rel_obj = doc.part._rels[rel]
             if "image" in rel_obj.target_ref:
                 image_data = rel_obj.target_part.blob
-                image_name = f"image_{uuid.uuid4().hex[:8]}.png"
+                digest = hashlib.sha256(image_data).hexdigest()
+                if dedupe and digest in seen_hashes:
+                    continue
+                seen_hashes.add(digest)
+                # Name images by content so the same diagram keeps the same name across runs
+                image_name = f"image_{digest[:8]}.png"
                 image_list.append((image_data, image_name))
 
         return image_list
 
 
-def analyze_and_convert_diagram(image_bytes, source_tech, target_tech, client):
+def perceptual_hash(image_bytes, hash_size=8):
+        """
+        Compute a difference hash (dHash) so near-identical diagrams map to nearby hashes.
+
+        Args:
+            image_bytes (bytes): Image data in bytes.
+            hash_size (int): Width of the comparison grid; the hash has hash_size**2 bits.
+
+        Returns:
+            int: The perceptual hash as an integer.
+        """
+        image = Image.open(io.BytesIO(image_bytes)).convert("L").resize(
+            (hash_size + 1, hash_size), Image.LANCZOS
+        )
+        pixels = list(image.getdata())
+        value = 0
+        for row in range(hash_size):
+            offset = row * (hash_size + 1)
+            for col in range(hash_size):
+                value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+        return value
+
+
+def hamming_distance(hash_a, hash_b):
+        """Number of differing bits between two perceptual hashes."""
+        return bin(hash_a ^ hash_b).count("1")
+
+
+def is_decorative_image(image_bytes, min_bytes=2048, min_side=64, min_entropy=1.5, max_aspect_ratio=8.0):
+        """
+        Cheap filter for logos, icons, bullets and separator lines that are not worth analyzing.
+
+        Args:
+            image_bytes (bytes): Image data in bytes.
+            min_bytes (int): Images smaller than this many bytes are skipped.
+            min_side (int): Images with a side shorter than this many pixels are skipped.
+            min_entropy (float): Images with a grayscale histogram entropy below this are skipped
+                                 (blank or near-flat images).
+            max_aspect_ratio (float): Very wide or tall strips (banners, rules) are skipped.
+
+        Returns:
+            bool: True if the image should not be sent for diagram analysis.
+        """
+        if len(image_bytes) < min_bytes:
+            return True
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+            width, height = image.size
+        except Exception:
+            # Formats PIL cannot open (e.g. EMF/WMF) cannot be sent as diagrams either
+            return True
+        if min(width, height) < min_side:
+            return True
+        if max(width, height) / max(1, min(width, height)) > max_aspect_ratio:
+            return True
+        # Entropy on a thumbnail is enough to tell flat images from real diagrams
+        thumbnail = image.convert("L")
+        thumbnail.thumbnail((128, 128))
+        return thumbnail.entropy() < min_entropy
+
+
+def diagram_complexity(image_bytes, sample_side=256, edge_threshold=64):
+        """
+        Estimate how busy a diagram is, to choose the model and detail level for it.
+
+        Edges are counted on a small grayscale thumbnail: a few boxes and arrows on white
+        give a low density, dense flowcharts and screenshots a high one.
+
+        Args:
+            image_bytes (bytes): Image data in bytes.
+            sample_side (int): Longest side of the thumbnail that is measured.
+            edge_threshold (int): Edge strength (0-255) above which a pixel counts as an edge.
+
+        Returns:
+            dict: {"edge_density": fraction of edge pixels, "width", "height"} of the original image.
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        width, height = image.size
+        thumbnail = image.convert("L")
+        thumbnail.thumbnail((sample_side, sample_side))
+        histogram = thumbnail.filter(ImageFilter.FIND_EDGES).histogram()
+        edges = sum(histogram[edge_threshold:])
+        return {"edge_density": edges / max(1, sum(histogram)), "width": width, "height": height}
+
+
+# Formats the vision API accepts as-is, mapped to their MIME types
+VISION_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "GIF": "image/gif", "WEBP": "image/webp"}
+
+
+def _vision_scaled_size(width, height):
+        # Size the API actually processes at high detail: fit 2048x2048, then short side <= 768
+        scale = min(1.0, 2048 / max(width, height))
+        width, height = width * scale, height * scale
+        scale = min(1.0, 768 / min(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_vision_tokens(width, height, detail="high"):
+        """
+        Estimate the input tokens a vision model charges for an image.
+
+        Follows the published gpt-4o rules: low detail is a flat 85 tokens; high detail
+        fits the image in 2048x2048, scales the short side down to 768, then charges
+        170 tokens per 512px tile plus 85.
+
+        Args:
+            width (int): Image width in pixels.
+            height (int): Image height in pixels.
+            detail (str): "low" or "high".
+
+        Returns:
+            int: Estimated token count.
+        """
+        if detail == "low":
+            return 85
+        width, height = _vision_scaled_size(width, height)
+        tiles = math.ceil(width / 512) * math.ceil(height / 512)
+        return 85 + 170 * tiles
+
+
+def _fit_tile_budget(width, height, max_tiles, min_short_side):
+        # Shrink until the image needs at most max_tiles 512px tiles, keeping labels legible
+        width, height = _vision_scaled_size(width, height)
+        while math.ceil(width / 512) * math.ceil(height / 512) > max_tiles:
+            next_width, next_height = int(width * 0.9), int(height * 0.9)
+            if min(next_width, next_height) < min_short_side:
+                break
+            width, height = next_width, next_height
+        return width, height
+
+
+@timed("image.prepare")
+def prepare_image_payload(image_bytes, max_tiles=4, min_short_side=384, max_bytes=4 * 1024 * 1024,
+                          low_detail_side=512):
+        """
+        Prepare an image for a vision call within a token and byte budget.
+
+        The image is first reduced to the size the API would downscale it to anyway, then
+        further until it fits max_tiles 512px tiles, without letting the short side drop
+        below min_short_side so diagram labels stay readable. Images already in an accepted
+        format and within budget are sent untouched; others are re-encoded in their original
+        family (JPEG stays JPEG, everything else becomes PNG). Small images use the
+        flat-cost "low" detail level.
+
+        Args:
+            image_bytes (bytes): Original image data.
+            max_tiles (int): Maximum number of 512px high-detail tiles to pay for.
+            min_short_side (int): Smallest short side allowed when shrinking for the tile budget.
+            max_bytes (int): Images above this size are re-encoded even if within budget.
+            low_detail_side (int): Images whose longest side fits this use detail="low".
+
+        Returns:
+            dict: {"data_url", "detail", "stats"} where stats holds original/payload bytes,
+                  estimated original/payload tokens, the savings and whether it was re-encoded.
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        source_format = image.format
+        width, height = image.size
+        original_tokens = estimate_vision_tokens(width, height, "high")
+        target_width, target_height = _fit_tile_budget(width, height, max_tiles, min_short_side)
+
+        reencode = (
+            source_format not in VISION_MIME_TYPES
+            or getattr(image, "is_animated", False)
+            or target_width < width
+            or len(image_bytes) > max_bytes
+        )
+
+        if reencode:
+            if target_width < width:
+                image = image.resize((target_width, target_height), Image.LANCZOS)
+            buffered = io.BytesIO()
+            if source_format == "JPEG":
+                image.convert("RGB").save(buffered, format="JPEG", quality=85, optimize=True)
+                mime_type = "image/jpeg"
+            else:
+                if image.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+                    image = image.convert("RGBA")
+                image.save(buffered, format="PNG", optimize=True)
+                mime_type = "image/png"
+            payload = buffered.getvalue()
+            width, height = image.size
+        else:
+            payload = image_bytes
+            mime_type = VISION_MIME_TYPES[source_format]
+
+        detail = "low" if max(width, height) <= low_detail_side else "high"
+        payload_tokens = estimate_vision_tokens(width, height, detail)
+
+        # A downscaled re-encode that saves neither bytes nor tokens is not worth sending
+        if (reencode and source_format in VISION_MIME_TYPES and len(payload) >= len(image_bytes)
+                and payload_tokens >= original_tokens and len(image_bytes) <= max_bytes):
+            payload, mime_type, reencode = image_bytes, VISION_MIME_TYPES[source_format], False
+            payload_tokens = original_tokens
+            detail = "high"
+
+        return {
+            "data_url": f"data:{mime_type};base64," + base64.b64encode(payload).decode("utf-8"),
+            "detail": detail,
+            "stats": {
+                "original_bytes": len(image_bytes),
+                "payload_bytes": len(payload),
+                "bytes_saved": len(image_bytes) - len(payload),
+                "original_tokens": original_tokens,
+                "payload_tokens": payload_tokens,
+                "tokens_saved": original_tokens - payload_tokens,
+                "reencoded": reencode,
+            },
+        }
+
+
+@timed("image.analyze")
+def analyze_and_convert_diagram(image_bytes, source_tech, target_tech, client, image_payload=None, route=None):
         """
         Analyze a diagram image and get a conversion description from the OpenAI client.
 
+        An empty or cut-off description is asked for again on the escalated route.
+
         Args:
             image_bytes (bytes): Image data in bytes.
             source_tech (str): Source technology name.
             target_tech (str): Target technology name.
             client: OpenAI API client instance.
+            image_payload (dict, optional): Result of prepare_image_payload, if already computed.
+            route (dict, optional): Model route from ModelRouter.route_diagram; derived from the image if omitted.
 
         Returns:
-            str: The assistant’s response describing the converted design.
+            str or None: The assistant’s response describing the converted design, or None if
+                         every route returned an empty reply.
         """
-        image = Image.open(io.BytesIO(image_bytes))
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        buffered.seek(0)
-
-        # Proper base64 encoding
-        image_b64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+        if image_payload is None:
+            image_payload = prepare_image_payload(image_bytes)
+        router = get_router()
+        if route is None:
+            route = router.route_diagram(diagram_complexity(image_bytes), image_payload)
 
         prompt = (
             f"This is a diagram from a {source_tech} design document. "
             f"Analyze it and describe how it would be implemented in {target_tech}."
         )
 
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        description, _ = router.complete(
+            client, route,
             messages=[
                 {
                     "role": "user",
                     "content": [
                         {"type": "text", "text": prompt},
-                        {"type": "image_url", "image_url": {"url": "data:image/png;base64," + image_b64}}
+                        {"type": "image_url", "image_url": {
+                            "url": image_payload["data_url"], "detail": image_payload["detail"]
+                        }}
                     ],
                 }
             ],
             temperature=0.7
         )
-        return response.choices[0].message.content
\ No newline at end of file
+        return description
+
+
+# Structured output schema for the single-call diagram conversion
+DIAGRAM_CONVERSION_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "diagram_conversion",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "description": {"type": "string"},
+                "dot": {"type": "string"},
+            },
+            "required": ["description", "dot"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+@timed("image.convert_direct")
+def convert_diagram_to_dot(image_bytes, source_tech, target_tech, client, image_payload=None, route=None):
+        """
+        Convert a diagram image straight into target-technology Graphviz DOT in a single call.
+
+        The model returns structured JSON with a short description and the DOT source,
+        replacing the analyze_and_convert_diagram + generate_dot_from_text round trips.
+        A reply that is cut off or not valid JSON is asked for again on the escalated route.
+
+        Args:
+            image_bytes (bytes): Image data in bytes.
+            source_tech (str): Source technology name.
+            target_tech (str): Target technology name.
+            client: OpenAI API client instance.
+            image_payload (dict, optional): Result of prepare_image_payload, if already computed.
+            route (dict, optional): Model route from ModelRouter.route_diagram(direct=True); derived
+                                    from the image if omitted.
+
+        Returns:
+            dict: {"description": str, "dot": str} as returned by the model.
+
+        Raises:
+            ValueError: If no route returned valid JSON.
+        """
+        if image_payload is None:
+            image_payload = prepare_image_payload(image_bytes)
+        router = get_router()
+        if route is None:
+            route = router.route_diagram(diagram_complexity(image_bytes), image_payload, direct=True)
+
+        prompt = (
+            f"This is a diagram from a {source_tech} design document. "
+            f"Redesign it as it would be implemented in {target_tech}. "
+            f"Return a short description of the {target_tech} design and the diagram itself as "
+            f"valid Graphviz DOT source (a single graph or digraph, no comments or code fences)."
+        )
+
+        result, _ = router.complete(
+            client, route,
+            validate=_parse_diagram_conversion,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {
+                            "url": image_payload["data_url"], "detail": image_payload["detail"]
+                        }}
+                    ],
+                }
+            ],
+            temperature=0.4,
+            response_format=DIAGRAM_CONVERSION_FORMAT,
+        )
+        if result is None:
+            raise ValueError("Diagram conversion reply is not valid JSON")
+        return result
+
+
+def _parse_diagram_conversion(text):
+        # Structured reply, or None when it was cut off or malformed so the router escalates
+        try:
+            result = json.loads(text)
+        except ValueError:
+            return None
+        return result if isinstance(result, dict) and "dot" in result else None
@@ -0,0 +1,571 @@
+"""
+Background conversion jobs that outlive Streamlit script reruns.
+
+A job owns a folder under JOBS_DIR holding its job.json state file; its input document,
+rendered diagrams and output document live in the artifact store under the job id.
+Conversion runs on a module-level worker pool, so widget interactions, browser
+refreshes and reconnects only re-read the job state by id. Per-section results are
+written to job.json as they complete, which lets a failed or interrupted job resume
+from the last completed section. Jobs unused for longer than the artifact TTL are
+removed together with their artifacts.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.artifact_store import get_artifact_store
+from app.diagram_handler import render_many
+from app.diagram_pipeline import convert_diagrams, prepare_images
+from app.formatter import build_docx
+from app.image_utils import extract_images_from_docx
+from app.metrics import export_metrics, metrics, propagate, span, trace
+from app.parser import parse_docx
+from app.section_store import convert_similar
+from app.transformer import is_failed_conversion, stream_sections_concurrently
+
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(".cache", "jobs"))
+INPUT_NAME = "input.docx"
+STATE_NAME = "job.json"
+
+# Statuses a job can be in; "interrupted" is reported for running jobs whose worker is gone
+QUEUED, RUNNING, COMPLETED, FAILED, INTERRUPTED = "queued", "running", "completed", "failed", "interrupted"
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("JOB_WORKERS", "2")), thread_name_prefix="job")
+_lock = threading.Lock()
+_active = {}        # job_id -> Future for jobs running in this process
+_live_text = {}     # job_id -> {section index: partial streamed text}, never persisted
+_last_cleanup = 0.0
+CLEANUP_INTERVAL = 600
+# Job and group ids come back from the URL, so only ids of the form created here are accepted
+ID_PATTERN = re.compile(r"[0-9a-f]{12}")
+
+logger = logging.getLogger(__name__)
+
+
+def is_valid_id(value):
+    """Whether a job or group id has the format generated by this module."""
+    return isinstance(value, str) and ID_PATTERN.fullmatch(value) is not None
+
+
+def _job_dir(job_id):
+    if not is_valid_id(job_id):
+        raise ValueError(f"Invalid job id: {job_id!r}")
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def _write_state(state):
+    # Write to a temp file and rename so readers never see a half-written job.json
+    state["updated"] = time.time()
+    path = os.path.join(_job_dir(state["id"]), STATE_NAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_state(job_id):
+    with open(os.path.join(_job_dir(job_id), STATE_NAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _group_path(group_id):
+    if not is_valid_id(group_id):
+        raise ValueError(f"Invalid group id: {group_id!r}")
+    return os.path.join(JOBS_DIR, "groups", f"{group_id}.json")
+
+
+def _write_group(group):
+    path = _group_path(group["id"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(group, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_group(group_id):
+    with open(_group_path(group_id), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _input_path(job_id):
+    # Jobs created before the artifact store kept their input in the job folder
+    return get_artifact_store().path(job_id, INPUT_NAME) or os.path.join(_job_dir(job_id), INPUT_NAME)
+
+
+def _diagram_name(index):
+    return f"diagrams/{index}.png"
+
+
+def submit_job(docx_bytes, filename, source_tech, target_tech, client, max_workers=8, include_diagrams=True,
+               diagram_index=None, diagram_mode="two_step", section_store=None, ocr_first=False):
+    """
+    Create a conversion job for an uploaded document and start it in the background.
+
+    Args:
+        docx_bytes (bytes): Content of the uploaded .docx file.
+        filename (str): Original file name, kept for display.
+        source_tech (str): Detected or chosen source technology.
+        target_tech (str): Target technology to convert to.
+        client (OpenAI): Initialized OpenAI client instance (thread-safe).
+        max_workers (int): Concurrent section requests within the job.
+        include_diagrams (bool): Whether to convert embedded diagrams as well.
+        diagram_index (DiagramIndex, optional): Index of earlier diagram conversions for reuse.
+        diagram_mode (str): "two_step" or "direct" diagram conversion, see convert_diagram.
+        section_store (SectionStore, optional): Earlier section conversions; unchanged sections are reused.
+        ocr_first (bool): OCR diagrams first and skip the vision call where the text is enough.
+
+    Returns:
+        str: The new job id.
+    """
+    job_id = _create_job(docx_bytes, filename, source_tech, target_tech, include_diagrams, diagram_mode, ocr_first)
+    _start(job_id, client, max_workers, diagram_index, section_store)
+    return job_id
+
+
+def submit_fanout(docx_bytes, filename, source_tech, target_techs, client, max_workers=8, include_diagrams=True,
+                  diagram_index=None, diagram_mode="two_step", section_store=None, ocr_first=False):
+    """
+    Convert one document to several target technologies from a single parse.
+
+    The document is parsed and its images are extracted, filtered and hashed once; the
+    per-target conversions then run concurrently, each as its own job with its own
+    output document. Each job can still be followed, resumed and downloaded on its own.
+
+    Args:
+        docx_bytes (bytes): Content of the uploaded .docx file.
+        filename (str): Original file name, kept for display.
+        source_tech (str): Detected or chosen source technology.
+        target_techs (list of str): Target technologies to convert to; duplicates are ignored.
+        client (OpenAI): Initialized OpenAI client instance (thread-safe).
+        max_workers (int): Concurrent section requests within each target's job.
+        include_diagrams (bool): Whether to convert embedded diagrams as well.
+        diagram_index (DiagramIndex, optional): Index of earlier diagram conversions for reuse.
+        diagram_mode (str): "two_step" or "direct" diagram conversion, see convert_diagram.
+        section_store (SectionStore, optional): Earlier section conversions; unchanged sections are reused.
+        ocr_first (bool): OCR diagrams first and skip the vision call where the text is enough.
+
+    Returns:
+        tuple: (group id, list of job ids in the order of target_techs).
+    """
+    targets = list(dict.fromkeys(target_techs))
+    group_id = uuid.uuid4().hex[:12]
+    job_ids = [_create_job(docx_bytes, filename, source_tech, target, include_diagrams, diagram_mode, ocr_first,
+                           group=group_id)
+               for target in targets]
+    _write_group({"id": group_id, "filename": filename, "targets": targets, "job_ids": job_ids,
+                  "created": time.time(), "shared": {}, "wall_seconds": None})
+
+    with _lock:
+        future = _executor.submit(_run_fanout, group_id, job_ids, client, max_workers, diagram_index, section_store)
+        for job_id in job_ids:
+            _active[job_id] = future
+    return group_id, job_ids
+
+
+def _create_job(docx_bytes, filename, source_tech, target_tech, include_diagrams, diagram_mode, ocr_first,
+                group=None):
+    try:
+        cleanup_jobs()
+    except Exception:
+        # Housekeeping must never stop a new job from starting
+        logger.exception("Job cleanup failed")
+    job_id = uuid.uuid4().hex[:12]
+    os.makedirs(_job_dir(job_id), exist_ok=True)
+    # Fan-out jobs and re-uploads of the same file share one stored copy
+    get_artifact_store().put(docx_bytes, job_id, INPUT_NAME)
+
+    _write_state({
+        "id": job_id,
+        "group": group,       # fan-out group id when converted alongside other targets
+        "filename": filename,
+        "source_tech": source_tech,
+        "target_tech": target_tech,
+        "include_diagrams": include_diagrams,
+        "diagram_mode": diagram_mode,
+        "ocr_first": ocr_first,
+        "status": QUEUED,
+        "created": time.time(),
+        "titles": [],
+        "converted": {},      # str(section index) -> converted text
+        "reuse": None,        # diff against the previous conversion of the same document
+        "diagrams": None,     # list of diagram results once the diagram stage has finished
+        "timings": {},        # stage -> seconds of the last run
+        "output_file": None,
+        "error": None,
+    })
+    return job_id
+
+
+def resume_job(job_id, client, max_workers=8, diagram_index=None, section_store=None):
+    """
+    Restart a failed or interrupted job; sections that already converted are not redone.
+
+    Args:
+        job_id (str): Id of the job to resume.
+        client (OpenAI): Initialized OpenAI client instance.
+        max_workers (int): Concurrent section requests within the job.
+        diagram_index (DiagramIndex, optional): Index of earlier diagram conversions for reuse.
+        section_store (SectionStore, optional): Earlier section conversions; unchanged sections are reused.
+
+    Returns:
+        bool: True if the job was restarted, False if it is already running.
+    """
+    with _lock:
+        future = _active.get(job_id)
+        if future is not None and not future.done():
+            return False
+    _start(job_id, client, max_workers, diagram_index, section_store)
+    return True
+
+
+def _start(job_id, client, max_workers, diagram_index, section_store):
+    with _lock:
+        _active[job_id] = _executor.submit(_run_job, job_id, client, max_workers, diagram_index, section_store)
+
+
+def _run_job(job_id, client, max_workers, diagram_index, section_store, prepared=None):
+    # Every span recorded while the job runs is grouped under the job id
+    with trace(job_id), span("job"):
+        _run_job_traced(job_id, client, max_workers, diagram_index, section_store, prepared)
+    export_metrics()
+
+
+def _run_fanout(group_id, job_ids, client, max_workers, diagram_index, section_store):
+    started = time.perf_counter()
+    group = _read_group(group_id)
+    prepared = None
+    with trace(group_id), span("fanout", targets=len(job_ids)):
+        try:
+            # Target-independent work, done once for every target
+            input_path = _input_path(job_ids[0])
+            stage_started = time.perf_counter()
+            sections = parse_docx(input_path)
+            group["shared"]["parse"] = round(time.perf_counter() - stage_started, 4)
+            images = None
+            first = _read_state(job_ids[0])
+            if first["include_diagrams"]:
+                stage_started = time.perf_counter()
+                images = prepare_images(extract_images_from_docx(input_path), with_payload=True,
+                                        ocr=first.get("ocr_first", False))
+                group["shared"]["images"] = round(time.perf_counter() - stage_started, 4)
+            prepared = {"sections": sections, "images": images}
+        except Exception as e:
+            # Each job falls back to parsing on its own and reports its own error
+            group["error"] = str(e)
+        _write_group(group)
+
+        with ThreadPoolExecutor(max_workers=len(job_ids), thread_name_prefix="fanout") as pool:
+            futures = [pool.submit(propagate(_run_job), job_id, client, max_workers, diagram_index,
+                                   section_store, prepared)
+                       for job_id in job_ids]
+            for future in futures:
+                future.result()
+
+    group["wall_seconds"] = round(time.perf_counter() - started, 4)
+    _write_group(group)
+    export_metrics()
+
+
+def _run_job_traced(job_id, client, max_workers, diagram_index, section_store, prepared=None):
+    started = time.perf_counter()
+    state = _read_state(job_id)
+    state["status"] = RUNNING
+    state["error"] = None
+    state["timings"] = {}
+    _write_state(state)
+    store = get_artifact_store()
+
+    try:
+        input_path = _input_path(job_id)
+        if prepared is not None:
+            sections = prepared["sections"]
+        else:
+            stage_started = time.perf_counter()
+            sections = parse_docx(input_path)
+            state["timings"]["parse"] = round(time.perf_counter() - stage_started, 4)
+        state["titles"] = [section.get("title", "Untitled") for section in sections]
+        _write_state(state)
+        stage_started = time.perf_counter()
+
+        # Only sections without a successful result are sent again
+        pending = [i for i in range(len(sections)) if is_failed_conversion(state["converted"].get(str(i)))]
+        if section_store is not None and pending:
+            if state["reuse"] is None:
+                diff = section_store.diff_document(state["filename"], state["target_tech"], sections)
+                state["reuse"] = {"previous": diff["previous"], "changed": len(diff["changed"]),
+                                  "removed": diff["removed"], "reused": 0, "near": 0, "revised": 0}
+            # Sections whose content, technologies and model settings are unchanged are not sent again
+            stored = section_store.lookup([sections[i] for i in pending], state["source_tech"], state["target_tech"])
+            for position, text in stored.items():
+                state["converted"][str(pending[position])] = text
+            state["reuse"]["reused"] += len(stored)
+            metrics.inc("sections_reused_total", len(stored))
+            pending = [index for position, index in enumerate(pending) if position not in stored]
+
+            # Near-duplicates of earlier sections (template boilerplate) are reused or sent as a short edit
+            similar, similar_stats = convert_similar(
+                section_store, [sections[i] for i in pending], state["source_tech"], state["target_tech"], client,
+                max_workers=max_workers,
+            )
+            for position, text in similar.items():
+                state["converted"][str(pending[position])] = text
+            state["reuse"]["near"] = state["reuse"].get("near", 0) + similar_stats["reused"]
+            state["reuse"]["revised"] = state["reuse"].get("revised", 0) + similar_stats["revised"]
+            pending = [index for position, index in enumerate(pending) if position not in similar]
+            _write_state(state)
+
+        live = _live_text.setdefault(job_id, {})
+        for event in stream_sections_concurrently(
+            [sections[i] for i in pending], state["source_tech"], state["target_tech"], client,
+            max_workers=max_workers,
+        ):
+            index = pending[event["index"]]
+            if event["type"] == "delta":
+                live[index] = live.get(index, "") + event["text"]
+            else:
+                live.pop(index, None)
+                state["converted"][str(index)] = event["text"]
+                if section_store is not None:
+                    section_store.save(sections[index], state["source_tech"], state["target_tech"], event["text"])
+                _write_state(state)
+
+        state["timings"]["sections"] = round(time.perf_counter() - stage_started, 4)
+
+        diagrams_missing = state["diagrams"] is None or any(d["status"] == "failed" for d in state["diagrams"])
+        if state["include_diagrams"] and diagrams_missing:
+            stage_started = time.perf_counter()
+            # Diagrams that succeeded before are served from the diagram index on a rerun
+            if prepared is not None and prepared["images"] is not None:
+                images = prepared["images"]
+            else:
+                images = extract_images_from_docx(input_path)
+            diagram_results = convert_diagrams(
+                images, state["source_tech"], state["target_tech"], client, index=diagram_index,
+                mode=state.get("diagram_mode", "two_step"), ocr_first=state.get("ocr_first", False),
+            )
+            # Rendered bytes stay out of job.json; they are kept as artifacts next to the output
+            for index, result in enumerate(diagram_results):
+                if result["image"]:
+                    store.put(result["image"], job_id, _diagram_name(index))
+            state["diagrams"] = [{k: v for k, v in r.items() if k != "image"} for r in diagram_results]
+            state["timings"]["diagrams"] = round(time.perf_counter() - stage_started, 4)
+            _write_state(state)
+
+        stage_started = time.perf_counter()
+        converted = job_results(state)
+        # Stored per job, so concurrent users converting to the same target never overwrite each other
+        output_file = f"{state['target_tech']}_Design.docx"
+        store.put(build_docx(converted, job_diagram_images(state)), job_id, output_file)
+        state["output_file"] = output_file
+        state["timings"]["docx"] = round(time.perf_counter() - stage_started, 4)
+
+        failed_sections = [title for i, title in enumerate(state["titles"])
+                           if is_failed_conversion(state["converted"].get(str(i)))]
+        metrics.inc("jobs_total", status=FAILED if failed_sections else COMPLETED)
+        if section_store is not None and not failed_sections:
+            section_store.record_document(state["filename"], state["target_tech"], sections)
+        if failed_sections:
+            state["status"] = FAILED
+            state["error"] = f"{len(failed_sections)} section(s) failed: {', '.join(failed_sections)}"
+        else:
+            state["status"] = COMPLETED
+    except Exception as e:
+        metrics.inc("jobs_total", status=FAILED)
+        state["status"] = FAILED
+        state["error"] = f"{e}\n{traceback.format_exc()}"
+    finally:
+        _live_text.pop(job_id, None)
+        state["timings"]["total"] = round(time.perf_counter() - started, 4)
+        _write_state(state)
+
+
+def get_job(job_id):
+    """
+    Read a job's current state, including any partially streamed section text.
+
+    Args:
+        job_id (str): Id of the job.
+
+    Returns:
+        dict or None: The job state, or None if the id is malformed or no such job exists. A running job whose
+                      worker no longer exists (e.g. after a server restart) is reported
+                      as "interrupted". "live" maps section index to partial text.
+    """
+    if not is_valid_id(job_id):
+        return None
+    try:
+        state = _read_state(job_id)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    with _lock:
+        future = _active.get(job_id)
+    if state["status"] in (QUEUED, RUNNING) and (future is None or future.done()):
+        state["status"] = INTERRUPTED
+    state["live"] = dict(_live_text.get(job_id, {}))
+    return state
+
+
+def job_results(state):
+    """
+    Build the ordered title -> converted text dict from a job state.
+
+    Args:
+        state (dict): Job state from get_job.
+
+    Returns:
+        dict: Section titles mapped to converted text, in document order.
+    """
+    converted = {}
+    for index, title in enumerate(state.get("titles", [])):
+        converted[title] = state["converted"].get(str(index), "")
+    return converted
+
+
+def job_output(state):
+    """
+    Return the converted .docx of a job as bytes.
+
+    Recently finished jobs are served from the artifact store's memory tier.
+
+    Args:
+        state (dict): Job state from get_job.
+
+    Returns:
+        bytes or None: The document, or None if the job has not produced one yet or it has expired.
+    """
+    if not state.get("output_file"):
+        return None
+    output = get_artifact_store().get(state["id"], os.path.basename(state["output_file"]))
+    if output is not None or not os.path.isabs(state["output_file"]):
+        return output
+    # Jobs created before the artifact store wrote their output to the job folder; nothing else is served
+    job_dir = os.path.realpath(_job_dir(state["id"]))
+    path = os.path.realpath(state["output_file"])
+    if os.path.commonpath([job_dir, path]) != job_dir:
+        logger.warning("Refusing to serve output outside job folder: %s", state["output_file"])
+        return None
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def job_diagram_images(state):
+    """
+    Return the rendered diagram images of a job, in document order.
+
+    Images come from the job's artifacts; any that are missing are re-rendered from the
+    persisted DOT sources.
+
+    Args:
+        state (dict): Job state from get_job.
+
+    Returns:
+        list of bytes: PNG bytes for each successfully converted diagram.
+    """
+    store = get_artifact_store()
+    converted = [(index, d["dot_code"]) for index, d in enumerate(state.get("diagrams") or [])
+                 if d["status"] in ("converted", "reused")]
+    images = [store.get(state["id"], _diagram_name(index)) for index, _ in converted]
+    missing = [position for position, image in enumerate(images) if image is None]
+    if missing:
+        rendered = render_many([converted[position][1] for position in missing])
+        for position, image in zip(missing, rendered):
+            images[position] = image
+    return [image for image in images if image]
+
+
+def cleanup_jobs(force=False):
+    """
+    Remove jobs and artifacts that have not been used for longer than the artifact TTL.
+
+    Runs at most every CLEANUP_INTERVAL seconds unless forced; jobs running in this
+    process are never removed. The artifact store then evicts least recently used
+    scopes until it is within its size limit.
+
+    Args:
+        force (bool): Run even if the last cleanup was recent.
+
+    Returns:
+        dict or None: {"jobs": removed job count, "scopes", "bytes"}, or None if skipped.
+    """
+    global _last_cleanup
+    store = get_artifact_store()
+    now = time.time()
+    with _lock:
+        if not force and now - _last_cleanup < CLEANUP_INTERVAL:
+            return None
+        _last_cleanup = now
+        running = {job_id for job_id, future in _active.items() if not future.done()}
+
+    removed = 0
+    cutoff = now - store.ttl_seconds if store.ttl_seconds else None
+    if cutoff is not None and os.path.isdir(JOBS_DIR):
+        for entry in os.scandir(JOBS_DIR):
+            if entry.name == "groups" or entry.name in running or not entry.is_dir():
+                continue
+            state_path = os.path.join(entry.path, STATE_NAME)
+            updated = os.path.getmtime(state_path) if os.path.exists(state_path) else entry.stat().st_mtime
+            if updated < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                store.delete_scope(entry.name)
+                with _lock:
+                    _active.pop(entry.name, None)
+                removed += 1
+        groups_dir = os.path.join(JOBS_DIR, "groups")
+        if os.path.isdir(groups_dir):
+            for entry in os.scandir(groups_dir):
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+
+    return {"jobs": removed, **store.cleanup(keep=running)}
+
+
+def fanout_report(group_id):
+    """
+    Combined timing report of a multi-target conversion.
+
+    Args:
+        group_id (str): Id returned by submit_fanout.
+
+    Returns:
+        dict or None: {"filename", "shared": {stage: seconds} for the work done once,
+                       "targets": [{"target_tech", "job_id", "status", "timings"}],
+                       "wall_seconds": total time once every target has finished,
+                       "sequential_seconds": sum of the per-target totals plus the shared work},
+                      or None if no such group exists.
+    """
+    if not is_valid_id(group_id):
+        return None
+    try:
+        group = _read_group(group_id)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    targets = []
+    for job_id, target in zip(group["job_ids"], group["targets"]):
+        state = get_job(job_id)
+        targets.append({
+            "target_tech": target,
+            "job_id": job_id,
+            "status": state["status"] if state else None,
+            "timings": state.get("timings", {}) if state else {},
+        })
+    sequential = sum(group["shared"].values()) + sum(t["timings"].get("total", 0.0) for t in targets)
+    return {
+        "filename": group["filename"],
+        "shared": group["shared"],
+        "targets": targets,
+        "wall_seconds": group["wall_seconds"],
+        "sequential_seconds": round(sequential, 4),
+    }
@@ -0,0 +1,316 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "llm_cache.sqlite")
+
+
+def make_cache_key(model, messages, temperature=None, max_tokens=None, **extra):
+    """
+    Build a content-addressed key for a chat completion request.
+
+    Image inputs are inlined as base64 data URLs inside the messages, so hashing
+    the serialized messages covers the image bytes as well.
+
+    Args:
+        model (str): Model name.
+        messages (list): Chat messages exactly as sent to the API.
+        temperature (float, optional): Sampling temperature.
+        max_tokens (int, optional): Completion token limit.
+        **extra: Any other request parameters that change the output (e.g. response_format).
+
+    Returns:
+        str: Hex SHA-256 digest identifying the request.
+    """
+    payload = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "extra": extra,
+    }
+    serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent SQLite cache for LLM responses with TTL, LRU eviction and hit/miss counters.
+
+    Args:
+        path (str): Path to the SQLite file. Parent folders are created if missing.
+        max_entries (int): Maximum number of stored responses before LRU eviction.
+        max_bytes (int): Maximum total size of stored responses before LRU eviction.
+        ttl_seconds (float): Entries older than this are treated as misses and removed.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=5000, max_bytes=200 * 1024 * 1024,
+                 ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+            self._conn.commit()
+
+    def get(self, key):
+        """
+        Look up a cached value and refresh its LRU position.
+
+        Args:
+            key (str): Cache key from make_cache_key.
+
+        Returns:
+            dict or None: The stored value, or None on a miss or an expired entry.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            value, created = row
+            if self.ttl_seconds and now - created > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, key, value):
+        """
+        Store a value and evict least recently used entries if the cache is over its limits.
+
+        Args:
+            key (str): Cache key from make_cache_key.
+            value (dict): JSON-serializable value to store.
+        """
+        serialized = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, serialized, len(serialized.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Drop expired rows first, then trim the oldest-accessed rows until within limits
+        if self.ttl_seconds:
+            self._conn.execute("DELETE FROM llm_cache WHERE created < ?", (time.time() - self.ttl_seconds,))
+        count, total_size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if count <= self.max_entries and total_size <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access ASC").fetchall()
+        stale_keys = []
+        for key, size in rows:
+            if count <= self.max_entries and total_size <= self.max_bytes:
+                break
+            stale_keys.append((key,))
+            count -= 1
+            total_size -= size
+        self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale_keys)
+
+    def clear(self):
+        """Remove every cached response and reset the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Summarize cache usage.
+
+        Returns:
+            dict: hits, misses, hit_rate, entries and total stored bytes.
+        """
+        with self._lock:
+            count, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total_size,
+        }
+
+
+def _response_to_dict(response):
+    # Keep only the fields the app reads back from a chat completion
+    usage = getattr(response, "usage", None)
+    return {
+        "model": getattr(response, "model", None),
+        "choices": [
+            {"message": {"role": "assistant", "content": choice.message.content},
+             "finish_reason": getattr(choice, "finish_reason", None)}
+            for choice in response.choices
+        ],
+        "usage": {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+            "completion_tokens": getattr(usage, "completion_tokens", 0),
+            "total_tokens": getattr(usage, "total_tokens", 0),
+        } if usage else None,
+    }
+
+
+def _dict_to_response(data):
+    # Rebuild an object with the same attribute shape as an OpenAI ChatCompletion
+    return SimpleNamespace(
+        model=data.get("model"),
+        choices=[
+            SimpleNamespace(
+                message=SimpleNamespace(**choice["message"]),
+                finish_reason=choice.get("finish_reason"),
+            )
+            for choice in data["choices"]
+        ],
+        usage=SimpleNamespace(**data["usage"]) if data.get("usage") else None,
+        cached=True,
+    )
+
+
+def _replay_stream(data):
+    # Yield a cached completion as a single stream chunk with the shape of ChatCompletionChunk
+    yield SimpleNamespace(
+        model=data.get("model"),
+        choices=[
+            SimpleNamespace(
+                index=0,
+                delta=SimpleNamespace(role="assistant", content=data["choices"][0]["message"]["content"]),
+                finish_reason=data["choices"][0].get("finish_reason"),
+            )
+        ],
+        usage=SimpleNamespace(**data["usage"]) if data.get("usage") else None,
+        cached=True,
+    )
+
+
+def _record_stream(stream, cache, key):
+    # Pass chunks through unchanged and store the assembled completion once the stream ends
+    parts = []
+    model = None
+    finish_reason = None
+    usage = None
+    for chunk in stream:
+        model = getattr(chunk, "model", model)
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if chunk.choices:
+            choice = chunk.choices[0]
+            if choice.delta and choice.delta.content:
+                parts.append(choice.delta.content)
+            finish_reason = choice.finish_reason or finish_reason
+        yield chunk
+
+    # Interrupted or truncated streams are not worth replaying later
+    if finish_reason == "stop":
+        cache.set(key, {
+            "model": model,
+            "choices": [{"message": {"role": "assistant", "content": "".join(parts)},
+                         "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+                "completion_tokens": getattr(usage, "completion_tokens", 0),
+                "total_tokens": getattr(usage, "total_tokens", 0),
+            } if usage else None,
+        })
+
+
+class _CachedCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        owner = self._owner
+        inner_create = owner._client.chat.completions.create
+        stream = kwargs.get("stream", False)
+        # Streamed and non-streamed requests share cache entries
+        key = owner._key_for({k: v for k, v in kwargs.items() if k not in ("stream", "stream_options")})
+
+        if owner.bypass:
+            response = inner_create(**kwargs)
+            if not owner.store_on_bypass:
+                return response
+            if stream:
+                return _record_stream(response, owner.cache, key)
+            owner.cache.set(key, _response_to_dict(response))
+            return response
+
+        cached = owner.cache.get(key)
+        if cached is not None:
+            return _replay_stream(cached) if stream else _dict_to_response(cached)
+
+        response = inner_create(**kwargs)
+        if stream:
+            return _record_stream(response, owner.cache, key)
+        owner.cache.set(key, _response_to_dict(response))
+        return response
+
+
+class CachedOpenAIClient:
+    """
+    Drop-in wrapper around an OpenAI client that caches chat.completions.create results.
+
+    Every other attribute is forwarded to the wrapped client, so existing call sites keep
+    working unchanged.
+
+    Args:
+        client (OpenAI): The underlying OpenAI client.
+        cache (LLMCache): Cache used for lookups and storage.
+        bypass (bool): When True, lookups are skipped and every call hits the API.
+        store_on_bypass (bool): When bypassing, still store fresh responses in the cache.
+    """
+
+    def __init__(self, client, cache, bypass=False, store_on_bypass=True):
+        self._client = client
+        self.cache = cache
+        self.bypass = bypass
+        self.store_on_bypass = store_on_bypass
+        self.chat = SimpleNamespace(completions=_CachedCompletions(self))
+
+    def _key_for(self, kwargs):
+        params = dict(kwargs)
+        return make_cache_key(
+            params.pop("model", None),
+            params.pop("messages", None),
+            params.pop("temperature", None),
+            params.pop("max_tokens", None),
+            **params,
+        )
+
+    def with_cache_bypass(self, bypass=True):
+        """
+        Return a sibling wrapper sharing the same cache but with a different bypass setting.
+
+        Useful when a single run wants fresh creative output without affecting other users.
+        """
+        return CachedOpenAIClient(self._client, self.cache, bypass=bypass, store_on_bypass=self.store_on_bypass)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,42 @@
+import os
+
+from openai import OpenAI
+
+from app.llm_cache import DEFAULT_CACHE_PATH, CachedOpenAIClient, LLMCache
+from app.llm_scheduler import RequestScheduler, create_http_client
+from app.metrics import MetricsOpenAIClient
+
+
+def create_openai_client(api_key=None):
+    """
+    Build the OpenAI client used by the app, wrapped with the persistent response cache,
+    the rate-limit-aware request scheduler and metrics for latency, token usage and cache hits.
+
+    Cache hits never reach the scheduler, so they do not take up rate-limit budget. The
+    SDK's own retries are disabled; the scheduler retries with backoff instead.
+
+    Cache behaviour is configured through environment variables:
+    - LLM_CACHE_PATH: SQLite file for cached responses (default .cache/llm_cache.sqlite)
+    - LLM_CACHE_MAX_ENTRIES / LLM_CACHE_MAX_MB: LRU eviction limits
+    - LLM_CACHE_TTL_HOURS: Age after which a cached response is ignored
+    - LLM_CACHE_BYPASS: Set to "1" to always call the API (responses are still stored)
+    - LLM_MAX_RETRIES: Retries of a failed request (default 5)
+    - LLM_MAX_CONNECTIONS / LLM_KEEPALIVE_SECONDS: Pooled HTTP connections
+
+    Args:
+        api_key (str, optional): OpenAI API key. Defaults to OPENAI_API_KEY from the environment.
+
+    Returns:
+        MetricsOpenAIClient: Client exposing the same chat.completions.create interface as OpenAI.
+    """
+    client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"), max_retries=0, http_client=create_http_client())
+    scheduler = RequestScheduler(client, max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")))
+    cache = LLMCache(
+        path=os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000")),
+        max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "200")) * 1024 * 1024),
+        ttl_seconds=float(os.getenv("LLM_CACHE_TTL_HOURS", "168")) * 3600,
+    )
+    return MetricsOpenAIClient(
+        CachedOpenAIClient(scheduler, cache, bypass=os.getenv("LLM_CACHE_BYPASS", "0") == "1")
+    )
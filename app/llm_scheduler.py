@@ -0,0 +1,372 @@
+import email.utils
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import openai
+
+from app.metrics import metrics
+
+# Starting and maximum concurrent requests per model; the limit then adapts between 1 and the maximum
+DEFAULT_MODEL_LIMITS = {
+    "gpt-4o": {"concurrency": 4, "max_concurrency": 16},
+    "gpt-4o-mini": {"concurrency": 8, "max_concurrency": 64},
+}
+DEFAULT_LIMITS = {"concurrency": 4, "max_concurrency": 16}
+
+# Status codes worth another attempt; 429 additionally halves the model's concurrency
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value):
+    """
+    Parse a rate-limit reset duration such as "1s", "6m0s" or "20ms".
+
+    Args:
+        value (str): Header value.
+
+    Returns:
+        float or None: Seconds, or None if the value is missing or malformed.
+    """
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_after_seconds(headers):
+    """
+    Read how long the server asked us to wait from retry-after-ms or Retry-After.
+
+    Args:
+        headers (Mapping): Response headers; lookups are case-insensitive for httpx headers.
+
+    Returns:
+        float or None: Seconds to wait, or None if the server did not say.
+    """
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+    except ValueError:
+        pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        # HTTP-date form
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def _request_cost(kwargs):
+    # Tokens the request may consume against the token-per-minute limit: a rough prompt size plus the completion cap
+    prompt_chars = 0
+    for message in kwargs.get("messages") or []:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            prompt_chars += sum(len(part.get("text", "")) for part in content if part.get("type") == "text")
+        else:
+            prompt_chars += len(content or "")
+    return prompt_chars // 4 + (kwargs.get("max_tokens") or 0)
+
+
+class ModelBudget:
+    """
+    Adaptive concurrency and rate-limit state for one model.
+
+    Concurrency follows AIMD: every successful request raises the limit by 1/limit
+    (about one slot per round of requests) and a 429 halves it. Rate-limit headers from
+    successful responses pause new requests when the request or token budget runs out,
+    and Retry-After from a 429 pauses them until the server allows more.
+
+    Args:
+        model (str): Model name, reported by stats.
+        concurrency (int): Starting concurrent request limit.
+        max_concurrency (int): Upper bound the limit can grow to.
+    """
+
+    def __init__(self, model, concurrency=4, max_concurrency=16):
+        self.model = model
+        self.limit = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.remaining_tokens = None
+        self.tokens_reset_at = 0.0
+        self.rate_limited = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self, cost=0):
+        """Block until a request of cost tokens may be sent, then take a concurrency slot."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.in_flight >= int(self.limit):
+                    wait = 1.0
+                elif self.remaining_tokens is not None and cost > self.remaining_tokens and now < self.tokens_reset_at:
+                    wait = self.tokens_reset_at - now
+                else:
+                    break
+                self._cond.wait(timeout=wait)
+            self.in_flight += 1
+            if self.remaining_tokens is not None:
+                self.remaining_tokens -= cost
+
+    def release(self):
+        """Give a concurrency slot back."""
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, headers=None):
+        """Grow the limit additively and apply the rate-limit headers of a response."""
+        with self._cond:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            if headers:
+                now = time.monotonic()
+                remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+                if remaining_requests is not None and remaining_requests < self.limit:
+                    # Close to the request limit: never have more in flight than the window still allows
+                    self.limit = max(1.0, float(remaining_requests))
+                if remaining_requests == 0:
+                    reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                    self.paused_until = max(self.paused_until, now + (reset or 1.0))
+                remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+                if remaining_tokens is not None:
+                    self.remaining_tokens = remaining_tokens
+                    self.tokens_reset_at = now + (parse_duration(headers.get("x-ratelimit-reset-tokens")) or 1.0)
+            self._cond.notify_all()
+
+    def on_rate_limited(self, retry_after=None):
+        """Halve the limit (once per burst of 429s) and pause until the server allows more."""
+        with self._cond:
+            now = time.monotonic()
+            self.rate_limited += 1
+            # Requests already in flight when the limit was hit should not halve it again
+            if now - self._last_decrease > 1.0:
+                self.limit = max(1.0, self.limit / 2)
+                self._last_decrease = now
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            self._cond.notify_all()
+
+    def stats(self):
+        """Return the current limit, requests in flight and 429 count."""
+        with self._cond:
+            return {"model": self.model, "limit": round(self.limit, 2), "in_flight": self.in_flight,
+                    "paused_seconds": round(max(0.0, self.paused_until - time.monotonic()), 2),
+                    "remaining_tokens": self.remaining_tokens, "rate_limited": self.rate_limited}
+
+
+def _error_status(error):
+    # Status code of an openai.APIStatusError or anything shaped like one
+    return getattr(error, "status_code", None)
+
+
+def _is_retryable(error):
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    status = _error_status(error)
+    if status == 429 and getattr(error, "code", None) == "insufficient_quota":
+        # Out of credit: waiting does not help
+        return False
+    return status in RETRYABLE_STATUS
+
+
+class _ReleasingStream:
+    """
+    Stream that keeps its model's concurrency slot until it is fully read, closed or
+    garbage collected, whichever comes first; the slot is given back exactly once.
+    """
+
+    def __init__(self, stream, budget):
+        self._stream = stream
+        self._budget = budget
+        self._released = False
+        self._release_lock = threading.Lock()
+
+    def _release(self):
+        with self._release_lock:
+            if self._released:
+                return
+            self._released = True
+        self._budget.release()
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        finally:
+            self._release()
+
+    def close(self):
+        """Close the underlying stream and give the slot back."""
+        try:
+            close = getattr(self._stream, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        # A stream the caller dropped without reading must not hold its slot forever
+        if "_budget" in self.__dict__:
+            self._release()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._stream, name)
+
+
+class _ScheduledCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner._send(kwargs)
+
+
+class RequestScheduler:
+    """
+    Drop-in wrapper that schedules chat completions under per-model rate-limit budgets.
+
+    Every request waits for a slot in its model's ModelBudget, so gpt-4o and gpt-4o-mini
+    are limited independently. Transient failures (429, 5xx, timeouts, connection
+    errors) are retried with exponential backoff and full jitter; a Retry-After from the
+    server takes precedence over the computed delay. Under sustained load the
+    concurrency settles just below the rate limit instead of failing requests.
+
+    Every other attribute is forwarded to the wrapped client. The wrapped OpenAI client
+    should be created with max_retries=0 so retries are not doubled.
+
+    Args:
+        client (OpenAI): The underlying OpenAI client.
+        max_retries (int): Retries per request after the first attempt.
+        base_delay (float): Backoff before the first retry, doubled on every further retry.
+        max_delay (float): Upper bound for a single backoff.
+        model_limits (dict, optional): Model name mapped to {"concurrency", "max_concurrency"};
+                                       defaults to DEFAULT_MODEL_LIMITS.
+    """
+
+    def __init__(self, client, max_retries=5, base_delay=0.5, max_delay=30.0, model_limits=None):
+        self._client = client
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.model_limits = model_limits or DEFAULT_MODEL_LIMITS
+        self._budgets = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self.chat = SimpleNamespace(completions=_ScheduledCompletions(self))
+
+    def budget(self, model):
+        """Return the shared ModelBudget of a model, creating it on first use."""
+        with self._lock:
+            budget = self._budgets.get(model)
+            if budget is None:
+                limits = self.model_limits.get(model, DEFAULT_LIMITS)
+                budget = ModelBudget(model or "unknown", **limits)
+                self._budgets[model] = budget
+            return budget
+
+    def stats(self):
+        """Return the budget state of every model used so far."""
+        with self._lock:
+            budgets = list(self._budgets.values())
+        return [budget.stats() for budget in budgets]
+
+    def _backoff(self, attempt, retry_after):
+        if retry_after is not None:
+            # The server knows best; a little jitter keeps waiting requests from returning together
+            return retry_after + self._random.uniform(0, self.base_delay)
+        return self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _create(self, kwargs):
+        # Raw responses expose the rate-limit headers; wrappers without them just return the response
+        completions = self._client.chat.completions
+        raw_api = getattr(completions, "with_raw_response", None)
+        if raw_api is None:
+            return completions.create(**kwargs), None
+        raw = raw_api.create(**kwargs)
+        return raw.parse(), raw.headers
+
+    def _send(self, kwargs):
+        budget = self.budget(kwargs.get("model"))
+        cost = _request_cost(kwargs)
+        attempt = 0
+        while True:
+            budget.acquire(cost)
+            try:
+                response, headers = self._create(kwargs)
+            except Exception as e:
+                budget.release()
+                if not _is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                response_obj = getattr(e, "response", None)
+                retry_after = retry_after_seconds(getattr(response_obj, "headers", None))
+                if _error_status(e) == 429:
+                    budget.on_rate_limited(retry_after)
+                    metrics.record_retry("llm_rate_limited")
+                else:
+                    metrics.record_retry("llm_server_error" if _error_status(e) else "llm_connection")
+                time.sleep(self._backoff(attempt, retry_after))
+                attempt += 1
+                continue
+
+            budget.on_success(headers)
+            if kwargs.get("stream"):
+                return _ReleasingStream(response, budget)
+            budget.release()
+            return response
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def create_http_client():
+    """
+    Build the pooled HTTP client shared by every OpenAI request.
+
+    Connections are kept alive between requests, so concurrent section and diagram calls
+    reuse TLS sessions instead of reconnecting. Sizes come from LLM_MAX_CONNECTIONS and
+    LLM_KEEPALIVE_SECONDS.
+
+    The limit and timeout objects are built from the types the installed openai package
+    uses itself (httpx or httpx2, depending on its version), so they always match its client.
+
+    Returns:
+        Client for OpenAI(http_client=...).
+    """
+    max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+    limits_type = type(openai.DEFAULT_CONNECTION_LIMITS)
+    limits = limits_type(max_connections=max_connections, max_keepalive_connections=max_connections,
+                         keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_SECONDS", "60")))
+    return openai.DefaultHttpxClient(limits=limits, timeout=openai.Timeout(120.0, connect=10.0))
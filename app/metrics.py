@@ -0,0 +1,412 @@
+"""
+In-process instrumentation: timing spans, counters and LLM usage.
+
+Pipeline code wraps its stages in span("stage.name") or decorates them with
+@timed("stage.name"). API calls are measured by MetricsOpenAIClient, which records
+latency, prompt/completion tokens and cache hits from every response. Spans opened
+inside trace(document_id) are grouped per document, so the admin view can show where
+each document's time went.
+
+The shared registry is exported as Prometheus text (to_prometheus, or the optional
+HTTP endpoint started by start_metrics_server / METRICS_PORT) and as JSON (snapshot,
+export_metrics / METRICS_PATH).
+"""
+import contextvars
+import functools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, math.inf)
+MAX_SPANS = 2000
+MAX_TRACES = 200
+
+logger = logging.getLogger(__name__)
+
+_current_trace = contextvars.ContextVar("metrics_trace", default=None)
+_current_span = contextvars.ContextVar("metrics_span", default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, duration histograms and recent spans.
+
+    Args:
+        max_spans (int): Number of most recent spans kept for inspection.
+        max_traces (int): Number of most recent traces (documents) kept with per-stage totals.
+    """
+
+    def __init__(self, max_spans=MAX_SPANS, max_traces=MAX_TRACES):
+        self._lock = threading.Lock()
+        self.max_traces = max_traces
+        self._counters = {}     # (name, labels) -> value
+        self._durations = {}    # (name, labels) -> {"count", "sum", "max", "buckets"}
+        self._spans = deque(maxlen=max_spans)
+        self._traces = OrderedDict()  # trace id -> {"started", "stages": {name: {"count", "seconds"}}}
+
+    def inc(self, name, value=1, **labels):
+        """Add value to a counter."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Record one duration in a histogram."""
+        key = (name, _label_key(labels))
+        with self._lock:
+            stats = self._durations.get(key)
+            if stats is None:
+                stats = self._durations[key] = {"count": 0, "sum": 0.0, "max": 0.0,
+                                                "buckets": [0] * len(DURATION_BUCKETS)}
+            stats["count"] += 1
+            stats["sum"] += seconds
+            stats["max"] = max(stats["max"], seconds)
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+                    break
+
+    def record_span(self, name, started, seconds, status="ok", trace_id=None, parent=None, **attrs):
+        """Store a finished span and add it to the stage histogram and its trace."""
+        self.observe("stage_duration_seconds", seconds, stage=name)
+        if status != "ok":
+            self.inc("stage_errors_total", stage=name)
+        span = {"name": name, "started": started, "seconds": round(seconds, 6), "status": status,
+                "trace": trace_id, "parent": parent, **attrs}
+        with self._lock:
+            self._spans.append(span)
+            if trace_id is not None:
+                trace = self._traces.get(trace_id)
+                if trace is None:
+                    trace = self._traces[trace_id] = {"started": started, "stages": {}}
+                    while len(self._traces) > self.max_traces:
+                        self._traces.popitem(last=False)
+                stage = trace["stages"].setdefault(name, {"count": 0, "seconds": 0.0})
+                stage["count"] += 1
+                stage["seconds"] += seconds
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Time a block of code as a named stage.
+
+        The yielded dict can be filled with attributes (sizes, counts) that are stored
+        with the span. Exceptions are recorded as status "error" and re-raised.
+        """
+        extra = dict(attrs)
+        token = _current_span.set(name)
+        started = time.time()
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield extra
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            _current_span.reset(token)
+            parent = _current_span.get()
+            self.record_span(name, started, time.perf_counter() - start, status=status,
+                             trace_id=_current_trace.get(), parent=parent, **extra)
+
+    def record_llm_call(self, model, seconds, prompt_tokens=0, completion_tokens=0, cached=False,
+                        status="ok", stream=False):
+        """Record one chat completion: latency, token usage and whether the cache answered it."""
+        labels = {"model": model or "unknown", "cached": str(bool(cached)).lower()}
+        self.inc("llm_requests_total", status=status, **labels)
+        self.observe("llm_request_duration_seconds", seconds, **labels)
+        if prompt_tokens:
+            self.inc("llm_prompt_tokens_total", prompt_tokens, **labels)
+        if completion_tokens:
+            self.inc("llm_completion_tokens_total", completion_tokens, **labels)
+        self.inc("llm_cache_hits_total" if cached else "llm_cache_misses_total", model=labels["model"])
+        self.record_span("llm.request", time.time() - seconds, seconds, status=status,
+                         trace_id=_current_trace.get(), parent=_current_span.get(), model=labels["model"],
+                         cached=bool(cached), stream=stream, prompt_tokens=prompt_tokens,
+                         completion_tokens=completion_tokens)
+
+    def record_retry(self, reason):
+        """Count a repeated request, e.g. a fallback after an unusable reply."""
+        self.inc("retries_total", reason=reason)
+
+    def record_cache(self, cache, hit):
+        """Count a hit or miss of a named local cache (render cache, diagram index, ...)."""
+        self.inc("cache_hits_total" if hit else "cache_misses_total", cache=cache)
+
+    def reset(self):
+        """Drop everything recorded so far."""
+        with self._lock:
+            self._counters.clear()
+            self._durations.clear()
+            self._spans.clear()
+            self._traces.clear()
+
+    def snapshot(self):
+        """
+        Return all metrics as plain JSON-serializable data.
+
+        Returns:
+            dict: "counters" and "durations" (lists with name, labels and values), "spans"
+                  (most recent first) and "traces" (per-trace stage totals, newest first).
+        """
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            durations = [{"name": name, "labels": dict(labels), "count": s["count"], "sum": round(s["sum"], 6),
+                          "max": round(s["max"], 6), "avg": round(s["sum"] / s["count"], 6) if s["count"] else 0.0}
+                         for (name, labels), s in sorted(self._durations.items())]
+            spans = list(reversed(self._spans))
+            traces = [{"trace": trace_id, "started": trace["started"],
+                       "stages": {name: {"count": s["count"], "seconds": round(s["seconds"], 6)}
+                                  for name, s in trace["stages"].items()}}
+                      for trace_id, trace in reversed(self._traces.items())]
+        return {"created": time.time(), "counters": counters, "durations": durations,
+                "spans": spans, "traces": traces}
+
+    def to_prometheus(self):
+        """Render counters and histograms in the Prometheus text exposition format."""
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            durations = sorted(self._durations.items())
+            stats_copy = [(key, dict(s, buckets=list(s["buckets"]))) for key, s in durations]
+
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"designshift_{name}"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} counter")
+                seen.add(metric)
+            lines.append(f"{metric}{format_labels(labels)} {value}")
+
+        for (name, labels), stats in stats_copy:
+            metric = f"designshift_{name}"
+            if metric not in seen:
+                lines.append(f"# TYPE {metric} histogram")
+                seen.add(metric)
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, stats["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                lines.append(f"{metric}_bucket{format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{metric}_sum{format_labels(labels)} {stats['sum']:.6f}")
+            lines.append(f"{metric}_count{format_labels(labels)} {stats['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def span(name, **attrs):
+    """Time a block as a named stage on the shared registry; see Metrics.span."""
+    return metrics.span(name, **attrs)
+
+
+def timed(name):
+    """Decorator that records every call of the function as a span on the shared registry."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def trace(trace_id):
+    """Group every span opened inside the block (including propagated threads) under trace_id."""
+    token = _current_trace.set(trace_id)
+    try:
+        yield
+    finally:
+        _current_trace.reset(token)
+
+
+def propagate(func):
+    """
+    Bind func to the caller's trace and span context, for work handed to a thread pool.
+
+    Returns:
+        callable: func wrapped to run inside a copy of the current context.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so each call gets its own copy
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def _usage_tokens(usage):
+    if usage is None:
+        return 0, 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+
+
+def _measure_stream(stream, model, started):
+    # Pass chunks through and record the call when the stream ends
+    usage = None
+    cached = False
+    status = "ok"
+    first_token = None
+    try:
+        for chunk in stream:
+            if first_token is None and chunk.choices:
+                first_token = time.perf_counter() - started
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage
+            cached = cached or getattr(chunk, "cached", False)
+            yield chunk
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        prompt_tokens, completion_tokens = _usage_tokens(usage)
+        if first_token is not None:
+            metrics.observe("llm_time_to_first_token_seconds", first_token, model=model or "unknown")
+        metrics.record_llm_call(model, time.perf_counter() - started, prompt_tokens, completion_tokens,
+                                cached=cached, status=status, stream=True)
+
+
+class _MeasuredCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        model = kwargs.get("model")
+        if kwargs.get("stream") and "stream_options" not in kwargs:
+            # Ask for a final usage chunk so streamed calls report tokens too
+            kwargs["stream_options"] = {"include_usage": True}
+        started = time.perf_counter()
+        try:
+            response = self._owner._client.chat.completions.create(**kwargs)
+        except Exception:
+            metrics.record_llm_call(model, time.perf_counter() - started, status="error",
+                                    stream=bool(kwargs.get("stream")))
+            raise
+
+        if kwargs.get("stream"):
+            return _measure_stream(response, model, started)
+        prompt_tokens, completion_tokens = _usage_tokens(getattr(response, "usage", None))
+        metrics.record_llm_call(model, time.perf_counter() - started, prompt_tokens, completion_tokens,
+                                cached=getattr(response, "cached", False))
+        return response
+
+
+class MetricsOpenAIClient:
+    """
+    Drop-in wrapper that records latency, token usage and cache hits of every chat completion.
+
+    Every other attribute is forwarded to the wrapped client.
+
+    Args:
+        client: OpenAI client or another wrapper with the same interface (e.g. CachedOpenAIClient).
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.chat = SimpleNamespace(completions=_MeasuredCompletions(self))
+
+    def with_cache_bypass(self, bypass=True):
+        """Return the same client with cache bypass changed, still measured."""
+        return MetricsOpenAIClient(self._client.with_cache_bypass(bypass))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def export_metrics(path=None):
+    """
+    Write the shared registry to a JSON file and a Prometheus text file next to it.
+
+    Args:
+        path (str, optional): JSON file path. Defaults to METRICS_PATH; nothing is written if neither is set.
+
+    Returns:
+        str or None: The JSON path written, or None.
+    """
+    path = path or os.getenv("METRICS_PATH")
+    if not path:
+        return None
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(metrics.snapshot(), f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, path)
+    with open(os.path.splitext(path)[0] + ".prom", "w", encoding="utf-8") as f:
+        f.write(metrics.to_prometheus())
+    return path
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(metrics.snapshot(), default=str).encode("utf-8")
+            content_type = "application/json"
+        elif self.path.startswith("/metrics"):
+            body = metrics.to_prometheus().encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host="0.0.0.0"):
+    """
+    Serve /metrics (Prometheus text) and /metrics.json from a background thread.
+
+    Safe to call on every Streamlit rerun; only the first call starts a server.
+
+    Args:
+        port (int, optional): Port to listen on. Defaults to METRICS_PORT; no server if neither is set.
+        host (str): Interface to bind.
+
+    Returns:
+        int or None: The port being served, or None if disabled.
+    """
+    global _server
+    port = port or int(os.getenv("METRICS_PORT", "0"))
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError as e:
+                logger.warning("Metrics endpoint not started on port %s: %s", port, e)
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True, name="metrics").start()
+        return _server.server_address[1]
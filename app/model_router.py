@@ -0,0 +1,420 @@
+import os
+import re
+import threading
+import time
+from collections import deque
+
+from app.metrics import metrics
+from app.section_planner import count_tokens
+
+DEFAULT_FAST_MODEL = "gpt-4o-mini"
+DEFAULT_STRONG_MODEL = "gpt-4o"
+# Part of every stored section's key: bump when the routing thresholds change so conversions made
+# under the old policy are redone
+ROUTING_POLICY_VERSION = 1
+# Largest completion an escalated request may ask for
+MAX_COMPLETION_TOKENS = 4096
+# Latencies kept per route for the percentiles in stats()
+LATENCY_WINDOW = 500
+
+# Boilerplate sections convert almost word for word; these need design judgement
+TRIVIAL_TITLE_PATTERN = re.compile(
+    r"\b(introduction|overview|purpose|scope|audience|revision|history|change log|glossary|"
+    r"references?|appendix|contacts?|approvals?|sign[- ]?off|contents|acknowledg\w*|assumptions?)\b",
+    re.IGNORECASE,
+)
+COMPLEX_TITLE_PATTERN = re.compile(
+    r"\b(integrations?|interfaces?|apis?|data ?models?|schemas?|security|authori[sz]ation|architecture|"
+    r"workflows?|flows?|business rules?|rules? engine|decisions?|migrations?|error handling|performance)\b",
+    re.IGNORECASE,
+)
+# Bullets, numbered steps and table rows: dense structure that a small model tends to flatten
+STRUCTURE_LINE_PATTERN = re.compile(r"^\s*([-*•▪◦]|\d+[.)]|[A-Za-z][.)]\s|\|)|\t")
+
+TRIVIAL_SECTION_TOKENS = 150
+COMPLEX_SECTION_TOKENS = 900
+COMPLEX_TITLE_MIN_TOKENS = 400
+COMPLEX_STRUCTURE_LINES = 25
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, int(value)))
+
+
+def _with_detail(messages, detail):
+    # Copy of the messages with every image part sent at the route's detail level
+    routed = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            message = dict(message, content=[
+                dict(part, image_url=dict(part["image_url"], detail=detail)) if part.get("type") == "image_url" else part
+                for part in content
+            ])
+        routed.append(message)
+    return routed
+
+
+def section_features(section):
+    """
+    Measure the properties of a section that decide its route.
+
+    Args:
+        section (dict): Section with "title" and "content".
+
+    Returns:
+        dict: {"tokens", "structure_lines", "trivial_title", "complex_title"}.
+    """
+    title = section.get("title", "Untitled")
+    content = section.get("content", "")
+    return {
+        "tokens": count_tokens(f"{title}\n{content}"),
+        "structure_lines": sum(1 for line in content.splitlines() if STRUCTURE_LINE_PATTERN.match(line)),
+        "trivial_title": bool(TRIVIAL_TITLE_PATTERN.search(title)),
+        "complex_title": bool(COMPLEX_TITLE_PATTERN.search(title)),
+    }
+
+
+class ModelRouter:
+    """
+    Picks the model, completion limit and vision detail of every LLM request.
+
+    Each request is described by a route: a dict with "name", "tier" ("fast" or "strong")
+    and the request parameters it sets ("model", "max_tokens" and, for images, "detail").
+    Short boilerplate sections go to the fast model with a small completion limit;
+    long, heavily structured or integration/data-model sections go to the strong model.
+    Diagrams are routed by how busy the image is and how many labels OCR found. A reply
+    that is cut off at max_tokens, empty or rejected by the caller's validation is
+    retried once on the next route up (see escalate), so only sections that need it pay
+    for the strong model.
+
+    Every request's latency and outcome is recorded per route, in the shared metrics
+    (llm_route_duration_seconds, llm_route_requests_total, llm_route_escalations_total)
+    and in stats(), so thresholds can be tuned from real traffic.
+
+    Args:
+        fast_model (str): Model for simple requests.
+        strong_model (str): Model for complex requests and escalations.
+        enabled (bool): When False every request gets the fixed model of its call site,
+                        as before routing existed; latency is still recorded per route.
+    """
+
+    def __init__(self, fast_model=DEFAULT_FAST_MODEL, strong_model=DEFAULT_STRONG_MODEL, enabled=True):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {}  # route name -> counters and recent latencies, see _entry
+
+    def config(self):
+        """Return what decides the routes: whether routing is on, both models and the policy version."""
+        return {"enabled": self.enabled, "fast_model": self.fast_model, "strong_model": self.strong_model,
+                "policy": ROUTING_POLICY_VERSION}
+
+    def _route(self, name, tier, max_tokens, detail=None):
+        route = {"name": name, "tier": tier, "model": self.strong_model if tier == "strong" else self.fast_model,
+                 "max_tokens": max_tokens}
+        if detail is not None:
+            route["detail"] = detail
+        return route
+
+    def route_section(self, section):
+        """
+        Route the conversion of one section by its size, title and structure.
+
+        Args:
+            section (dict): Section with "title" and "content".
+
+        Returns:
+            dict: The route.
+        """
+        if not self.enabled:
+            return self._route("section.fixed", "fast", 1500)
+        features = section_features(section)
+        tokens = features["tokens"]
+        if (tokens > COMPLEX_SECTION_TOKENS or features["structure_lines"] >= COMPLEX_STRUCTURE_LINES
+                or (features["complex_title"] and tokens >= COMPLEX_TITLE_MIN_TOKENS)):
+            return self._route("section.complex", "strong", _clamp(tokens * 2 + 300, 1000, 3000))
+        if features["trivial_title"] or (tokens <= TRIVIAL_SECTION_TOKENS and not features["complex_title"]):
+            # A converted section is rarely more than twice its source
+            return self._route("section.trivial", "fast", _clamp(tokens * 2 + 100, 200, 1500))
+        return self._route("section.standard", "fast", _clamp(tokens * 1.5 + 300, 500, 1500))
+
+    def route_packed(self, sections):
+        """Route one request converting several small sections; they share a single completion."""
+        if not self.enabled:
+            return self._route("packed.fixed", "fast", 1500)
+        tokens = sum(section_features(section)["tokens"] for section in sections)
+        return self._route("packed", "fast", _clamp(tokens * 2 + 100 * len(sections), 500, 3000))
+
+    def route_revision(self, diff, previous_text):
+        """Route a diff-based edit of an earlier conversion: the reply is about as long as the earlier text."""
+        if not self.enabled:
+            return self._route("revise.fixed", "fast", 1500)
+        tokens = count_tokens(previous_text) + count_tokens(diff)
+        return self._route("revise", "fast", _clamp(tokens * 1.2 + 200, 400, 3000))
+
+    def route_detection(self):
+        """Route a technology detection request; the answer is a name."""
+        return self._route("detect" if self.enabled else "detect.fixed", "fast", 20)
+
+    def route_dot(self, description):
+        """
+        Route DOT generation from a diagram description by the size of the description.
+
+        Args:
+            description (str): Prose or OCR description of the diagram.
+
+        Returns:
+            dict: The route.
+        """
+        if not self.enabled:
+            return self._route("dot.fixed", "strong", 400)
+        tokens = count_tokens(description or "")
+        if tokens <= 250:
+            return self._route("dot.simple", "fast", 500)
+        # DOT for a described diagram is roughly as long as the description
+        return self._route("dot.complex", "strong", _clamp(tokens * 1.5, 600, 1500))
+
+    def route_dot_repair(self, dot_code):
+        """Route a targeted fix of DOT that fails to parse; the reply is the corrected DOT."""
+        max_tokens = max(400, len(dot_code) // 2)
+        if not self.enabled:
+            return self._route("dot.repair.fixed", "strong", max_tokens)
+        # Short graphs are a mechanical fix; long ones need the model that keeps their structure intact
+        return self._route("dot.repair", "fast" if len(dot_code) <= 1500 else "strong", max_tokens)
+
+    def route_suggestion(self):
+        """Route a request for a short list of suggested target technologies."""
+        return self._route("suggest" if self.enabled else "suggest.fixed", "fast", 100)
+
+    def route_diagram(self, complexity, image_payload, direct=False):
+        """
+        Route a vision request for one diagram by its visual complexity.
+
+        Args:
+            complexity (dict): From image_utils.diagram_complexity, optionally with "labels"
+                               (distinct labels read by OCR).
+            image_payload (dict): From prepare_image_payload; its detail is kept except for complex
+                                  diagrams, which are always sent at "high".
+            direct (bool): The request also returns the DOT source, so it needs a larger completion.
+
+        Returns:
+            dict: The route, including "detail".
+        """
+        extra = 600 if direct else 0
+        if not self.enabled:
+            return self._route("diagram.fixed", "strong", 1200 if direct else None, image_payload["detail"])
+        labels = complexity.get("labels")
+        density = complexity["edge_density"]
+        if density >= 0.12 or (labels is not None and labels > 20):
+            return self._route("diagram.complex", "strong", 1400 + extra, "high")
+        if density < 0.04 and (labels is None or labels <= 8):
+            # Few boxes: the fast model reads them. The detail level stays the payload's, which is only
+            # "low" when the prepared image already fits 512px; a large sparse diagram with small labels
+            # would be unreadable at that size
+            return self._route("diagram.simple", "fast", 500 + extra, image_payload["detail"])
+        return self._route("diagram.standard", "strong", 900 + extra, image_payload["detail"])
+
+    def escalate(self, route, reason):
+        """
+        Return the route to retry a failed reply on, or None if there is nothing stronger.
+
+        Fast routes move to the strong model with twice the completion limit; strong routes
+        only get a larger limit, and only when the reply was cut off.
+
+        Args:
+            route (dict): Route of the failed request.
+            reason (str): "truncated", "empty" or "invalid".
+
+        Returns:
+            dict or None: The escalated route.
+        """
+        if not self.enabled:
+            return None
+        if route["tier"] == "strong" and (reason != "truncated" or not route.get("max_tokens")
+                                          or route["max_tokens"] >= MAX_COMPLETION_TOKENS):
+            return None
+        base = route["name"].split("+", 1)[0]
+        max_tokens = route.get("max_tokens")
+        escalated = dict(route, name=f"{base}+escalated", tier="strong", model=self.strong_model,
+                         max_tokens=min(MAX_COMPLETION_TOKENS, max_tokens * 2) if max_tokens else None)
+        if escalated.get("detail") == "low":
+            escalated["detail"] = "high"
+        metrics.inc("llm_route_escalations_total", route=route["name"], reason=reason)
+        with self._lock:
+            self._entry(route["name"], route["model"])["escalated"] += 1
+        return escalated
+
+    def _entry(self, name, model):
+        # Called with the lock held
+        entry = self._stats.get(name)
+        if entry is None:
+            entry = self._stats[name] = {"model": model, "calls": 0, "cached": 0, "errors": 0, "truncated": 0,
+                                         "escalated": 0, "completion_tokens": 0,
+                                         "latencies": deque(maxlen=LATENCY_WINDOW)}
+        entry["model"] = model
+        return entry
+
+    def record(self, route, seconds, outcome="ok", completion_tokens=0):
+        """
+        Record one request of a route.
+
+        Cached replies are counted but kept out of the latency figures.
+
+        Args:
+            route (dict): Route the request was sent with.
+            seconds (float): Request latency.
+            outcome (str): "ok", "truncated", "error" or "cached".
+            completion_tokens (int): Tokens generated.
+        """
+        labels = {"route": route["name"], "model": route["model"]}
+        metrics.inc("llm_route_requests_total", outcome=outcome, **labels)
+        if outcome != "cached":
+            metrics.observe("llm_route_duration_seconds", seconds, **labels)
+        with self._lock:
+            entry = self._entry(route["name"], route["model"])
+            entry["calls"] += 1
+            if outcome == "cached":
+                entry["cached"] += 1
+                return
+            if outcome == "error":
+                entry["errors"] += 1
+            elif outcome == "truncated":
+                entry["truncated"] += 1
+            entry["completion_tokens"] += completion_tokens
+            entry["latencies"].append(seconds)
+
+    def call(self, client, route, **params):
+        """
+        Send one chat completion with a route's model and limits and record its latency.
+
+        Args:
+            client (OpenAI): Initialized OpenAI client instance.
+            route (dict): Route from one of the route_* methods.
+            **params: Remaining create() arguments (messages, temperature, ...); the route's
+                      model and max_tokens take precedence, a None max_tokens is left out, and
+                      image parts are sent at the route's detail level.
+
+        Returns:
+            The chat completion (or stream, which is measured until fully read).
+        """
+        params.update(model=route["model"], max_tokens=route.get("max_tokens"))
+        if params["max_tokens"] is None:
+            del params["max_tokens"]
+        if route.get("detail") and params.get("messages"):
+            params["messages"] = _with_detail(params["messages"], route["detail"])
+        started = time.perf_counter()
+        try:
+            response = client.chat.completions.create(**params)
+        except Exception:
+            self.record(route, time.perf_counter() - started, "error")
+            raise
+        if params.get("stream"):
+            return self._measure_stream(response, route, started)
+
+        choice = response.choices[0] if response.choices else None
+        usage = getattr(response, "usage", None)
+        if getattr(response, "cached", False):
+            outcome = "cached"
+        elif choice is not None and getattr(choice, "finish_reason", None) == "length":
+            outcome = "truncated"
+        else:
+            outcome = "ok"
+        self.record(route, time.perf_counter() - started, outcome, (getattr(usage, "completion_tokens", 0) or 0))
+        return response
+
+    def _measure_stream(self, stream, route, started):
+        outcome, completion_tokens = "ok", 0
+        try:
+            for chunk in stream:
+                if getattr(chunk, "cached", False):
+                    outcome = "cached"
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+                if chunk.choices and getattr(chunk.choices[0], "finish_reason", None) == "length":
+                    outcome = "truncated"
+                yield chunk
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            self.record(route, time.perf_counter() - started, outcome, completion_tokens)
+
+    def complete(self, client, route, validate=None, **params):
+        """
+        Send a request and retry it on the escalated route while the reply is unusable.
+
+        A reply is unusable when it was cut off at max_tokens, is empty, or validate
+        returns None for it. API errors are raised without escalating; the scheduler has
+        already retried them.
+
+        Args:
+            client (OpenAI): Initialized OpenAI client instance.
+            route (dict): Route to start with.
+            validate (callable, optional): Turns the reply text into the result, or returns None if it is unusable.
+            **params: Remaining create() arguments, as for call.
+
+        Returns:
+            tuple: (result, route used). When no route produced a usable reply, result is
+                   the last reply's (possibly truncated) result, or None.
+        """
+        while True:
+            response = self.call(client, route, **params)
+            choice = response.choices[0]
+            text = (choice.message.content or "").strip()
+            result = validate(text) if validate and text else (text or None)
+            truncated = getattr(choice, "finish_reason", None) == "length"
+            if result is not None and not truncated:
+                return result, route
+            escalated = self.escalate(route, "truncated" if truncated else "empty" if not text else "invalid")
+            if escalated is None:
+                return result, route
+            route = escalated
+
+    def stats(self):
+        """
+        Summarize every route used so far, most used first.
+
+        Returns:
+            list of dict: route, model, calls, cached, errors, truncated, escalated, average
+                          completion tokens and p50/p95/avg latency in seconds (uncached requests).
+        """
+        rows = []
+        with self._lock:
+            for name, entry in self._stats.items():
+                latencies = sorted(entry["latencies"])
+                measured = len(latencies)
+                rows.append({
+                    "route": name, "model": entry["model"], "calls": entry["calls"], "cached": entry["cached"],
+                    "errors": entry["errors"], "truncated": entry["truncated"], "escalated": entry["escalated"],
+                    "avg_completion_tokens": round(entry["completion_tokens"] / measured) if measured else 0,
+                    "p50_seconds": round(latencies[measured // 2], 3) if measured else None,
+                    "p95_seconds": round(latencies[min(measured - 1, int(measured * 0.95))], 3) if measured else None,
+                    "avg_seconds": round(sum(latencies) / measured, 3) if measured else None,
+                })
+        return sorted(rows, key=lambda row: -row["calls"])
+
+
+_default_router = None
+_default_router_lock = threading.Lock()
+
+
+def get_router():
+    """
+    Return the process-wide model router, configured from the environment on first use.
+
+    - LLM_ROUTING: Set to "0" to use the fixed model of every call site (default "1")
+    - LLM_FAST_MODEL: Model for simple requests (default gpt-4o-mini)
+    - LLM_STRONG_MODEL: Model for complex requests and escalations (default gpt-4o)
+    """
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = ModelRouter(
+                fast_model=os.getenv("LLM_FAST_MODEL", DEFAULT_FAST_MODEL),
+                strong_model=os.getenv("LLM_STRONG_MODEL", DEFAULT_STRONG_MODEL),
+                enabled=os.getenv("LLM_ROUTING", "1") != "0",
+            )
+        return _default_router
@@ -0,0 +1,197 @@
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from app.metrics import metrics, span
+
+# Tesseract reads text best at roughly 30 px cap height; small diagram labels are upscaled towards it
+MIN_OCR_SHORT_SIDE = 1200
+MAX_UPSCALE = 3.0
+# Diagrams are sparse text, not paragraphs: find as much text as possible in no particular order
+TESSERACT_CONFIG = "--oem 1 --psm 11"
+
+ARROW_PATTERN = re.compile(r"-+>|<-+|=+>|→|←|↔|⇒|➔|➜|▶|►")
+# Words of one label are one space apart; wider gaps separate neighbouring boxes
+LABEL_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9&/()._'-]*(?: [A-Za-z0-9&/()._'-]+)*")
+
+
+def _to_grayscale(image):
+    # ITU-R 601 luma on the whole pixel array; transparent areas become white paper
+    rgba = np.asarray(image.convert("RGBA"), dtype=np.float32)
+    gray = rgba[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    alpha = rgba[..., 3] / 255.0
+    return gray * alpha + 255.0 * (1.0 - alpha)
+
+
+def _otsu_threshold(gray):
+    # Otsu's method over the 256-bin histogram, all thresholds evaluated at once
+    histogram = np.bincount(gray.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256, dtype=np.float64)
+    weight_low = np.cumsum(histogram)
+    weight_high = weight_low[-1] - weight_low
+    mass_low = np.cumsum(histogram * levels)
+    mean_low = mass_low / np.maximum(weight_low, 1)
+    mean_high = (mass_low[-1] - mass_low) / np.maximum(weight_high, 1)
+    between_variance = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return int(np.argmax(between_variance))
+
+
+def _binarize(gray):
+    # Dark text on light background; light-on-dark images are inverted so ink is always black
+    ink = gray < _otsu_threshold(gray)
+    if ink.mean() > 0.5:
+        ink = ~ink
+    return ink
+
+
+def _skew_angle(ink, max_angle=5.0, step=0.5, sample_side=600):
+    # The rotation whose row profile is sharpest lines the text up horizontally
+    sample = Image.fromarray((ink * 255).astype(np.uint8))
+    sample.thumbnail((sample_side, sample_side))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        rotated = np.asarray(sample.rotate(float(angle), resample=Image.NEAREST, fillcolor=0), dtype=np.float32)
+        score = float((np.diff(rotated.sum(axis=1)) ** 2).sum())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess_for_ocr(image_bytes, deskew=True):
+    """
+    Prepare an image for Tesseract: grayscale, upscale small text, deskew and binarize.
+
+    Args:
+        image_bytes (bytes): Image data in bytes.
+        deskew (bool): Straighten slightly rotated scans (up to 5 degrees).
+
+    Returns:
+        PIL.Image.Image: Black text on white, mode "L".
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+
+    scale = min(MAX_UPSCALE, MIN_OCR_SHORT_SIDE / max(1, min(image.size)))
+    if scale > 1.0:
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+
+    ink = _binarize(_to_grayscale(image))
+    if deskew:
+        angle = _skew_angle(ink)
+        if angle:
+            rotated = Image.fromarray((ink * 255).astype(np.uint8)).rotate(
+                angle, resample=Image.NEAREST, expand=True, fillcolor=0
+            )
+            ink = np.asarray(rotated) > 127
+    return Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+
+
+def ocr_image(image_bytes):
+    """
+    Read the text of one image with Tesseract after preprocessing.
+
+    Runs in OCR worker processes, so it only takes and returns picklable values.
+    pytesseract is imported here because it is slow to import and most runs never OCR.
+
+    Args:
+        image_bytes (bytes): Image data in bytes.
+
+    Returns:
+        str or None: Recognized text, or None if the image could not be read or Tesseract is missing.
+    """
+    try:
+        import pytesseract
+
+        return pytesseract.image_to_string(preprocess_for_ocr(image_bytes), config=TESSERACT_CONFIG)
+    except Exception:
+        return None
+
+
+def ocr_images(images, max_workers=None):
+    """
+    OCR several images in parallel, one Tesseract process per worker.
+
+    Args:
+        images (list of bytes): Image data; None entries are skipped.
+        max_workers (int, optional): Worker processes; defaults to OCR_WORKERS or the CPU count.
+
+    Returns:
+        list: Recognized text (or None on failure) for each input, in the same order.
+    """
+    todo = [i for i, image in enumerate(images) if image]
+    texts = [None] * len(images)
+    if not todo:
+        return texts
+
+    max_workers = max_workers or int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count() or 1
+    workers = max(1, min(max_workers, len(todo)))
+    with span("ocr", images=len(todo), workers=workers):
+        if workers == 1:
+            # Starting a process costs more than a single OCR run saves
+            results = [ocr_image(images[i]) for i in todo]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(ocr_image, [images[i] for i in todo]))
+
+    for i, text in zip(todo, results):
+        texts[i] = text
+        metrics.inc("ocr_images_total", result="ok" if text is not None else "failed")
+    return texts
+
+
+def diagram_labels(text):
+    """
+    Extract the distinct box labels from a diagram's OCR text.
+
+    Args:
+        text (str): OCR output; None is treated as empty.
+
+    Returns:
+        set of str: Lower-cased labels.
+    """
+    labels = set()
+    for line in (text or "").splitlines():
+        for match in LABEL_PATTERN.finditer(ARROW_PATTERN.sub("  ", line)):
+            label = match.group(0).strip()
+            # Tesseract turns lines and box borders into short junk; real labels have a few letters
+            if sum(ch.isalpha() for ch in label) >= 3:
+                labels.add(label.lower())
+    return labels
+
+
+def ocr_diagram_stats(text):
+    """
+    Count what a diagram's OCR text says about its structure.
+
+    Args:
+        text (str): OCR output.
+
+    Returns:
+        dict: {"labels": distinct box labels, "arrows": arrow glyphs, "words": label words}.
+    """
+    labels = diagram_labels(text)
+    arrows = sum(len(ARROW_PATTERN.findall(line)) for line in (text or "").splitlines())
+    return {"labels": len(labels), "arrows": arrows, "words": sum(len(label.split()) for label in labels)}
+
+
+def is_rich_ocr_text(text, min_labels=4, min_words=6):
+    """
+    Decide whether OCR text alone describes a diagram well enough to redraw it.
+
+    Drawn connectors rarely survive OCR, so arrow glyphs count in favour but are not required.
+
+    Args:
+        text (str): OCR output.
+        min_labels (int): Distinct box labels needed (one fewer when arrows were read).
+        min_words (int): Words across all labels needed.
+
+    Returns:
+        bool: True if the vision call can be skipped for this diagram.
+    """
+    stats = ocr_diagram_stats(text)
+    needed = min_labels - 1 if stats["arrows"] else min_labels
+    return stats["labels"] >= needed and stats["words"] >= min_words
@@ -1,12 +1,193 @@
-from docx import Document
+import zipfile
+import xml.etree.ElementTree as ET
 
+from app import formatter
+from app.metrics import timed
+
+# WordprocessingML namespace and the fully qualified tag names used while streaming
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+W_BODY = f"{{{W_NS}}}body"
+W_P = f"{{{W_NS}}}p"
+W_R = f"{{{W_NS}}}r"
+W_T = f"{{{W_NS}}}t"
+W_TAB = f"{{{W_NS}}}tab"
+W_PTAB = f"{{{W_NS}}}ptab"
+W_BR = f"{{{W_NS}}}br"
+W_CR = f"{{{W_NS}}}cr"
+W_NO_BREAK_HYPHEN = f"{{{W_NS}}}noBreakHyphen"
+W_HYPERLINK = f"{{{W_NS}}}hyperlink"
+W_TBL = f"{{{W_NS}}}tbl"
+W_TR = f"{{{W_NS}}}tr"
+W_TC = f"{{{W_NS}}}tc"
+W_PPR = f"{{{W_NS}}}pPr"
+W_PSTYLE = f"{{{W_NS}}}pStyle"
+W_STYLE = f"{{{W_NS}}}style"
+W_NAME = f"{{{W_NS}}}name"
+W_VAL = f"{{{W_NS}}}val"
+W_TYPE = f"{{{W_NS}}}type"
+W_STYLE_ID = f"{{{W_NS}}}styleId"
+W_DEFAULT = f"{{{W_NS}}}default"
+
+
+def _heading_style_ids(docx_zip):
+    """
+    Resolve which paragraph style ids are "Heading 1" styles by reading styles.xml once.
+
+    Word stores built-in names in lowercase ("heading 1"); python-docx shows them as
+    "Heading 1", so the same prefix check as before is applied to the display name.
+
+    Args:
+        docx_zip (zipfile.ZipFile): Open .docx package.
+
+    Returns:
+        tuple: (set of heading style ids, default paragraph style id or None)
+    """
+    heading_ids = set()
+    default_id = None
+    try:
+        styles_root = ET.fromstring(docx_zip.read("word/styles.xml"))
+    except KeyError:
+        return heading_ids, default_id
+
+    for style in styles_root.iter(W_STYLE):
+        if style.get(W_TYPE) != "paragraph":
+            continue
+        style_id = style.get(W_STYLE_ID)
+        name_el = style.find(W_NAME)
+        name = name_el.get(W_VAL, "") if name_el is not None else ""
+        if name.startswith("heading "):
+            name = "H" + name[1:]
+        if name.startswith("Heading 1"):
+            heading_ids.add(style_id)
+        if style.get(W_DEFAULT) in ("1", "true", "on"):
+            default_id = style_id
+    return heading_ids, default_id
+
+
+def _run_text(run):
+    # Mirror python-docx Run.text: text, tabs and line breaks, ignoring page/column breaks
+    parts = []
+    for child in run:
+        tag = child.tag
+        if tag == W_T:
+            parts.append(child.text or "")
+        elif tag in (W_TAB, W_PTAB):
+            parts.append("\t")
+        elif tag == W_BR:
+            if child.get(W_TYPE) in (None, "textWrapping"):
+                parts.append("\n")
+        elif tag == W_CR:
+            parts.append("\n")
+        elif tag == W_NO_BREAK_HYPHEN:
+            parts.append("-")
+    return "".join(parts)
+
+
+def _paragraph_text(paragraph):
+    # Only direct runs and runs inside hyperlinks count, like python-docx Paragraph.text
+    parts = []
+    for child in paragraph:
+        if child.tag == W_R:
+            parts.append(_run_text(child))
+        elif child.tag == W_HYPERLINK:
+            parts.extend(_run_text(run) for run in child.iter(W_R))
+    return "".join(parts)
+
+
+def _paragraph_style_id(paragraph, default_id):
+    ppr = paragraph.find(W_PPR)
+    if ppr is not None:
+        pstyle = ppr.find(W_PSTYLE)
+        if pstyle is not None:
+            return pstyle.get(W_VAL)
+    return default_id
+
+
+def _table_lines(table):
+    """
+    Flatten a table into one text line per row, with cells separated by " | ".
+
+    Nested tables are folded into their parent cell's text.
+    """
+    lines = []
+    for row in table.findall(W_TR):
+        cells = []
+        for cell in row.findall(W_TC):
+            cell_text = " ".join(
+                text for text in (_paragraph_text(p).strip() for p in cell.iter(W_P)) if text
+            )
+            cells.append(cell_text)
+        if any(cells):
+            lines.append(" | ".join(cells))
+    return lines
+
+
+def iter_docx_sections(filepath):
+    """
+    Stream a .docx file section by section without loading the python-docx object model.
+
+    word/document.xml is read incrementally straight out of the zip package and each
+    top-level paragraph or table is discarded as soon as it has been processed, so memory
+    stays flat on very large documents. Heading styles are resolved once from styles.xml.
+
+    Each section is defined by:
+    - A Heading 1 paragraph marking the section title.
+    - All subsequent paragraphs and tables until the next Heading 1 are the section content.
+      Tables contribute one line per row, with cells separated by " | ".
+
+    Args:
+        filepath (str or file-like): Path to the input .docx file, or a binary file object.
+
+    Yields:
+        dict: A section with keys 'title' (str) and 'content' (str), as produced by parse_docx.
+    """
+    with zipfile.ZipFile(filepath) as docx_zip:
+        heading_ids, default_id = _heading_style_ids(docx_zip)
+
+        title = None
+        buffer = []  # Content lines of the current section, joined once when the section ends
+        depth = 0
+        body = None
+
+        with docx_zip.open("word/document.xml") as document_xml:
+            for event, elem in ET.iterparse(document_xml, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if elem.tag == W_BODY:
+                        body = elem
+                    continue
+
+                depth -= 1
+                # Only direct children of <w:body> are handled; depth 2 is document > body
+                if body is None or depth != 2:
+                    continue
+
+                if elem.tag == W_P:
+                    if _paragraph_style_id(elem, default_id) in heading_ids:
+                        if title:
+                            yield {"title": title, "content": "".join(buffer)}
+                        title = _paragraph_text(elem).strip()
+                        buffer = []
+                    elif title:
+                        buffer.append(_paragraph_text(elem) + "\n")
+                elif elem.tag == W_TBL and title:
+                    buffer.extend(line + "\n" for line in _table_lines(elem))
+
+                # Drop processed elements so the tree never grows with the document
+                body.clear()
+
+        if title:
+            yield {"title": title, "content": "".join(buffer)}
+
+
+@timed("parse")
 def parse_docx(filepath):
     """
     Parse a .docx file into a list of sections.
 
     Each section is defined by:
     - A Heading 1 paragraph marking the section title.
-    - All subsequent paragraphs until the next Heading 1 are the section content.
+    - All subsequent paragraphs and tables until the next Heading 1 are the section content.
 
     Args:
         filepath (str): Path to the input .docx file.
@@ -16,53 +197,17 @@ def parse_docx(filepath):
                       'title' (str): Section title from Heading 1
                       'content' (str): Section content concatenated as text with newlines
     """
-    # Load the Word document from the file
-    doc = Document(filepath)
-    sections = []
-    current_section = {"title": None, "content": ""}  # Initialize current section holder
-
-    # Iterate over all paragraphs in the document
-    for para in doc.paragraphs:
-        # Check if paragraph style is Heading 1 (section title marker)
-        if para.style.name.startswith('Heading 1'):
-            # If we already have a current section title, save that section before starting new
-            if current_section["title"]:
-                sections.append(current_section)
-            # Start a new section with the current paragraph text as title
-            current_section = {"title": para.text.strip(), "content": ""}
-        else:
-            # If inside a section, append paragraph text to current section content with a newline
-            if current_section["title"]:
-                current_section["content"] += para.text + "\n"
-
-    # After loop ends, add the last section if any
-    if current_section["title"]:
-        sections.append(current_section)
-
-    return sections
+    return list(iter_docx_sections(filepath))
 
 
 def save_to_docx(converted_dict, output_file):
     """
     Save converted sections into a new .docx file.
 
-    Each key in the dictionary is treated as a section title,
-    and its corresponding value as the section content.
+    Kept for existing callers; delegates to app.formatter.save_to_docx.
 
     Args:
         converted_dict (dict): Dictionary of section titles to content strings.
         output_file (str): Path to save the output .docx file.
     """
-    # Create a new Word document
-    doc = Document()
-
-    # Iterate over each section title and content
-    for title, content in converted_dict.items():
-        # Add the section title as a Heading 1
-        doc.add_heading(title, level=1)
-        # Add each line of the section content as a separate paragraph
-        for line in content.strip().split("\n"):
-            doc.add_paragraph(line)
-
-    # Save the document to the specified output file
-    doc.save(output_file)
+    formatter.save_to_docx(converted_dict, output_file)
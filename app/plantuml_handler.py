@@ -1,32 +1,173 @@
-import subprocess
-import uuid
+import logging
 import os
+import subprocess
+import threading
+import time
+
+from app.metrics import metrics
+
+PLANTUML_JAR = os.getenv("PLANTUML_JAR", "plantuml.jar")
+# Printed by PlantUML after each diagram in pipe mode, so outputs can be told apart
+PIPE_DELIMITER = b"___DESIGNSHIFT_PLANTUML_END___"
+
+logger = logging.getLogger(__name__)
+
+
+class PlantUMLRenderer:
+    """
+    Long-lived PlantUML process fed over stdin/stdout in pipe mode.
+
+    One JVM renders every diagram, so only the first diagram pays JVM startup. The process
+    is restarted automatically if it crashes or a render times out.
+
+    Args:
+        jar_path (str): Path to plantuml.jar.
+        output_format (str): "png" or "svg".
+        timeout (float): Seconds to wait for one diagram before restarting the process.
+        java (str): Java executable.
+    """
+
+    def __init__(self, jar_path=PLANTUML_JAR, output_format="png", timeout=30, java="java"):
+        self.jar_path = jar_path
+        self.output_format = output_format
+        self.timeout = timeout
+        self.java = java
+        self._process = None
+        self._buffer = bytearray()
+        self._stdout_closed = False
+        self._buffer_changed = threading.Condition()
+        self._lock = threading.Lock()  # One batch on the pipe at a time
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            [self.java, "-Djava.awt.headless=true", "-jar", self.jar_path,
+             "-pipe", f"-t{self.output_format}", "-pipedelimitor", PIPE_DELIMITER.decode("ascii")],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        self._buffer = bytearray()
+        self._stdout_closed = False
+        threading.Thread(target=self._read_stdout, args=(self._process,), daemon=True).start()
+
+    def _read_stdout(self, process):
+        # Drain stdout continuously so PlantUML never blocks on a full pipe
+        while True:
+            chunk = process.stdout.read1(65536)
+            with self._buffer_changed:
+                if process is not self._process:
+                    return
+                if not chunk:
+                    self._stdout_closed = True
+                    self._buffer_changed.notify_all()
+                    return
+                self._buffer.extend(chunk)
+                self._buffer_changed.notify_all()
+
+    def _ensure_running(self):
+        if self._process is None or self._process.poll() is not None:
+            self._start()
+
+    def _restart(self):
+        self.close()
+        self._start()
+
+    def _next_output(self, deadline):
+        # Wait for the next delimiter and return everything before it
+        with self._buffer_changed:
+            while True:
+                position = self._buffer.find(PIPE_DELIMITER)
+                if position >= 0:
+                    output = bytes(self._buffer[:position])
+                    del self._buffer[:position + len(PIPE_DELIMITER)]
+                    # The delimiter is printed on its own line, leaving a newline before the next image
+                    return output.lstrip(b"\r\n")
+                if self._stdout_closed or self._process.poll() is not None:
+                    raise RuntimeError("PlantUML process exited")
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError("PlantUML render timed out")
+                self._buffer_changed.wait(remaining)
+
+    def render_batch(self, uml_texts):
+        """
+        Render several diagrams through the running process in one round trip.
+
+        Args:
+            uml_texts (list of str): PlantUML sources; @startuml/@enduml are added if missing.
+
+        Returns:
+            list: Image bytes for each diagram, or None for diagrams that could not be rendered.
+        """
+        if not uml_texts:
+            return []
+
+        payload = "".join(_wrap_uml(text) for text in uml_texts).encode("utf-8")
+        with self._lock:
+            for _ in range(2):
+                try:
+                    self._ensure_running()
+                    self._process.stdin.write(payload)
+                    self._process.stdin.flush()
+                    deadline = time.time() + self.timeout * len(uml_texts)
+                    return [self._next_output(deadline) or None for _ in uml_texts]
+                except Exception as e:
+                    # Crashed or stuck JVM: start a fresh one and retry the batch once
+                    logger.warning("PlantUML generation error: %s", e)
+                    metrics.inc("render_failures_total", engine="plantuml", reason="restart")
+                    self._restart()
+        return [None] * len(uml_texts)
+
+    def render(self, uml_text):
+        """Render one diagram and return its image bytes, or None on failure."""
+        return self.render_batch([uml_text])[0]
+
+    def close(self):
+        """Stop the PlantUML process."""
+        process, self._process = self._process, None
+        if process is None:
+            return
+        with self._buffer_changed:
+            self._buffer_changed.notify_all()
+        try:
+            process.stdin.close()
+        except Exception:
+            pass
+        process.kill()
+        process.wait()
+
+
+def _wrap_uml(uml_text):
+    text = uml_text.strip()
+    if not text.startswith("@start"):
+        text = f"@startuml\n{text}\n@enduml"
+    return text + "\n"
+
+
+_renderers = {}
+_renderers_lock = threading.Lock()
+
+
+def get_plantuml_renderer(output_format="png"):
+    """Return the shared PlantUML renderer for an output format, creating it on first use."""
+    with _renderers_lock:
+        if output_format not in _renderers:
+            _renderers[output_format] = PlantUMLRenderer(output_format=output_format)
+        return _renderers[output_format]
+
+
+def generate_plantuml_diagram(uml_text: str, output_format: str = "png") -> bytes:
+    """
+    Generate a PlantUML diagram from UML text as PNG or SVG bytes.
+    Uses the shared long-lived PlantUML process; nothing is written to disk.
+    Returns the image bytes or None on failure.
+    """
+    return get_plantuml_renderer(output_format).render(uml_text)
+
 
-def generate_plantuml_diagram(uml_text: str, output_format: str = "png") -> str:
+def generate_plantuml_diagrams(uml_texts, output_format="png"):
     """
-    Generate a PlantUML diagram from UML text and save as PNG or SVG.
-    Returns the filepath of generated image or None on failure.
+    Generate several PlantUML diagrams in one batch through the shared process.
+    Returns a list of image bytes (None for failures) in the same order.
     """
-    temp_id = uuid.uuid4().hex[:8]
-    uml_file = f"plantuml_{temp_id}.puml"
-    output_file = f"plantuml_{temp_id}.{output_format}"
-
-    with open(uml_file, "w") as f:
-        f.write(uml_text)
-
-    try:
-        # Assuming plantuml.jar is in your project root or adjust path
-        subprocess.run([
-            "java", "-jar", "plantuml.jar",
-            f"-t{output_format}", uml_file
-        ], check=True)
-        if os.path.exists(output_file):
-            return output_file
-        else:
-            return None
-    except Exception as e:
-        print(f"PlantUML generation error: {e}")
-        return None
-    finally:
-        if os.path.exists(uml_file):
-            os.remove(uml_file)
+    return get_plantuml_renderer(output_format).render_batch(uml_texts)
@@ -0,0 +1,163 @@
+import logging
+import re
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to a character-based estimate
+    tiktoken = None
+
+from app.metrics import metrics
+
+# Sections above this many tokens are split; conversion output is capped at 1500 tokens
+MAX_SECTION_TOKENS = 1000
+# Sections below this many tokens are candidates for packing with their neighbours
+SMALL_SECTION_TOKENS = 300
+# Upper bound for the combined content of one packed request
+PACK_TOKEN_LIMIT = 1000
+MAX_SECTIONS_PER_PACK = 8
+
+logger = logging.getLogger(__name__)
+
+_encoder = None  # Lazily loaded tiktoken encoding; False once loading has failed
+
+
+def count_tokens(text):
+    """
+    Count tokens locally, using tiktoken when installed and ~4 characters per token otherwise.
+
+    Args:
+        text (str): Text to measure.
+
+    Returns:
+        int: Number of tokens.
+    """
+    global _encoder
+    if tiktoken is not None and _encoder is None:
+        try:
+            _encoder = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            # The encoding file is downloaded on first use; offline hosts use the estimate
+            logger.warning("tiktoken unavailable, estimating token counts: %s", e)
+            metrics.inc("tokenizer_fallbacks_total")
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def _split_long_paragraph(paragraph, max_tokens):
+    # Prefer sentence boundaries; fall back to fixed-size slices for run-on text
+    pieces = []
+    current = ""
+    for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+        candidate = f"{current} {sentence}".strip()
+        if current and count_tokens(candidate) > max_tokens:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+
+    result = []
+    max_chars = max_tokens * 4
+    for piece in pieces:
+        if count_tokens(piece) > max_tokens:
+            result.extend(piece[i:i + max_chars] for i in range(0, len(piece), max_chars))
+        else:
+            result.append(piece)
+    return result
+
+
+def split_content(content, max_tokens=MAX_SECTION_TOKENS):
+    """
+    Split section content into chunks of at most max_tokens, breaking at paragraph boundaries.
+
+    Args:
+        content (str): Section content with one paragraph per line.
+        max_tokens (int): Token limit per chunk.
+
+    Returns:
+        list of str: Content chunks in their original order.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    for paragraph in content.split("\n"):
+        paragraph_tokens = count_tokens(paragraph) + 1
+        if paragraph_tokens > max_tokens:
+            if current:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            chunks.extend(_split_long_paragraph(paragraph, max_tokens))
+            continue
+        if current and current_tokens + paragraph_tokens > max_tokens:
+            chunks.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(paragraph)
+        current_tokens += paragraph_tokens
+    if current and "\n".join(current).strip():
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def plan_requests(sections, max_section_tokens=MAX_SECTION_TOKENS, small_section_tokens=SMALL_SECTION_TOKENS,
+                  pack_token_limit=PACK_TOKEN_LIMIT, max_sections_per_pack=MAX_SECTIONS_PER_PACK):
+    """
+    Group sections into conversion requests sized for the model's limits.
+
+    - Small adjacent sections are packed into one request.
+    - Oversized sections are split at paragraph boundaries into several requests.
+    - Everything else (including empty sections) stays one request per section.
+
+    Args:
+        sections (list of dict): Sections as returned by parse_docx.
+        max_section_tokens (int): Sections above this are split.
+        small_section_tokens (int): Sections below this may be packed together.
+        pack_token_limit (int): Combined content limit of one packed request.
+        max_sections_per_pack (int): Maximum number of sections in one packed request.
+
+    Returns:
+        list of dict: Requests, each with "type" ("single", "packed" or "part"), "indices"
+                      (positions in sections) and "sections" (the section dicts to send).
+                      Parts also carry "part" and "parts".
+    """
+    plan = []
+    pack = []
+    pack_tokens = 0
+
+    def flush_pack():
+        nonlocal pack, pack_tokens
+        if len(pack) == 1:
+            plan.append({"type": "single", "indices": [pack[0]], "sections": [sections[pack[0]]]})
+        elif pack:
+            plan.append({"type": "packed", "indices": list(pack), "sections": [sections[i] for i in pack]})
+        pack, pack_tokens = [], 0
+
+    for index, section in enumerate(sections):
+        content = section.get("content", "")
+        tokens = count_tokens(content)
+
+        if not content.strip():
+            # Empty sections never reach the API, so they should not occupy a packed slot
+            flush_pack()
+            plan.append({"type": "single", "indices": [index], "sections": [section]})
+        elif tokens > max_section_tokens:
+            flush_pack()
+            chunks = split_content(content, max_section_tokens)
+            for part, chunk in enumerate(chunks, start=1):
+                plan.append({
+                    "type": "part", "indices": [index], "part": part, "parts": len(chunks),
+                    "sections": [{"title": section.get("title", "Untitled"), "content": chunk}],
+                })
+        elif tokens < small_section_tokens:
+            if pack and (pack_tokens + tokens > pack_token_limit or len(pack) >= max_sections_per_pack):
+                flush_pack()
+            pack.append(index)
+            pack_tokens += tokens
+        else:
+            flush_pack()
+            plan.append({"type": "single", "indices": [index], "sections": [section]})
+
+    flush_pack()
+    return plan
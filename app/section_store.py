@@ -0,0 +1,338 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.metrics import metrics, propagate
+from app.minhash import MinHashLSH
+from app.transformer import CONVERSION_PROMPT_VERSION, conversion_settings, revise_conversion
+
+DEFAULT_STORE_PATH = os.path.join(".cache", "section_store.sqlite")
+
+# Estimated Jaccard similarity of word 3-grams at or above which a stored conversion is sent as a
+# diff-based edit request; it is only reused as is when the text differs in whitespace alone
+REVISE_SIMILARITY = 0.7
+
+
+def section_hash(section):
+    """
+    Fingerprint a section's title and content.
+
+    Whitespace at line ends is ignored, so re-saving a document in Word does not make
+    every section look edited.
+
+    Args:
+        section (dict): Section with "title" and "content".
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    content = "\n".join(line.rstrip() for line in section.get("content", "").strip().splitlines())
+    text = f"{section.get('title', 'Untitled').strip()}\0{content}"
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _settings_id(settings=None):
+    settings = dict(settings or conversion_settings(), prompt_version=CONVERSION_PROMPT_VERSION)
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _similarity_text(section):
+    return f"{section.get('title', 'Untitled')}\n{section.get('content', '')}"
+
+
+def _normalized_text(section):
+    # Rewrapped or reindented text converts the same; any change to the words does not
+    return " ".join(_similarity_text(section).split())
+
+
+def conversion_key(section, source_tech, target_tech, settings=None):
+    """
+    Key of one section conversion: section content, technologies and model settings.
+
+    Args:
+        section (dict): Section with "title" and "content".
+        source_tech (str): Source technology name.
+        target_tech (str): Target technology name.
+        settings (dict, optional): Model settings; defaults to the transformer's conversion settings,
+                                   which include the model router's configuration.
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    settings = dict(settings or conversion_settings(), prompt_version=CONVERSION_PROMPT_VERSION)
+    payload = json.dumps([section_hash(section), source_tech, target_tech, settings], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SectionStore:
+    """
+    Persistent store of converted sections keyed by content hash, for incremental re-conversion.
+
+    A re-uploaded document only sends sections whose content, technologies or model
+    settings changed; every other section reuses its stored conversion. The section
+    hashes of the last conversion of each document are kept too, so a new upload can be
+    diffed against it.
+
+    Every stored section also gets a MinHash signature, so sections that differ only in
+    wording from one converted before (template boilerplate) can be found with
+    find_similar. The LSH index for a source/target pair is loaded into memory on first use.
+
+    Args:
+        path (str): Path to the SQLite file. Parent folders are created if missing.
+        max_entries (int): Converted sections kept; the least recently used are removed first.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, max_entries=20000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._lsh = MinHashLSH()
+        self._indexes = {}  # (source_tech, target_tech, settings id) -> MinHashLSH
+
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS section_conversions ("
+                "key TEXT PRIMARY KEY, title TEXT, text TEXT NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS document_versions ("
+                "document TEXT NOT NULL, target_tech TEXT NOT NULL, section_hashes TEXT NOT NULL, "
+                "updated REAL NOT NULL, PRIMARY KEY (document, target_tech))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS section_signatures ("
+                "key TEXT PRIMARY KEY, source_tech TEXT NOT NULL, target_tech TEXT NOT NULL, "
+                "settings_id TEXT NOT NULL, title TEXT, content TEXT NOT NULL, signature BLOB NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_section_signatures_pair "
+                               "ON section_signatures(source_tech, target_tech, settings_id)")
+            self._conn.commit()
+
+    def lookup(self, sections, source_tech, target_tech, settings=None):
+        """
+        Find stored conversions for sections.
+
+        Args:
+            sections (list of dict): Sections as returned by parse_docx.
+            source_tech (str): Source technology name.
+            target_tech (str): Target technology name.
+            settings (dict, optional): Model settings the conversion must have used.
+
+        Returns:
+            dict: Position in sections mapped to the stored converted text, for sections found.
+        """
+        keys = [conversion_key(section, source_tech, target_tech, settings) for section in sections]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, text FROM section_conversions WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._conn.executemany("UPDATE section_conversions SET last_used = ? WHERE key = ?",
+                                       [(time.time(), key) for key in found])
+                self._conn.commit()
+
+        result = {index: found[key] for index, key in enumerate(keys) if key in found}
+        with self._lock:
+            self.hits += len(result)
+            self.misses += len(keys) - len(result)
+        return result
+
+    def save(self, section, source_tech, target_tech, text, settings=None):
+        """
+        Store one converted section.
+
+        Args:
+            section (dict): The source section.
+            source_tech (str): Source technology name.
+            target_tech (str): Target technology name.
+            text (str): Converted text; error and warning results are not stored.
+            settings (dict, optional): Model settings used for the conversion.
+        """
+        if not text or text.startswith("⚠️"):
+            return
+        key = conversion_key(section, source_tech, target_tech, settings)
+        pair = (source_tech, target_tech, _settings_id(settings))
+        signature = self._lsh.signature(_similarity_text(section))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO section_conversions (key, title, text, last_used) VALUES (?, ?, ?, ?)",
+                (key, section.get("title", "Untitled"), text, time.time()),
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO section_signatures "
+                "(key, source_tech, target_tech, settings_id, title, content, signature) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, *pair, section.get("title", "Untitled"), section.get("content", ""), signature.tobytes()),
+            )
+            if pair in self._indexes:
+                self._indexes[pair].add(key, signature)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM section_conversions").fetchone()[0]
+        if count > self.max_entries:
+            stale = self._conn.execute(
+                "SELECT key FROM section_conversions ORDER BY last_used LIMIT ?", (count - self.max_entries,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM section_conversions WHERE key = ?", stale)
+            self._conn.executemany("DELETE FROM section_signatures WHERE key = ?", stale)
+            for index in self._indexes.values():
+                for (key,) in stale:
+                    index.remove(key)
+
+    def _index(self, pair):
+        # Called with the lock held; builds the in-memory LSH index of one source/target pair
+        index = self._indexes.get(pair)
+        if index is None:
+            index = MinHashLSH()
+            rows = self._conn.execute(
+                "SELECT key, signature FROM section_signatures "
+                "WHERE source_tech = ? AND target_tech = ? AND settings_id = ?", pair
+            )
+            for key, signature in rows:
+                index.add(key, np.frombuffer(signature, dtype=np.uint32))
+            self._indexes[pair] = index
+        return index
+
+    def find_similar(self, sections, source_tech, target_tech, threshold=REVISE_SIMILARITY, settings=None):
+        """
+        Find stored conversions of sections that are near-duplicates of the given ones.
+
+        Args:
+            sections (list of dict): Sections to look up.
+            source_tech (str): Source technology name.
+            target_tech (str): Target technology name.
+            threshold (float): Minimum estimated similarity (Jaccard of word 3-grams).
+            settings (dict, optional): Model settings the conversion must have used.
+
+        Returns:
+            dict: Position in sections mapped to {"similarity", "section" (the stored source
+                  section), "text" (its converted text)} for the most similar match of each section.
+        """
+        pair = (source_tech, target_tech, _settings_id(settings))
+        signatures = [self._lsh.signature(_similarity_text(section)) for section in sections]
+        found = {}
+        with self._lock:
+            index = self._index(pair)
+            for position, signature in enumerate(signatures):
+                for key, similarity in index.query(signature, threshold):
+                    row = self._conn.execute(
+                        "SELECT s.title, s.content, c.text FROM section_signatures s "
+                        "JOIN section_conversions c ON c.key = s.key WHERE s.key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        found[position] = {"similarity": similarity, "section": {"title": row[0], "content": row[1]},
+                                           "text": row[2]}
+                        break
+        return found
+
+    def diff_document(self, document, target_tech, sections):
+        """
+        Compare sections with the last recorded conversion of the same document.
+
+        Args:
+            document (str): Document identity, e.g. the uploaded file name.
+            target_tech (str): Target technology of the conversion.
+            sections (list of dict): Sections of the new version.
+
+        Returns:
+            dict: {"previous": bool, "changed": [positions of new or edited sections],
+                   "removed": number of sections that no longer exist}.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT section_hashes FROM document_versions WHERE document = ? AND target_tech = ?",
+                (document, target_tech),
+            ).fetchone()
+        if row is None:
+            return {"previous": False, "changed": list(range(len(sections))), "removed": 0}
+
+        previous = set(json.loads(row[0]))
+        hashes = [section_hash(section) for section in sections]
+        return {
+            "previous": True,
+            "changed": [index for index, digest in enumerate(hashes) if digest not in previous],
+            "removed": len(previous - set(hashes)),
+        }
+
+    def record_document(self, document, target_tech, sections):
+        """Remember the section hashes of a finished conversion for the next diff_document."""
+        hashes = [section_hash(section) for section in sections]
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO document_versions (document, target_tech, section_hashes, updated) "
+                "VALUES (?, ?, ?, ?)",
+                (document, target_tech, json.dumps(hashes), time.time()),
+            )
+            self._conn.commit()
+
+
+def convert_similar(store, sections, source_tech, target_tech, client, max_workers=4, on_section_done=None):
+    """
+    Convert sections from near-duplicates converted before, without a full conversion.
+
+    Sections whose text matches a stored one up to whitespace reuse its conversion as is;
+    other sections at least REVISE_SIMILARITY alike are sent as a diff-based edit of it (see
+    revise_conversion), since even a one-word change can alter a name or value.
+    Results are stored, so the next identical section is an exact hit.
+
+    Args:
+        store (SectionStore): Store holding earlier conversions.
+        sections (list of dict): Sections not found by an exact lookup.
+        source_tech (str): Source technology name.
+        target_tech (str): Target technology name.
+        client (OpenAI): Initialized OpenAI client instance.
+        max_workers (int): Concurrent edit requests.
+        on_section_done (callable, optional): Called with (position, text) as each section finishes.
+
+    Returns:
+        tuple: ({position: converted text}, {"reused": count, "revised": count}); failed edits are left out.
+    """
+    similar = store.find_similar(sections, source_tech, target_tech)
+    texts = {}
+    stats = {"reused": 0, "revised": 0}
+
+    def finish(position, text, kind):
+        texts[position] = text
+        stats[kind] += 1
+        metrics.inc("sections_near_duplicate_total", kind=kind)
+        store.save(sections[position], source_tech, target_tech, text)
+        if on_section_done:
+            on_section_done(position, text)
+
+    to_revise = []
+    for position, match in similar.items():
+        if _normalized_text(match["section"]) == _normalized_text(sections[position]):
+            finish(position, match["text"], "reused")
+        else:
+            to_revise.append(position)
+
+    if to_revise:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(to_revise)))) as executor:
+            revised = executor.map(
+                propagate(lambda position: revise_conversion(
+                    sections[position], similar[position]["section"], similar[position]["text"],
+                    source_tech, target_tech, client,
+                )),
+                to_revise,
+            )
+            for position, text in zip(to_revise, revised):
+                if not text.startswith("⚠️"):
+                    finish(position, text, "revised")
+    return texts, stats
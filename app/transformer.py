@@ -1,40 +1,80 @@
-from docx import Document
+import asyncio
+import difflib
+import logging
+import queue
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app import formatter
+from app.metrics import metrics, propagate, span, timed
+from app.model_router import get_router
+from app.section_planner import plan_requests
+from app.validator import MIN_CONFIDENCE, build_detection_excerpt, detect_technology_locally
+
+logger = logging.getLogger(__name__)
+
+# Model settings for section conversion. Some creativity is allowed to adapt the content well,
+# and enough tokens for detailed converted content. The model router replaces model and
+# max_tokens per request (see app.model_router), so stored sections are keyed by these settings
+# together with the router configuration (conversion_settings); changing either invalidates
+# earlier conversions. Bump CONVERSION_PROMPT_VERSION when the prompts change.
+CONVERSION_SETTINGS = {"model": "gpt-4o-mini", "temperature": 0.7, "max_tokens": 1500}
+CONVERSION_PROMPT_VERSION = 1
+# Prefix of the text returned for a section whose conversion request failed
+API_ERROR_PREFIX = "⚠️ API Error"
+
+
+def conversion_settings():
+    """
+    Return the settings that decide how a section is converted, for keying stored conversions.
+
+    Returns:
+        dict: CONVERSION_SETTINGS plus the model router's configuration under "routing".
+    """
+    return dict(CONVERSION_SETTINGS, routing=get_router().config())
+
+
+def is_failed_conversion(text):
+    """Tell whether a converted section text is missing or an API error placeholder."""
+    return text is None or text.startswith(API_ERROR_PREFIX)
 
 def save_to_docx(converted_dict, output_file):
     """
-    Save the converted design document sections into a .docx file using python-docx.
+    Save the converted design document sections into a .docx file.
+
+    Kept for existing callers; delegates to app.formatter.save_to_docx.
 
     Args:
         converted_dict (dict): Dictionary where keys are section titles and values are converted content strings.
         output_file (str): Path to output .docx file to save.
     """
-    # Create a new blank Word document
-    doc = Document()
-
-    # Loop over each converted section
-    for title, content in converted_dict.items():
-        # Add the section title as a heading of level 2
-        doc.add_heading(title, level=2)
-        # Add the converted content as a paragraph
-        doc.add_paragraph(content)
-        # Add an extra blank paragraph for spacing between sections
-        doc.add_paragraph()
-
-    # Save the document to the specified file path
-    doc.save(output_file)
+    formatter.save_to_docx(converted_dict, output_file)
 
 
-def detect_technology_from_text(text, client):
+def detect_technology_from_text(text, client, min_confidence=MIN_CONFIDENCE):
     """
-    Use OpenAI GPT API to detect the primary source technology of a design document based on its text.
+    Detect the primary source technology of a design document based on its text.
+
+    A local keyword scorer answers confident cases in milliseconds. Only low-confidence
+    documents are sent to the OpenAI GPT API, and then with a capped, representative
+    excerpt instead of the full text.
 
     Args:
         text (str): Full text extracted from the design document.
         client (OpenAI): Initialized OpenAI client instance.
+        min_confidence (float): Local confidence at or above which the LLM is skipped.
 
     Returns:
         str: Detected technology name, or "Unknown" if detection fails or is uncertain.
     """
+    with span("detect.local") as attrs:
+        local_tech, confidence = detect_technology_locally(text)
+        attrs["confidence"] = confidence
+    if confidence >= min_confidence:
+        metrics.inc("detections_total", method="local")
+        return local_tech
+    metrics.inc("detections_total", method="llm")
+
     # Construct a prompt instructing the model to identify the technology from the given document text
     prompt = f"""
 You are an expert in software design documents.
@@ -43,20 +83,21 @@ Given the following design document content, identify the primary source technol
 If unsure, respond with "Unknown".
 
 Content:
-{text}
+{build_detection_excerpt(text)}
 
 Answer with just the technology name.
 """
 
     try:
-        # Call OpenAI chat completions API with a system message for context and user prompt
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        # Call OpenAI chat completions API with a system message for context and user prompt;
+        # the detection route caps the reply at a few tokens (technology name is short)
+        router = get_router()
+        response = router.call(
+            client, router.route_detection(),
             messages=[
                 {"role": "system", "content": "You detect the technology of design documents."},
                 {"role": "user", "content": prompt},
             ],
-            max_tokens=20,     # Limit response length (technology name is short)
             temperature=0      # Use deterministic output for accuracy
         )
         # Extract the detected technology from the response
@@ -64,15 +105,19 @@ Answer with just the technology name.
         return detected_tech
 
     except Exception as e:
-        # On any API error, print it and fallback to "Unknown"
-        print(f"OpenAI API Error in detect_technology_from_text: {e}")
-        return "Unknown"
+        # On any API error, log it and fall back to the best local guess
+        logger.warning("OpenAI API error in detect_technology_from_text: %s", e)
+        metrics.inc("detection_failures_total", reason="api_error")
+        return local_tech
 
 
 def convert_any_to_any(section, source_tech, target_tech, client):
     """
     Convert a single design document section from source technology format to target technology format using OpenAI.
 
+    The model and completion limit are routed from the section's size and type, and a
+    reply cut off at the limit is converted again on the stronger route.
+
     Args:
         section (dict): Dictionary with keys "title" and "content" representing one document section.
         source_tech (str): The source technology name detected or specified.
@@ -82,40 +127,401 @@ def convert_any_to_any(section, source_tech, target_tech, client):
     Returns:
         str: Converted text for the section or an error/warning message.
     """
-    # Extract section title and content; provide defaults if missing
-    title = section.get("title", "Untitled")
+    # Extract section content; provide a default if missing
     content = section.get("content", "")
 
     # If content is empty or whitespace, return a warning string
     if not content.strip():
         return "⚠️ No content to convert."
 
+    router = get_router()
+    try:
+        # Call OpenAI chat completions API with instructions to convert design document sections
+        with span("convert.section") as attrs:
+            text, route = router.complete(
+                client, router.route_section(section),
+                messages=_conversion_messages(section, source_tech, target_tech),
+                **CONVERSION_SETTINGS
+            )
+            attrs["route"] = route["name"]
+        # Return the converted text from the response
+        return text or ""
+
+    except Exception as e:
+        # Return an error message string on API failure
+        return f"⚠️ API Error: {str(e)}"
+
+
+def _conversion_messages(section, source_tech, target_tech):
     # Build a detailed prompt guiding the model to perform the conversion
     prompt = f"""
 You are an expert in {source_tech} and {target_tech}. Convert the following {source_tech} design section into an equivalent {target_tech} format.
 
-Title: {title}
+Title: {section.get("title", "Untitled")}
 
 Content:
-{content}
+{section.get("content", "")}
 
 Output:
 """
+    return [
+        {"role": "system", "content": f"You convert design documents from {source_tech} to {target_tech}."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def revise_conversion(section, previous_section, previous_text, source_tech, target_tech, client):
+    """
+    Update an earlier conversion of a near-identical section instead of converting from scratch.
+
+    Only the line diff between the two source sections and the earlier converted text
+    are sent, so the model edits a known-good conversion rather than rewriting it.
+
+    Args:
+        section (dict): The new section, with "title" and "content".
+        previous_section (dict): The similar section that was converted before.
+        previous_text (str): Its converted text.
+        source_tech (str): The source technology name.
+        target_tech (str): The target technology name.
+        client (OpenAI): Initialized OpenAI client instance.
+
+    Returns:
+        str: Converted text for the new section or an error message.
+    """
+    old_lines = [previous_section.get("title", "Untitled")] + previous_section.get("content", "").splitlines()
+    new_lines = [section.get("title", "Untitled")] + section.get("content", "").splitlines()
+    diff = "\n".join(difflib.unified_diff(old_lines, new_lines, "previous", "current", n=1, lineterm=""))
 
+    prompt = f"""
+You earlier converted a {source_tech} design section into the {target_tech} section below. The {source_tech} section has since changed slightly.
+
+Changes to the {source_tech} section (unified diff, first line is the title):
+{diff}
+
+Previous {target_tech} section:
+{previous_text}
+
+Apply the same changes to the {target_tech} section. Keep everything the changes do not affect exactly as it is, and return the complete updated section only.
+"""
+    router = get_router()
     try:
-        # Call OpenAI chat completions API with instructions to convert design document sections
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": f"You convert design documents from {source_tech} to {target_tech}."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,    # Some creativity allowed to adapt the content well
-            max_tokens=1500     # Allow enough tokens for detailed converted content
-        )
-        # Return the converted text from the response
-        return response.choices[0].message.content.strip()
+        with span("convert.revise"):
+            text, _ = router.complete(
+                client, router.route_revision(diff, previous_text),
+                messages=[
+                    {"role": "system", "content": f"You convert design documents from {source_tech} to {target_tech}."},
+                    {"role": "user", "content": prompt},
+                ],
+                **CONVERSION_SETTINGS
+            )
+        return text or ""
 
     except Exception as e:
-        # Return an error message string on API failure
         return f"⚠️ API Error: {str(e)}"
+
+
+def stream_convert_any_to_any(section, source_tech, target_tech, client):
+    """
+    Streaming variant of convert_any_to_any that yields the converted text as it is generated.
+
+    Args:
+        section (dict): Dictionary with keys "title" and "content" representing one document section.
+        source_tech (str): The source technology name detected or specified.
+        target_tech (str): The target technology name to convert to.
+        client (OpenAI): Initialized OpenAI client instance.
+
+    Yields:
+        str: Successive pieces of the converted text (or a single error/warning message).
+    """
+    if not section.get("content", "").strip():
+        yield "⚠️ No content to convert."
+        return
+
+    router = get_router()
+    try:
+        # Text already shown cannot be taken back, so streamed sections are routed but never escalated
+        stream = router.call(
+            client, router.route_section(section),
+            messages=_conversion_messages(section, source_tech, target_tech),
+            stream=True,
+            **CONVERSION_SETTINGS
+        )
+        for chunk in stream:
+            # Usage-only chunks have no choices; role/finish chunks have no content
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    except Exception as e:
+        yield f"⚠️ API Error: {str(e)}"
+
+
+SECTION_MARKER = "<<<SECTION {number}>>>"
+SECTION_MARKER_PATTERN = re.compile(r"^\s*<<<SECTION (\d+)>>>\s*$", re.MULTILINE)
+
+
+def convert_packed_sections(sections, source_tech, target_tech, client):
+    """
+    Convert several small sections in a single request, separated by numbered marker lines.
+
+    If the model's reply is empty, was cut off at max_tokens or does not contain exactly one
+    marker per section, each section is converted on its own instead so nothing is lost.
+
+    Args:
+        sections (list of dict): Small sections, each with "title" and "content".
+        source_tech (str): The source technology name detected or specified.
+        target_tech (str): The target technology name to convert to.
+        client (OpenAI): Initialized OpenAI client instance.
+
+    Returns:
+        list of str: Converted text for each section, in the same order.
+    """
+    blocks = []
+    for number, section in enumerate(sections, start=1):
+        blocks.append(
+            f"{SECTION_MARKER.format(number=number)}\n"
+            f"Title: {section.get('title', 'Untitled')}\n\n"
+            f"Content:\n{section.get('content', '')}"
+        )
+
+    prompt = f"""
+You are an expert in {source_tech} and {target_tech}. Convert each of the following {source_tech} design sections into an equivalent {target_tech} format.
+
+Each section starts with a marker line such as {SECTION_MARKER.format(number=1)}. Start each converted section with the same marker line, keep the sections in the same order, and do not add any other marker lines.
+
+{chr(10).join(blocks)}
+
+Output:
+"""
+
+    router = get_router()
+    try:
+        with span("convert.packed", sections=len(sections)):
+            response = router.call(
+                client, router.route_packed(sections),
+                messages=[
+                    {"role": "system", "content": f"You convert design documents from {source_tech} to {target_tech}."},
+                    {"role": "user", "content": prompt}
+                ],
+                **CONVERSION_SETTINGS
+            )
+        reply = response.choices[0].message.content
+        truncated = getattr(response.choices[0], "finish_reason", None) == "length"
+    except Exception as e:
+        return [f"⚠️ API Error: {str(e)}"] * len(sections)
+
+    if truncated:
+        # Every marker may still be there, but the last section is missing its tail; converted on
+        # their own, sections escalate to a larger limit when they are cut off
+        metrics.record_retry("packed_truncated")
+        return [convert_any_to_any(section, source_tech, target_tech, client) for section in sections]
+
+    # re.split with a capture group alternates [preamble, number, text, number, text, ...]
+    parts = SECTION_MARKER_PATTERN.split(reply or "")
+    converted = {}
+    for number, text in zip(parts[1::2], parts[2::2]):
+        converted[int(number)] = text.strip()
+
+    if sorted(converted) != list(range(1, len(sections) + 1)):
+        metrics.record_retry("packed_markers_mismatch")
+        return [convert_any_to_any(section, source_tech, target_tech, client) for section in sections]
+    return [converted[number] for number in range(1, len(sections) + 1)]
+
+
+def _convert_planned_request(request, source_tech, target_tech, client):
+    # Run one request from plan_requests and return its converted text per section
+    if request["type"] == "packed":
+        return convert_packed_sections(request["sections"], source_tech, target_tech, client)
+    return [convert_any_to_any(request["sections"][0], source_tech, target_tech, client)]
+
+
+class _PlanResults:
+    """Collects request results and reassembles them into per-section text."""
+
+    def __init__(self, sections, plan):
+        self.sections = sections
+        self.texts = [None] * len(sections)
+        self.parts = {}
+        self.parts_expected = {
+            request["indices"][0]: request["parts"] for request in plan if request["type"] == "part"
+        }
+
+    def add(self, request, converted_texts):
+        """Store a finished request and return the indices of sections that are now complete."""
+        if request["type"] != "part":
+            for index, text in zip(request["indices"], converted_texts):
+                self.texts[index] = text
+            return list(request["indices"])
+
+        index = request["indices"][0]
+        self.parts.setdefault(index, {})[request["part"]] = converted_texts[0]
+        if len(self.parts[index]) < self.parts_expected[index]:
+            return []
+        self.texts[index] = "\n\n".join(self.parts[index][part] for part in sorted(self.parts[index]))
+        return [index]
+
+    def as_dict(self):
+        converted = {}
+        for section, text in zip(self.sections, self.texts):
+            converted[section.get("title", "Untitled")] = text
+        return converted
+
+
+@timed("convert.document")
+def convert_sections_concurrently(sections, source_tech, target_tech, client, max_workers=8, on_section_done=None,
+                                  pack_sections=True):
+    """
+    Convert many design document sections in parallel using a bounded thread pool.
+
+    Sections are first grouped by plan_requests: small neighbours share one request and
+    oversized sections are split at paragraph boundaries so their output is not truncated.
+    Each request runs on its own worker thread, so the total wall-clock time is close to
+    the slowest single request instead of the sum of all of them.
+
+    Args:
+        sections (list of dict): Sections as returned by parse_docx, each with "title" and "content".
+        source_tech (str): The source technology name detected or specified.
+        target_tech (str): The target technology name to convert to.
+        client (OpenAI): Initialized OpenAI client instance (thread-safe).
+        max_workers (int): Maximum number of requests running at the same time.
+        on_section_done (callable, optional): Called as on_section_done(index, title, converted_text)
+                                              from the calling thread as each section completes.
+        pack_sections (bool): Pack small sections and split large ones; False sends one request per section.
+
+    Returns:
+        dict: Section titles mapped to converted text, in the original section order.
+    """
+    if not sections:
+        return {}
+
+    if pack_sections:
+        plan = plan_requests(sections)
+    else:
+        plan = [{"type": "single", "indices": [i], "sections": [s]} for i, s in enumerate(sections)]
+    # Collect results by position so completion order never changes the output order
+    results = _PlanResults(sections, plan)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(plan)))) as executor:
+        futures = {
+            executor.submit(propagate(_convert_planned_request), request, source_tech, target_tech, client): request
+            for request in plan
+        }
+        for future in as_completed(futures):
+            request = futures[future]
+            try:
+                converted_texts = future.result()
+            except Exception as e:
+                # The conversion functions already handle API errors; this guards unexpected failures
+                converted_texts = [f"⚠️ API Error: {str(e)}"] * len(request["indices"])
+            for index in results.add(request, converted_texts):
+                if on_section_done:
+                    on_section_done(index, sections[index].get("title", "Untitled"), results.texts[index])
+
+    return results.as_dict()
+
+
+async def convert_sections_async(sections, source_tech, target_tech, client, max_concurrency=8, on_section_done=None,
+                                 pack_sections=True):
+    """
+    Async variant of convert_sections_concurrently for callers that already run an event loop.
+
+    The blocking conversion calls are dispatched to worker threads and limited by a
+    semaphore, so the same sync OpenAI client can be reused.
+
+    Args:
+        sections (list of dict): Sections as returned by parse_docx.
+        source_tech (str): The source technology name detected or specified.
+        target_tech (str): The target technology name to convert to.
+        client (OpenAI): Initialized OpenAI client instance.
+        max_concurrency (int): Maximum number of requests running at the same time.
+        on_section_done (callable, optional): Called as on_section_done(index, title, converted_text)
+                                              as each section completes.
+        pack_sections (bool): Pack small sections and split large ones; False sends one request per section.
+
+    Returns:
+        dict: Section titles mapped to converted text, in the original section order.
+    """
+    if pack_sections:
+        plan = plan_requests(sections)
+    else:
+        plan = [{"type": "single", "indices": [i], "sections": [s]} for i, s in enumerate(sections)]
+    results = _PlanResults(sections, plan)
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def convert_one(request):
+        async with semaphore:
+            converted_texts = await asyncio.to_thread(
+                propagate(_convert_planned_request), request, source_tech, target_tech, client
+            )
+        for index in results.add(request, converted_texts):
+            if on_section_done:
+                on_section_done(index, sections[index].get("title", "Untitled"), results.texts[index])
+
+    await asyncio.gather(*(convert_one(request) for request in plan))
+    return results.as_dict()
+
+
+def stream_sections_concurrently(sections, source_tech, target_tech, client, max_workers=8, pack_sections=True):
+    """
+    Convert sections concurrently while streaming their output back to the calling thread.
+
+    Requests are planned and fanned out exactly like convert_sections_concurrently. Single
+    sections and parts of split sections stream token by token; packed requests deliver
+    each of their sections in one piece when the request finishes.
+
+    Args:
+        sections (list of dict): Sections as returned by parse_docx.
+        source_tech (str): The source technology name detected or specified.
+        target_tech (str): The target technology name to convert to.
+        client (OpenAI): Initialized OpenAI client instance (thread-safe).
+        max_workers (int): Maximum number of requests running at the same time.
+        pack_sections (bool): Pack small sections and split large ones; False sends one request per section.
+
+    Yields:
+        dict: Events with keys "type", "index" and "title".
+              - "delta": adds "part" (1 unless the section was split) and "text", the new piece.
+              - "done": adds "text", the complete converted text of the section.
+    """
+    if not sections:
+        return
+
+    if pack_sections:
+        plan = plan_requests(sections)
+    else:
+        plan = [{"type": "single", "indices": [i], "sections": [s]} for i, s in enumerate(sections)]
+    results = _PlanResults(sections, plan)
+    events = queue.Queue()
+
+    @propagate
+    def run_request(request):
+        # Runs on a worker thread; everything is reported through the queue
+        try:
+            if request["type"] == "packed":
+                converted_texts = convert_packed_sections(request["sections"], source_tech, target_tech, client)
+            else:
+                index = request["indices"][0]
+                pieces = []
+                with span("convert.section", stream=True):
+                    for piece in stream_convert_any_to_any(request["sections"][0], source_tech, target_tech, client):
+                        pieces.append(piece)
+                        events.put({"type": "delta", "index": index, "part": request.get("part", 1), "text": piece})
+                converted_texts = ["".join(pieces).strip()]
+        except Exception as e:
+            converted_texts = [f"⚠️ API Error: {str(e)}"] * len(request["indices"])
+        events.put({"type": "finished", "request": request, "texts": converted_texts})
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(plan)))) as executor:
+        for request in plan:
+            executor.submit(run_request, request)
+
+        pending = len(plan)
+        while pending:
+            event = events.get()
+            if event["type"] == "delta":
+                event["title"] = sections[event["index"]].get("title", "Untitled")
+                yield event
+                continue
+
+            pending -= 1
+            for index in results.add(event["request"], event["texts"]):
+                yield {"type": "done", "index": index,
+                       "title": sections[index].get("title", "Untitled"), "text": results.texts[index]}
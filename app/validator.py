@@ -1,16 +1,117 @@
-# def detect_technology_from_text(text: str) -> str:
-#     text = text.lower()
-#     tech_keywords = {
-#         "pega": ["pega", "case management", "rules engine", "pega platform"],
-#         "servicenow": ["servicenow", "incident management", "workflow automation", "cmdb"],
-#         "power platforms": ["powerapps", "power automate", "power bi", "power platform"],
-#         "sap": ["sap", "s4hana", "abap", "erp"],
-#         "salesforce": ["salesforce", "crm", "apex", "force.com"],
-#         "customtech": ["customtech", "custom platform", "custom solution"]
-#     }
-
-#     for tech, keywords in tech_keywords.items():
-#         for kw in keywords:
-#             if kw in text:
-#                 return tech.capitalize()
-#     return "Unknown"
+import re
+
+# Keywords per technology with weights: product names are strong evidence,
+# platform-specific terms are medium, generic domain terms are weak.
+TECH_KEYWORDS = {
+    "Pega": {"pega": 3, "pega platform": 3, "pegasystems": 3, "pega infinity": 3, "pega constellation": 3,
+             "prpc": 2, "case type": 1, "data page": 2, "flow action": 2, "decisioning": 1},
+    "ServiceNow": {"servicenow": 3, "service-now": 3, "now platform": 3, "flow designer": 2, "glide": 2,
+                   "cmdb": 2, "itsm": 1, "service portal": 2, "incident management": 1},
+    "Salesforce": {"salesforce": 3, "force.com": 3, "apex": 2, "visualforce": 3, "lightning component": 2,
+                   "service cloud": 2, "sales cloud": 2, "process builder": 2, "soql": 2, "crm": 1},
+    "SAP": {"sap": 3, "s/4hana": 3, "s4hana": 3, "abap": 3, "fiori": 2, "sap btp": 3, "netweaver": 2,
+            "idoc": 2, "erp": 1},
+    "Power Platforms": {"power platform": 3, "power automate": 3, "power apps": 3, "powerapps": 3,
+                        "power bi": 2, "dataverse": 3, "power fx": 3, "copilot studio": 2},
+    "Appian": {"appian": 3, "sail": 2, "appian records": 3, "process model": 1},
+    "Blue Prism": {"blue prism": 3, "blueprism": 3, "digital worker": 2, "object studio": 2,
+                   "process studio": 2, "rpa": 1},
+    "UiPath": {"uipath": 3, "orchestrator": 1, "studiox": 3, "rpa": 1},
+    "Java": {"java": 3, "spring boot": 3, "jakarta ee": 3, "hibernate": 2, "maven": 2, "jvm": 2},
+    ".NET": {".net": 3, "asp.net": 3, "c#": 3, "entity framework": 2, "nuget": 2, "blazor": 3},
+    "CustomTech": {"customtech": 3, "custom platform": 2, "custom solution": 1},
+}
+
+# Matches below this confidence are handed to the LLM
+MIN_CONFIDENCE = 0.6
+# Total keyword weight considered enough evidence on its own
+MIN_EVIDENCE = 12
+
+
+def _build_keyword_pattern(tech_keywords):
+    # One alternation for all keywords, longest first so "power platform" wins over shorter overlaps.
+    # Lookarounds instead of \b so keywords starting or ending in punctuation (".net", "c#") still match.
+    keywords = sorted({kw for weights in tech_keywords.values() for kw in weights}, key=len, reverse=True)
+    alternation = "|".join(re.escape(kw) for kw in keywords)
+    return re.compile(rf"(?<![\w.])(?:{alternation})(?![\w])", re.IGNORECASE)
+
+
+KEYWORD_PATTERN = _build_keyword_pattern(TECH_KEYWORDS)
+
+# Which technologies each keyword counts towards, and with what weight
+_KEYWORD_INDEX = {}
+for _tech, _weights in TECH_KEYWORDS.items():
+    for _keyword, _weight in _weights.items():
+        _KEYWORD_INDEX.setdefault(_keyword, []).append((_tech, _weight))
+
+
+def score_technologies(text):
+    """
+    Score every known technology against a document's text in a single regex pass.
+
+    Args:
+        text (str): Document text.
+
+    Returns:
+        dict: Technology name mapped to its total keyword weight (only technologies with hits).
+    """
+    scores = {}
+    for match in KEYWORD_PATTERN.finditer(text):
+        for tech, weight in _KEYWORD_INDEX.get(match.group(0).lower(), ()):
+            scores[tech] = scores.get(tech, 0) + weight
+    return scores
+
+
+def detect_technology_locally(text):
+    """
+    Detect a document's source technology from keyword evidence, without any API call.
+
+    Confidence combines how clearly the top technology beats the runner-up with how much
+    evidence there is overall, so a single stray mention never yields a confident answer.
+
+    Args:
+        text (str): Document text.
+
+    Returns:
+        tuple: (technology name or "Unknown", confidence between 0 and 1).
+    """
+    scores = score_technologies(text)
+    if not scores:
+        return "Unknown", 0.0
+
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    top_tech, top_score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+
+    margin = (top_score - runner_up) / top_score
+    evidence = min(1.0, top_score / MIN_EVIDENCE)
+    return top_tech, round(margin * evidence, 3)
+
+
+def build_detection_excerpt(text, max_chars=6000, slices=6):
+    """
+    Build a capped, representative excerpt of a long document for LLM detection.
+
+    The opening of the document (usually overview and scope) is kept, and the rest of the
+    budget is spread as evenly spaced slices across the remainder.
+
+    Args:
+        text (str): Full document text.
+        max_chars (int): Maximum excerpt length.
+        slices (int): Number of evenly spaced slices taken after the opening.
+
+    Returns:
+        str: The excerpt, or the full text if it already fits.
+    """
+    if len(text) <= max_chars:
+        return text
+
+    head_chars = max_chars // 2
+    slice_chars = (max_chars - head_chars) // slices
+    parts = [text[:head_chars]]
+    remainder_start = head_chars
+    step = (len(text) - remainder_start) // slices
+    for i in range(slices):
+        start = remainder_start + i * step
+        parts.append(text[start:start + slice_chars])
+    return "\n...\n".join(parts)
@@ -0,0 +1,174 @@
+"""
+Deterministic stand-in for the OpenAI client, for benchmarks that must not touch the network.
+
+FakeOpenAIClient mimics client.chat.completions.create closely enough for every call the
+pipeline makes: plain and streamed section conversions, packed sections with marker
+lines, near-duplicate edit requests, technology detection, diagram descriptions, DOT generation and the structured
+single-call diagram conversion. Replies are derived from the request, so the same input
+always produces the same output, replies longer than max_tokens are cut off with
+finish_reason "length", and latency is simulated with sleep.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from app.section_planner import count_tokens
+from app.transformer import SECTION_MARKER, SECTION_MARKER_PATTERN
+
+CANNED_DOT = (
+    "digraph Converted {\n"
+    "    rankdir=LR;\n"
+    "    node [shape=box];\n"
+    "    User -> Portal -> Workflow -> Integration -> Backend;\n"
+    "    Workflow -> Notification [label=\"status\"];\n"
+    "}"
+)
+CANNED_DESCRIPTION = (
+    "The diagram shows a user submitting a request through the portal. A workflow routes it "
+    "to an integration layer that calls the backend system and sends status notifications."
+)
+
+
+class FakeOpenAIClient:
+    """
+    Offline replacement for openai.OpenAI with simulated latency.
+
+    Args:
+        latency (float): Fixed seconds per request, before the first token.
+        seconds_per_token (float): Additional seconds per generated token.
+        jitter (float): Random extra latency as a fraction of the total (seeded, reproducible).
+        seed (int): Seed for the jitter.
+        failure_rate (float): Fraction of requests that raise, to exercise error paths.
+        model_latency (dict, optional): Model name mapped to its fixed latency, overriding latency,
+                                        e.g. to compare routing between a fast and a slow model.
+    """
+
+    def __init__(self, latency=0.05, seconds_per_token=0.0, jitter=0.0, seed=0, failure_rate=0.0,
+                 model_latency=None):
+        self.latency = latency
+        self.model_latency = model_latency or {}
+        self.seconds_per_token = seconds_per_token
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def _draw(self):
+        with self._lock:
+            return self._random.random(), self._random.random()
+
+    def create(self, model=None, messages=None, stream=False, response_format=None, **kwargs):
+        """Answer a chat.completions.create call with a canned, request-derived reply."""
+        jitter_draw, failure_draw = self._draw()
+        if failure_draw < self.failure_rate:
+            time.sleep(self.latency)
+            raise RuntimeError("Simulated API failure")
+
+        text = _reply_for(messages or [], response_format)
+        finish_reason = "stop"
+        max_tokens = kwargs.get("max_tokens")
+        if max_tokens and count_tokens(text) > max_tokens:
+            text, finish_reason = text[:max_tokens * 4], "length"
+        prompt_tokens = sum(count_tokens(_message_text(m)) for m in messages or [])
+        completion_tokens = count_tokens(text)
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+
+        latency = self.model_latency.get(model, self.latency)
+        delay = (latency + self.seconds_per_token * completion_tokens) * (1 + self.jitter * jitter_draw)
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+        if stream:
+            return self._stream(text, latency, delay, usage, model, finish_reason)
+
+        time.sleep(delay)
+        message = SimpleNamespace(role="assistant", content=text)
+        return SimpleNamespace(
+            id=f"fake-{hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]}",
+            model=model,
+            choices=[SimpleNamespace(index=0, message=message, finish_reason=finish_reason)],
+            usage=usage,
+        )
+
+    def _stream(self, text, latency, delay, usage, model, finish_reason):
+        # First token after the fixed latency, the rest spread over the per-token time
+        pieces = re.findall(r"\S+\s*|\s+", text) or [""]
+        time.sleep(latency)
+        per_piece = max(0.0, delay - latency) / len(pieces)
+        for piece in pieces:
+            if per_piece:
+                time.sleep(per_piece)
+            delta = SimpleNamespace(role=None, content=piece)
+            yield SimpleNamespace(model=model, usage=None,
+                                  choices=[SimpleNamespace(index=0, delta=delta, finish_reason=None)])
+        done = SimpleNamespace(role=None, content=None)
+        yield SimpleNamespace(model=model, usage=usage,
+                              choices=[SimpleNamespace(index=0, delta=done, finish_reason=finish_reason)])
+
+    def stats(self):
+        """Return call and token counters."""
+        return {"calls": self.calls, "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens}
+
+
+def _message_text(message):
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content
+
+
+def _has_image(messages):
+    return any(isinstance(m.get("content"), list) and any(p.get("type") == "image_url" for p in m["content"])
+               for m in messages)
+
+
+def _convert_text(title, content):
+    # Roughly the size of the input, like a real conversion
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    body = "\n".join(f"- Target equivalent: {line}" for line in lines) or "- No content."
+    return f"{title}\n\n{body}"
+
+
+def _reply_for(messages, response_format):
+    prompt = _message_text(messages[-1]) if messages else ""
+
+    if response_format is not None:
+        return json.dumps({"description": CANNED_DESCRIPTION, "dot": CANNED_DOT})
+    if _has_image(messages):
+        return CANNED_DESCRIPTION
+    if "Graphviz DOT" in prompt:
+        if "fails to parse" in prompt:
+            return CANNED_DOT
+        return f"```dot\n{CANNED_DOT}\n```"
+    if "identify the primary source technology" in prompt:
+        return "Unknown"
+    if "(unified diff" in prompt:
+        # Edit request for a near-duplicate section: the earlier conversion, unchanged
+        previous = prompt.split(" section:\n", 1)[-1]
+        return previous.rsplit("\n\nApply the same changes", 1)[0].strip()
+
+    if SECTION_MARKER_PATTERN.search(prompt):
+        # Packed request: echo every marker with a converted body
+        parts = SECTION_MARKER_PATTERN.split(prompt.split("Output:")[0])
+        replies = []
+        for number, block in zip(parts[1::2], parts[2::2]):
+            title = re.search(r"Title: (.*)", block)
+            content = block.split("Content:", 1)[-1]
+            replies.append(f"{SECTION_MARKER.format(number=number)}\n"
+                           f"{_convert_text(title.group(1) if title else 'Untitled', content)}")
+        return "\n\n".join(replies)
+
+    title = re.search(r"^Title: (.*)$", prompt, re.MULTILINE)
+    content = prompt.split("Content:", 1)[-1].rsplit("Output:", 1)[0]
+    return _convert_text(title.group(1) if title else "Untitled", content)
@@ -0,0 +1,277 @@
+"""
+Offline pipeline benchmark.
+
+Usage:
+    python -m benchmarks.run [--corpus .] [--latency 0.05] [--output results.json]
+    python -m benchmarks.run --compare results.json --threshold 0.2
+
+Runs every stage of the conversion pipeline over the *_Design.docx corpus against
+FakeOpenAIClient, so no API key or network is needed and runs are comparable. Each
+stage reports wall time, throughput, simulated API calls and peak Python heap; the
+whole run reports peak RSS. Results are JSON; --compare checks them against an
+earlier run and exits non-zero when a stage got slower than the threshold allows.
+"""
+import argparse
+import contextlib
+import gc
+import glob
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+from benchmarks.fake_openai import FakeOpenAIClient
+
+from app.diagram_handler import render_many
+from app.diagram_pipeline import DIAGRAM_MODES, convert_diagram
+from app.formatter import build_docx
+from app.image_utils import extract_images_from_docx, is_decorative_image
+from app.parser import parse_docx
+from app.transformer import convert_any_to_any, convert_sections_concurrently, detect_technology_from_text
+
+STAGES = ("parse", "detect", "convert_sequential", "convert_concurrent", "image_pipeline", "render", "docx_write")
+
+
+def find_corpus(corpus_dir):
+    """Return the *_Design.docx files in corpus_dir, sorted by name."""
+    return sorted(glob.glob(os.path.join(corpus_dir, "*_Design.docx")))
+
+
+def _measure(stage, func, client, trace_memory):
+    # Run one stage and collect its timings, throughput and memory
+    gc.collect()
+    calls_before = client.calls
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    items, errors = func()
+    wall = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "stage": stage,
+        "wall_seconds": round(wall, 4),
+        "items": items,
+        "items_per_sec": round(items / wall, 2) if wall else 0.0,
+        "api_calls": client.calls - calls_before,
+        "errors": errors,
+        "peak_python_bytes": peak,
+    }
+
+
+def run_once(documents, client, args, stages):
+    """
+    Run the selected stages once over all documents.
+
+    Returns:
+        dict: Stage name mapped to its measurement.
+    """
+    state = {"sections": {}, "source": {}, "converted": {}, "dot_codes": {}, "images": {}}
+    results = {}
+
+    def parse():
+        for path in documents:
+            state["sections"][path] = parse_docx(path)
+        return sum(len(s) for s in state["sections"].values()), 0
+
+    def detect():
+        for path in documents:
+            text = "\n".join(sec.get("content", "") for sec in state["sections"][path])
+            state["source"][path] = detect_technology_from_text(text, client)
+        return len(documents), 0
+
+    def convert_sequential():
+        count = errors = 0
+        for path in documents:
+            for section in state["sections"][path]:
+                text = convert_any_to_any(section, state["source"].get(path, "Unknown"), args.target, client)
+                errors += text.startswith("⚠️ API Error")
+                count += 1
+        return count, errors
+
+    def convert_concurrent():
+        count = errors = 0
+        for path in documents:
+            converted = convert_sections_concurrently(
+                state["sections"][path], state["source"].get(path, "Unknown"), args.target, client,
+                max_workers=args.workers,
+            )
+            state["converted"][path] = converted
+            errors += sum(text.startswith("⚠️ API Error") for text in converted.values())
+            count += len(state["sections"][path])
+        return count, errors
+
+    def image_pipeline():
+        count = errors = 0
+        for path in documents:
+            codes = []
+            for image_bytes, _ in extract_images_from_docx(path):
+                if is_decorative_image(image_bytes):
+                    continue
+                count += 1
+                try:
+                    result = convert_diagram(image_bytes, state["source"].get(path, "Unknown"), args.target, client,
+                                             mode=args.diagram_mode)
+                    if result["dot_code"]:
+                        codes.append(result["dot_code"])
+                    else:
+                        errors += 1
+                except Exception:
+                    errors += 1
+            state["dot_codes"][path] = codes
+        return count, errors
+
+    def render():
+        count = errors = 0
+        for path in documents:
+            codes = state["dot_codes"].get(path, [])
+            images = render_many(codes, engine=args.graphviz, max_workers=args.render_workers)
+            state["images"][path] = [image for image in images if image]
+            count += len(codes)
+            errors += sum(image is None for image in images)
+        return count, errors
+
+    def docx_write():
+        for path in documents:
+            converted = state["converted"].get(path) or {
+                sec.get("title", "Untitled"): sec.get("content", "") for sec in state["sections"][path]
+            }
+            build_docx(converted, state["images"].get(path, []))
+        return len(documents), 0
+
+    stage_funcs = {
+        "parse": parse, "detect": detect, "convert_sequential": convert_sequential,
+        "convert_concurrent": convert_concurrent, "image_pipeline": image_pipeline,
+        "render": render, "docx_write": docx_write,
+    }
+    for stage in STAGES:
+        # parse always runs because every later stage needs the sections
+        if stage in stages or stage == "parse":
+            results[stage] = _measure(stage, stage_funcs[stage], client, args.trace_memory)
+    return results
+
+
+def summarize(runs):
+    """Combine repeated runs into one entry per stage, using the median wall time."""
+    summary = {}
+    for stage in runs[0]:
+        samples = [run[stage] for run in runs]
+        walls = [s["wall_seconds"] for s in samples]
+        median = statistics.median(walls)
+        peaks = [s["peak_python_bytes"] for s in samples if s["peak_python_bytes"] is not None]
+        summary[stage] = {
+            "wall_seconds": round(median, 4),
+            "min_wall_seconds": min(walls),
+            "max_wall_seconds": max(walls),
+            "items": samples[0]["items"],
+            "items_per_sec": round(samples[0]["items"] / median, 2) if median else 0.0,
+            "api_calls": samples[0]["api_calls"],
+            "errors": max(s["errors"] for s in samples),
+            "peak_python_bytes": max(peaks) if peaks else None,
+        }
+    return summary
+
+
+def compare(current, baseline, threshold):
+    """
+    Compare stage wall times against a baseline result.
+
+    Returns:
+        list of dict: One entry per shared stage with the ratio and a regression flag.
+    """
+    rows = []
+    for stage, result in current["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before or not before["wall_seconds"]:
+            continue
+        ratio = result["wall_seconds"] / before["wall_seconds"]
+        rows.append({"stage": stage, "baseline": before["wall_seconds"], "current": result["wall_seconds"],
+                     "ratio": round(ratio, 3), "regression": ratio > 1 + threshold})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the conversion pipeline offline.")
+    parser.add_argument("--corpus", default=".", help="Folder containing *_Design.docx files")
+    parser.add_argument("--target", default="ServiceNow", help="Target technology for conversions")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES), help="Stages to run")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the median is reported")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per API request")
+    parser.add_argument("--seconds-per-token", type=float, default=0.0, help="Simulated seconds per output token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random extra latency as a fraction")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the latency jitter")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent section requests per document")
+    parser.add_argument("--render-workers", type=int, default=4, help="Concurrent Graphviz renders")
+    parser.add_argument("--graphviz", default="dot", help="Graphviz layout engine executable")
+    parser.add_argument("--diagram-mode", choices=DIAGRAM_MODES, default="two_step")
+    parser.add_argument("--no-trace-memory", dest="trace_memory", action="store_false",
+                        help="Skip tracemalloc (it slows Python-heavy stages down)")
+    parser.add_argument("--output", help="Write the JSON result here instead of stdout")
+    parser.add_argument("--compare", help="Earlier JSON result to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown before a stage regresses")
+    args = parser.parse_args(argv)
+
+    documents = find_corpus(args.corpus)
+    if not documents:
+        print(f"No *_Design.docx files found in {args.corpus}", file=sys.stderr)
+        return 1
+
+    client = FakeOpenAIClient(latency=args.latency, seconds_per_token=args.seconds_per_token,
+                              jitter=args.jitter, seed=args.seed)
+    started = time.perf_counter()
+    # Pipeline log output goes to stderr so stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        runs = [run_once(documents, client, args, set(args.stages)) for _ in range(max(1, args.repeat))]
+
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "corpus": [os.path.basename(path) for path in documents],
+            "target": args.target,
+            "repeat": args.repeat,
+            "latency": args.latency,
+            "seconds_per_token": args.seconds_per_token,
+            "jitter": args.jitter,
+            "workers": args.workers,
+            "diagram_mode": args.diagram_mode,
+            "trace_memory": args.trace_memory,
+        },
+        "stages": summarize(runs),
+        "total_seconds": round(time.perf_counter() - started, 4),
+        # ru_maxrss is kilobytes on Linux and bytes on macOS
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+        "client": client.stats(),
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            rows = compare(result, json.load(f), args.threshold)
+        result["comparison"] = rows
+        for row in rows:
+            flag = "REGRESSION" if row["regression"] else "ok"
+            print(f"{row['stage']:<20} {row['baseline']:>9.4f}s -> {row['current']:>9.4f}s  x{row['ratio']:<6} {flag}",
+                  file=sys.stderr)
+        exit_code = 1 if any(row["regression"] for row in rows) else 0
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        for stage, stats in result["stages"].items():
+            print(f"{stage:<20} {stats['wall_seconds']:>9.4f}s  {stats['items_per_sec']:>9} items/s", file=sys.stderr)
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
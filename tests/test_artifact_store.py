@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+from app import artifact_store
+from app.artifact_store import ArtifactStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(artifact_store.time, "time", lambda: now[0])
+    return now
+
+
+def _blobs(store):
+    return sorted(name for _, _, files in os.walk(os.path.join(store.root, "blobs")) for name in files)
+
+
+def test_identical_content_is_stored_once(tmp_path):
+    store = ArtifactStore(root=str(tmp_path))
+    digest = store.put(b"same bytes", "job-a", "input.docx")
+    assert store.put(b"same bytes", "job-b", "input.docx") == digest
+
+    assert _blobs(store) == [digest]
+    assert store.get("job-b", "input.docx") == b"same bytes"
+    assert store.get("job-b", "missing.docx") is None
+    assert store.stats() == {"scopes": 2, "artifacts": 2, "blobs": 1, "bytes": 10, "memory_bytes": 10}
+    with store.open("job-a", "input.docx") as f:
+        assert f.read() == b"same bytes"
+
+
+def test_replaced_and_deleted_artifacts_free_unshared_blobs(tmp_path):
+    store = ArtifactStore(root=str(tmp_path))
+    shared = store.put(b"shared", "job-a", "input.docx")
+    store.put(b"shared", "job-b", "input.docx")
+    store.put(b"first", "job-a", "output.docx")
+    second = store.put(b"second", "job-a", "output.docx")
+
+    assert _blobs(store) == sorted([shared, second])
+    store.delete_scope("job-a")
+    assert _blobs(store) == [shared]
+    assert store.get("job-a", "output.docx") is None
+    assert store.get("job-b", "input.docx") == b"shared"
+
+
+def test_cleanup_removes_expired_scopes_but_keeps_running_ones(tmp_path, clock):
+    store = ArtifactStore(root=str(tmp_path), ttl_seconds=3600)
+    store.put(b"old", "old-job", "output.docx")
+    store.put(b"running", "running-job", "output.docx")
+    clock[0] += 1800
+    store.put(b"recent", "recent-job", "output.docx")
+    clock[0] += 1800 + 1
+
+    assert store.cleanup(keep=["running-job"])["scopes"] == 1
+    assert store.get("old-job", "output.docx") is None
+    assert store.get("running-job", "output.docx") == b"running"
+    assert store.get("recent-job", "output.docx") == b"recent"
+
+
+def test_reading_an_artifact_keeps_its_scope_alive(tmp_path, clock):
+    store = ArtifactStore(root=str(tmp_path), ttl_seconds=3600)
+    store.put(b"content", "job-a", "output.docx")
+    clock[0] += 3000
+    store.get("job-a", "output.docx")
+    clock[0] += 3000
+
+    assert store.cleanup()["scopes"] == 0
+
+
+def test_cleanup_evicts_least_recently_used_scopes_beyond_max_bytes(tmp_path, clock):
+    store = ArtifactStore(root=str(tmp_path), ttl_seconds=0, max_bytes=250)
+    for scope in ("job-a", "job-b", "job-c"):
+        store.put(scope.encode() * 20, scope, "output.docx")  # 100 bytes each
+        clock[0] += 10
+    store.get("job-a", "output.docx")
+
+    assert store.cleanup() == {"scopes": 1, "bytes": 200}
+    assert store.get("job-b", "output.docx") is None
+    assert store.get("job-a", "output.docx") is not None
+
+
+def test_memory_tier_serves_small_artifacts_without_the_disk(tmp_path):
+    store = ArtifactStore(root=str(tmp_path), memory_bytes=100, memory_item_bytes=60)
+    small = store.put(b"s" * 50, "job-a", "small.png")
+    store.put(b"L" * 80, "job-a", "large.png")
+    assert store.stats()["memory_bytes"] == 50
+
+    os.remove(store.blob_path(small))
+    assert store.get("job-a", "small.png") == b"s" * 50
+
+    store.put(b"t" * 60, "job-a", "other.png")
+    assert store.stats()["memory_bytes"] == 60  # the older entry was evicted
+    assert store.get("job-a", "small.png") is None
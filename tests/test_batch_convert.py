@@ -0,0 +1,104 @@
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import batch_convert
+from app.diagram_index import DiagramIndex
+from app.section_store import SectionStore
+from benchmarks.fake_openai import FakeOpenAIClient
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(REPO_ROOT, "SAP_Design.docx")
+
+
+class FailingTargetClient(FakeOpenAIClient):
+    """Fake client whose conversions to one target technology fail."""
+
+    def __init__(self, failing_target=None):
+        super().__init__(latency=0)
+        self.failing_target = failing_target
+
+    def create(self, messages=None, **kwargs):
+        if self.failing_target and any(f"to {self.failing_target}" in str(m.get("content")) for m in messages or []):
+            raise RuntimeError("Simulated API failure")
+        return super().create(messages=messages, **kwargs)
+
+
+@pytest.fixture
+def batch(monkeypatch, tmp_path):
+    # Worker state is set up in-process, so the run needs no API key, network or child processes
+    monkeypatch.setattr(batch_convert, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(batch_convert, "_worker_section_store", SectionStore(":memory:"))
+    monkeypatch.setattr(batch_convert, "_worker_diagram_index", DiagramIndex(":memory:"))
+
+    input_dir = tmp_path / "input"
+    for wave in ("wave1", "wave2"):
+        (input_dir / wave).mkdir(parents=True)
+    shutil.copy(SAMPLE, input_dir / "wave1" / "design.docx")
+    shutil.copy(SAMPLE, input_dir / "wave2" / "design.docx")
+    with open(input_dir / "wave2" / "design.docx", "ab") as f:
+        f.write(b"\0")  # Same name, different bytes
+
+    def run(client, output_dir=tmp_path / "output"):
+        monkeypatch.setattr(batch_convert, "_worker_client", client)
+        return batch_convert.run_batch(str(input_dir), ["Mermaid", "PlantUML"], str(output_dir),
+                                       workers=2, include_diagrams=False)
+
+    run.input_dir = input_dir
+    return run, tmp_path / "output"
+
+
+def _manifest(output_dir):
+    with open(output_dir / batch_convert.MANIFEST_NAME, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_same_named_documents_keep_separate_outputs(batch):
+    run, output_dir = batch
+    summary = run(FailingTargetClient())
+
+    assert summary["documents_converted"] == 4
+    assert summary["failures"] == 0
+    for wave in ("wave1", "wave2"):
+        for target in ("Mermaid", "PlantUML"):
+            assert (output_dir / wave / f"design_{target}.docx").exists()
+
+
+def test_resume_redoes_only_failed_targets(batch):
+    run, output_dir = batch
+    first = run(FailingTargetClient(failing_target="PlantUML"))
+    assert (first["documents_converted"], first["failures"]) == (2, 2)
+    failed = [entry for entry in _manifest(output_dir) if entry["status"] == "failed"]
+    assert {entry["target_tech"] for entry in failed} == {"PlantUML"}
+    assert all("section(s) failed to convert" in entry["error"] for entry in failed)
+
+    second = run(FailingTargetClient())
+    assert (second["documents_converted"], second["failures"], second["skipped"]) == (2, 0, 2)
+
+    third = run(FailingTargetClient())
+    assert (third["documents_converted"], third["skipped"]) == (0, 4)
+
+
+def test_manifest_ignores_a_torn_last_line(tmp_path):
+    manifest = tmp_path / batch_convert.MANIFEST_NAME
+    manifest.write_text(
+        json.dumps({"sha256": "a", "target_tech": "Mermaid", "status": "done"}) + "\n"
+        + json.dumps({"sha256": "b", "target_tech": "Mermaid", "status": "failed"}) + "\n"
+        + '{"sha256": "c", "target',
+        encoding="utf-8",
+    )
+    assert batch_convert.load_manifest(str(manifest)) == {("a", "Mermaid")}
+
+
+@pytest.mark.parametrize("output_name", ["converted", None], ids=["inside input", "same as input"])
+def test_outputs_are_never_picked_up_as_inputs(batch, output_name):
+    run, _ = batch
+    output_dir = run.input_dir / output_name if output_name else run.input_dir
+    first = run(FailingTargetClient(), output_dir)
+    assert first["documents_converted"] == 4
+
+    second = run(FailingTargetClient(), output_dir)
+    assert (second["documents_converted"], second["skipped"]) == (0, 4)
@@ -0,0 +1,70 @@
+import subprocess
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+from app import diagram_handler
+from app.diagram_handler import render_dot_bytes, render_many
+
+
+@pytest.fixture
+def graphviz(monkeypatch):
+    """Replace the Graphviz executable with a stub that echoes its input and records each run."""
+    runs = []
+
+    def run(args, input=None, capture_output=False, timeout=None, check=False):
+        runs.append(input.decode("utf-8"))
+        if b"broken" in input:
+            raise subprocess.CalledProcessError(1, args, stderr=b"syntax error in line 1")
+        if b"slow" in input:
+            raise subprocess.TimeoutExpired(args, timeout)
+        return SimpleNamespace(stdout=b"IMG:" + input)
+
+    monkeypatch.setattr(diagram_handler.subprocess, "run", run)
+    monkeypatch.setattr(diagram_handler, "_render_cache", OrderedDict())
+    monkeypatch.setattr(diagram_handler, "_render_cache_bytes", 0)
+    return runs
+
+
+def test_repeated_render_is_served_from_the_cache(graphviz):
+    first = render_dot_bytes("digraph { a -> b }")
+    again = render_dot_bytes("digraph { a -> b }")
+    svg = render_dot_bytes("digraph { a -> b }", output_format="svg")
+
+    assert first == again == svg == b"IMG:digraph { a -> b }"
+    assert len(graphviz) == 2
+
+
+def test_render_cache_evicts_the_oldest_entries(graphviz, monkeypatch):
+    monkeypatch.setattr(diagram_handler, "RENDER_CACHE_MAX_BYTES", 100)
+    for name in ("a", "b", "c"):
+        render_dot_bytes(f"digraph {{ {name} }}" + " " * 30)
+    render_dot_bytes("digraph { c }" + " " * 30)
+    render_dot_bytes("digraph { a }" + " " * 30)
+
+    assert len(graphviz) == 4
+    assert diagram_handler._render_cache_bytes <= 100
+
+
+def test_render_failures_return_none_and_are_counted(graphviz, monkeypatch):
+    counted = []
+    monkeypatch.setattr(diagram_handler.metrics, "inc", lambda name, *args, **labels: counted.append((name, labels)))
+
+    assert render_dot_bytes("digraph { broken") is None
+    assert render_dot_bytes("digraph { slow }", timeout=1) is None
+    failures = [entry for entry in counted if entry[0] == "render_failures_total"]
+    assert failures == [("render_failures_total", {"engine": "dot", "reason": "invalid_dot"}),
+                        ("render_failures_total", {"engine": "dot", "reason": "timeout"})]
+    # Failures are not cached
+    render_dot_bytes("digraph { broken")
+    assert len(graphviz) == 3
+
+
+def test_render_many_keeps_order_and_renders_duplicates_once(graphviz):
+    codes = ["digraph { a }", None, "digraph { b }", "digraph { a }", "digraph { broken"]
+    images = render_many(codes)
+
+    assert images == [b"IMG:digraph { a }", None, b"IMG:digraph { b }", b"IMG:digraph { a }", None]
+    assert sorted(graphviz) == ["digraph { a }", "digraph { b }", "digraph { broken"]
+    assert render_many([None, ""]) == [None, None]
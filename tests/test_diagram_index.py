@@ -0,0 +1,65 @@
+import pytest
+
+from app.diagram_index import DiagramIndex
+
+LABELS = {"api gateway", "order service"}
+
+
+@pytest.fixture
+def index():
+    index = DiagramIndex(":memory:", max_distance=6)
+    index.add("a" * 64, 0b1011, "Visio", "Mermaid", "description", "digraph { a }", labels=LABELS)
+    index.add("b" * 64, 0xF0F0, "Visio", "Mermaid", "unlabelled", "digraph { b }")
+    return index
+
+
+def test_identical_image_is_an_exact_hit(index):
+    match = index.lookup("a" * 64, 0, "Visio", "Mermaid")
+    assert (match["dot_code"], match["exact"]) == ("digraph { a }", True)
+
+
+@pytest.mark.parametrize("source_tech, target_tech, mode", [
+    ("Lucidchart", "Mermaid", "two_step"),
+    ("Visio", "PlantUML", "two_step"),
+    ("Visio", "Mermaid", "ocr"),
+])
+def test_key_covers_technologies_and_mode(index, source_tech, target_tech, mode):
+    assert index.lookup("a" * 64, 0b1011, source_tech, target_tech, mode=mode) is None
+
+
+NEAR = 0b1011 ^ 0b1110000  # Three bits from the labelled entry: beyond unlabelled_distance, within max_distance
+
+
+def test_near_match_needs_the_same_labels(index):
+    assert index.lookup("c" * 64, NEAR, "Visio", "Mermaid") is None
+    assert index.lookup("c" * 64, NEAR, "Visio", "Mermaid", labels={"api gateway", "billing"}) is None
+    match = index.lookup("c" * 64, NEAR, "Visio", "Mermaid", labels={"order service", "api gateway"})
+    assert (match["dot_code"], match["distance"], match["exact"]) == ("digraph { a }", 3, False)
+
+
+def test_without_labels_on_either_side_only_close_hashes_match(index):
+    # Stored without labels
+    assert index.lookup("c" * 64, 0xF0F1, "Visio", "Mermaid", labels=LABELS)["dot_code"] == "digraph { b }"
+    assert index.lookup("c" * 64, 0xF0F7, "Visio", "Mermaid", labels=LABELS) is None
+    # Stored with labels, none readable now
+    assert index.lookup("c" * 64, 0b1001, "Visio", "Mermaid", labels=set())["dot_code"] == "digraph { a }"
+    assert index.lookup("c" * 64, 0b0100, "Visio", "Mermaid", labels=set()) is None
+
+
+def test_labels_decide_even_for_close_hashes(index):
+    assert index.lookup("c" * 64, 0b1010, "Visio", "Mermaid", labels={"billing"}) is None
+
+
+def test_labels_are_only_read_for_a_near_candidate(index):
+    reads = []
+
+    def read_labels():
+        reads.append(1)
+        return LABELS
+
+    assert index.lookup("a" * 64, 0b1011, "Visio", "Mermaid", read_labels=read_labels)["exact"]
+    assert index.lookup("c" * 64, ~0b1011 & (2 ** 64 - 1), "Visio", "Mermaid", read_labels=read_labels) is None
+    assert reads == []
+    assert index.lookup("c" * 64, NEAR, "Visio", "Mermaid", read_labels=read_labels)["exact"] is False
+    assert reads == [1]
+    assert (index.hits, index.misses) == (2, 1)
@@ -0,0 +1,106 @@
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from app import diagram_pipeline
+from app.diagram_index import DiagramIndex
+from app.diagram_pipeline import convert_diagram
+from benchmarks.fake_openai import FakeOpenAIClient
+
+
+def _diagram(size=(400, 240), image_format="PNG"):
+    image = Image.new("RGB", (400, 240), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((20, 40, 160, 120), outline="black", width=3)
+    draw.rectangle((240, 120, 380, 200), outline="black", width=3)
+    draw.line((160, 80, 240, 160), fill="black", width=3)
+    output = io.BytesIO()
+    image.resize(size).save(output, image_format)
+    return output.getvalue()
+
+
+@pytest.fixture
+def no_ocr(monkeypatch):
+    monkeypatch.setattr(diagram_pipeline, "ocr_image", lambda image_bytes: None)
+
+
+def test_reencoded_diagram_is_reused_without_ocr(no_ocr):
+    index = DiagramIndex(":memory:")
+    client = FakeOpenAIClient(latency=0)
+    first = convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index)
+    calls = client.calls
+
+    again = convert_diagram(_diagram((380, 228), "JPEG"), "Visio", "Mermaid", client, index=index)
+    assert first["dot_code"] and not first["reused"]
+    assert again["reused"] and again["dot_code"] == first["dot_code"]
+    assert client.calls == calls
+
+
+def test_reuse_is_scoped_to_the_source_technology(no_ocr):
+    index = DiagramIndex(":memory:")
+    client = FakeOpenAIClient(latency=0)
+    convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index)
+    assert not convert_diagram(_diagram(), "Lucidchart", "Mermaid", client, index=index)["reused"]
+
+
+class NoStructuredOutputClient(FakeOpenAIClient):
+    """Fake client whose structured-output (direct mode) calls fail."""
+
+    def create(self, model=None, messages=None, stream=False, response_format=None, **kwargs):
+        if response_format is not None:
+            self.calls += 1
+            raise RuntimeError("response_format is not supported")
+        return super().create(model=model, messages=messages, stream=stream, **kwargs)
+
+
+def test_direct_mode_converts_in_one_call(no_ocr):
+    index = DiagramIndex(":memory:")
+    client = FakeOpenAIClient(latency=0)
+    result = convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index, mode="direct")
+
+    assert result["mode"] == "direct" and result["dot_code"].startswith("digraph")
+    assert client.calls == 1
+    # Results are kept per mode
+    assert convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index, mode="direct")["reused"]
+    assert not convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index)["reused"]
+
+
+def test_failed_direct_call_falls_back_to_two_step(no_ocr):
+    index = DiagramIndex(":memory:")
+    client = NoStructuredOutputClient(latency=0)
+    result = convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index, mode="direct")
+
+    assert result["mode"] == "two_step" and result["dot_code"].startswith("digraph")
+    assert result["payload_stats"] is not None
+    # The fallback result is filed as two-step, never served to a later direct run
+    assert convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index)["reused"]
+    assert not convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index, mode="direct")["reused"]
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        convert_diagram(_diagram(), "Visio", "Mermaid", FakeOpenAIClient(latency=0), mode="sketch")
+
+
+def test_rich_ocr_text_skips_the_vision_call():
+    index = DiagramIndex(":memory:")
+    client = FakeOpenAIClient(latency=0)
+    ocr_text = "Customer Portal -> Order Service\nPayment Gateway   Inventory DB   Email Notifier"
+    result = convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index, ocr_text=ocr_text)
+
+    assert result["mode"] == "ocr" and result["dot_code"].startswith("digraph")
+    assert result["payload_stats"] is None
+    assert "Customer Portal -> Order Service" in result["description"]
+    assert client.calls == 1
+    # OCR-built DOT is only reused by runs that read the same text, never as a vision result
+    assert convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index, ocr_text=ocr_text)["reused"]
+    assert not convert_diagram(_diagram(), "Visio", "Mermaid", client, index=index, ocr_text="")["reused"]
+
+
+def test_sparse_ocr_text_goes_to_the_vision_model(no_ocr):
+    client = FakeOpenAIClient(latency=0)
+    result = convert_diagram(_diagram(), "Visio", "Mermaid", client, ocr_text="Start\nEnd")
+
+    assert result["mode"] == "two_step" and result["payload_stats"] is not None
+    assert client.calls == 2
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.dot_utils import DotSyntaxError, normalize_dot, parse_dot, repair_dot
+
+
+class ReplyClient:
+    """Chat client stub that answers every request with the next canned reply."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **params):
+        self.requests.append(params)
+        message = SimpleNamespace(content=self.replies.pop(0))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+
+@pytest.mark.parametrize("raw, expected, fix", [
+    ("Here is the diagram:\n```dot\ndigraph G {\n  A -> B\n}\n```\nHope it helps.",
+     "digraph G {\n    A -> B;\n}\n", "removed code fences"),
+    ("digraph G {\n  A -> B;\n  B -> C;\n",
+     "digraph G {\n    A -> B;\n    B -> C;\n}\n", "added 1 missing '}'"),
+    ("digraph G {\n  Order Service -> Payment Gateway;\n}",
+     'digraph G {\n    "Order Service" -> "Payment Gateway";\n}\n', "quoted node name 'Order Service'"),
+    ("digraph G {\n  A [label=Order Service];\n}",
+     'digraph G {\n    A [label="Order Service"];\n}\n', "quoted attribute value 'Order Service'"),
+    ("graph G {\n  A -> B;\n}",
+     "graph G {\n    A -- B;\n}\n", "corrected edge operators"),
+    ("digraph G {\n  A [shape=box];\n  A [color=red];\n}",
+     "digraph G {\n    A [shape=box, color=red];\n}\n", "merged repeated node declarations"),
+])
+def test_normalize_fixes_common_model_defects(raw, expected, fix):
+    dot_code, fixes = normalize_dot(raw)
+    assert dot_code == expected
+    assert fix in fixes
+    parse_dot(dot_code)
+
+
+def test_normalize_leaves_valid_dot_alone():
+    assert normalize_dot("digraph G { A -> B; }") == ("digraph G {\n    A -> B;\n}\n", [])
+
+
+def test_normalize_reports_unrepairable_dot():
+    with pytest.raises(DotSyntaxError) as error:
+        normalize_dot("digraph G { A -> ; }")
+    assert error.value.line == 1
+    assert error.value.dot == "digraph G { A -> ; }"
+
+
+def test_repair_without_client_only_repairs_locally():
+    assert repair_dot("```\ndigraph G { A -> B }\n```") == "digraph G {\n    A -> B;\n}\n"
+    with pytest.raises(DotSyntaxError):
+        repair_dot("digraph G { A -> ; }")
+
+
+def test_repair_sends_only_the_dot_and_error_to_the_model():
+    client = ReplyClient("digraph G { A -> B; }")
+    assert repair_dot("digraph G { A -> ; }", client) == "digraph G {\n    A -> B;\n}\n"
+
+    [request] = client.requests
+    prompt = request["messages"][0]["content"]
+    assert "expected an identifier" in prompt
+    assert "digraph G { A -> ; }" in prompt
+
+
+def test_repair_gives_up_after_the_allowed_model_attempts():
+    client = ReplyClient("still { broken", "digraph G { A -> B; }")
+    with pytest.raises(DotSyntaxError):
+        repair_dot("digraph G { A -> ; }", client, max_model_attempts=1)
+    assert len(client.requests) == 1
+
+
+@pytest.mark.parametrize("statement", ["a b c d e", "rankdir LR a b c"])
+def test_lines_of_bare_node_ids_survive(statement):
+    raw = f"digraph G {{\n  subgraph cluster_a {{\n    {statement}\n  }}\n  a -> b;\n}}"
+    dot_code, fixes = normalize_dot(raw)
+    nodes = [s["id"] for s in parse_dot(dot_code)["stmts"][0]["stmts"] if s["kind"] == "node"]
+    assert nodes == statement.split()
+    assert fixes == []
+
+
+@pytest.mark.parametrize("line", ["This shows how the flow works, roughly", "Note: the flow below.",
+                                  "Orders go to billing."])
+def test_prose_lines_inside_the_graph_are_removed(line):
+    dot_code, fixes = normalize_dot(f"digraph G {{\n  {line}\n  a -> b;\n}}")
+    assert dot_code == "digraph G {\n    a -> b;\n}\n"
+    assert "removed 1 prose line(s)" in fixes
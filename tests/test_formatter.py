@@ -0,0 +1,28 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from docx import Document
+
+from app.formatter import build_docx, insert_images_to_docx
+
+
+def _titles(data):
+    return [p.text for p in Document(io.BytesIO(data)).paragraphs if p.style.name.startswith("Heading 1")]
+
+
+def test_build_docx_writes_one_heading_per_section():
+    data = build_docx({"Overview": "Some **bold** text.", "Data model": "Tables."}, None)
+    assert _titles(data) == ["Overview", "Data model"]
+
+
+def test_concurrent_writers_of_one_output_leave_a_complete_document(tmp_path):
+    output = tmp_path / "ServiceNow_Design.docx"
+    versions = [{f"Section {i}": f"Content {i}"} for i in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        written = list(pool.map(lambda sections: insert_images_to_docx(str(output), sections, None), versions))
+
+    assert output.read_bytes() in written
+    assert len(_titles(output.read_bytes())) == 1
+    assert os.listdir(tmp_path) == [output.name]
@@ -0,0 +1,88 @@
+import base64
+import io
+
+import pytest
+from PIL import Image, ImageDraw
+
+from app.image_utils import estimate_vision_tokens, is_decorative_image, prepare_image_payload
+
+
+def _diagram(size, image_format="PNG"):
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    for left in range(0, width - 40, max(40, width // 8)):
+        draw.rectangle((left + 5, height // 4, left + 35, height // 2), outline="black", width=2)
+        draw.line((left, height // 3, left + 40, height // 3 + 20), fill="black", width=2)
+    output = io.BytesIO()
+    image.save(output, image_format)
+    return output.getvalue()
+
+
+def _payload_image(payload):
+    data = payload["data_url"].split(",", 1)[1]
+    return Image.open(io.BytesIO(base64.b64decode(data)))
+
+
+def test_vision_token_estimate():
+    assert estimate_vision_tokens(4000, 4000, "low") == 85
+    assert estimate_vision_tokens(512, 512) == 85 + 170
+    # 4096x2048 fits 2048x1024 and then 1536x768: 3x2 tiles
+    assert estimate_vision_tokens(4096, 2048) == 85 + 170 * 6
+
+
+def test_small_png_is_sent_untouched_at_low_detail():
+    image_bytes = _diagram((400, 240))
+    payload = prepare_image_payload(image_bytes)
+
+    assert payload["detail"] == "low"
+    assert payload["data_url"].startswith("data:image/png;base64,")
+    assert base64.b64decode(payload["data_url"].split(",", 1)[1]) == image_bytes
+    assert not payload["stats"]["reencoded"]
+    assert payload["stats"]["payload_tokens"] == 85
+
+
+def test_large_image_is_downscaled_to_the_tile_budget():
+    payload = prepare_image_payload(_diagram((3000, 2000)), max_tiles=4, min_short_side=384)
+    stats = payload["stats"]
+    width, height = _payload_image(payload).size
+
+    assert payload["detail"] == "high"
+    assert stats["reencoded"]
+    assert stats["payload_tokens"] <= 85 + 170 * 4 < stats["original_tokens"]
+    assert stats["tokens_saved"] == stats["original_tokens"] - stats["payload_tokens"]
+    assert min(width, height) >= 384
+    assert width / height == pytest.approx(1.5, rel=0.02)
+
+
+def test_tile_budget_never_shrinks_below_the_short_side_floor():
+    payload = prepare_image_payload(_diagram((3000, 2000)), max_tiles=1, min_short_side=600)
+    assert min(_payload_image(payload).size) >= 600
+
+
+def test_jpeg_stays_jpeg_and_other_formats_become_png():
+    jpeg = prepare_image_payload(_diagram((3000, 2000), "JPEG"))
+    bmp = prepare_image_payload(_diagram((400, 240), "BMP"))
+
+    assert jpeg["data_url"].startswith("data:image/jpeg;base64,")
+    assert bmp["data_url"].startswith("data:image/png;base64,")
+    assert bmp["stats"]["reencoded"]
+
+
+def test_decorative_images_are_skipped():
+    blank = io.BytesIO()
+    Image.new("RGB", (400, 400), "white").save(blank, "BMP")
+    rule = io.BytesIO()
+    Image.new("RGB", (2000, 20), "black").save(rule, "BMP")
+
+    assert is_decorative_image(blank.getvalue())
+    assert is_decorative_image(rule.getvalue())
+    assert is_decorative_image(b"\x89PNG tiny")
+    shaded = Image.new("RGB", (400, 240), "white")
+    draw = ImageDraw.Draw(shaded)
+    for index, shade in enumerate((200, 160, 120, 80)):
+        draw.rectangle((10 + index * 95, 40, 95 + index * 95, 200), fill=(shade, shade, 255), outline="black")
+    diagram = io.BytesIO()
+    shaded.save(diagram, "BMP")
+    assert not is_decorative_image(diagram.getvalue())
+
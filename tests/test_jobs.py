@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from app import artifact_store, jobs
+from app.artifact_store import ArtifactStore
+from benchmarks.fake_openai import FakeOpenAIClient
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Pega_Design.docx")
+
+
+@pytest.fixture
+def jobs_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(artifact_store, "_default_store", ArtifactStore(root=str(tmp_path / "artifacts")))
+    return tmp_path / "jobs"
+
+
+@pytest.mark.parametrize("job_id", ["../../etc", "0123456789ab/..", "0123456789AB", "0123456789abc", "", None])
+def test_malformed_ids_are_not_found(jobs_dir, job_id):
+    assert not jobs.is_valid_id(job_id)
+    assert jobs.get_job(job_id) is None
+    assert jobs.fanout_report(job_id) is None
+
+
+def test_legacy_output_is_only_served_from_the_job_folder(jobs_dir, tmp_path):
+    job_dir = jobs_dir / "0123456789ab"
+    job_dir.mkdir(parents=True)
+    (job_dir / "Mermaid_Design.docx").write_bytes(b"converted")
+    (tmp_path / "secret.docx").write_bytes(b"secret")
+
+    inside = {"id": "0123456789ab", "output_file": str(job_dir / "Mermaid_Design.docx")}
+    outside = {"id": "0123456789ab", "output_file": str(tmp_path / "secret.docx")}
+    escaping = {"id": "0123456789ab", "output_file": str(job_dir / ".." / ".." / "secret.docx")}
+    assert jobs.job_output(inside) == b"converted"
+    assert jobs.job_output(outside) is None
+    assert jobs.job_output(escaping) is None
+
+
+def test_failed_cleanup_does_not_block_new_jobs(jobs_dir, monkeypatch):
+    def broken_cleanup():
+        raise OSError("disk unavailable")
+
+    monkeypatch.setattr(jobs, "cleanup_jobs", broken_cleanup)
+    job_id = jobs._create_job(b"PK", "design.docx", "Visio", "Mermaid", False, "two_step", False)
+    assert jobs.is_valid_id(job_id)
+    assert jobs.get_job(job_id)["filename"] == "design.docx"
+
+
+def test_fanout_parses_once_and_converts_every_target(jobs_dir, monkeypatch):
+    calls = {"parse": 0, "extract": 0}
+
+    def counted(name, func):
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return func(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(jobs, "parse_docx", counted("parse", jobs.parse_docx))
+    monkeypatch.setattr(jobs, "extract_images_from_docx", counted("extract", jobs.extract_images_from_docx))
+    with open(SAMPLE, "rb") as f:
+        docx_bytes = f.read()
+
+    group_id, job_ids = jobs.submit_fanout(docx_bytes, "Pega_Design.docx", "Pega",
+                                           ["ServiceNow", "Salesforce", "ServiceNow"], FakeOpenAIClient(latency=0))
+    for job_id in job_ids:
+        jobs._active[job_id].result(timeout=60)
+
+    assert len(job_ids) == 2
+    assert calls == {"parse": 1, "extract": 1}
+    states = [jobs.get_job(job_id) for job_id in job_ids]
+    assert [state["target_tech"] for state in states] == ["ServiceNow", "Salesforce"]
+    assert all(state["status"] == jobs.COMPLETED and state["group"] == group_id for state in states)
+    assert all(jobs.job_output(state)[:2] == b"PK" for state in states)
+
+    report = jobs.fanout_report(group_id)
+    assert set(report["shared"]) == {"parse", "images"}
+    assert [target["job_id"] for target in report["targets"]] == job_ids
+    assert report["wall_seconds"] is not None
+    assert report["sequential_seconds"] >= sum(report["shared"].values())
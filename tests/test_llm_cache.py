@@ -0,0 +1,103 @@
+import pytest
+
+from app import llm_cache
+from app.llm_cache import CachedOpenAIClient, LLMCache, make_cache_key
+from benchmarks.fake_openai import FakeOpenAIClient
+
+MESSAGES = [{"role": "user", "content": "Title: Intro\n\nContent:\nConvert me"}]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    return now
+
+
+def _client(cache, **options):
+    fake = FakeOpenAIClient(latency=0)
+    return fake, CachedOpenAIClient(fake, cache, **options)
+
+
+def _streamed_text(stream):
+    return "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+
+
+def test_key_covers_every_output_affecting_parameter():
+    key = make_cache_key("gpt-4o", MESSAGES, 0.7, 1500)
+    assert make_cache_key("gpt-4o", list(MESSAGES), 0.7, 1500) == key
+    assert make_cache_key("gpt-4o-mini", MESSAGES, 0.7, 1500) != key
+    assert make_cache_key("gpt-4o", MESSAGES, 0.0, 1500) != key
+    assert make_cache_key("gpt-4o", MESSAGES, 0.7, 1500, response_format={"type": "json_object"}) != key
+
+
+def test_repeated_request_is_served_from_the_cache():
+    cache = LLMCache(":memory:")
+    fake, client = _client(cache)
+    first = client.chat.completions.create(model="gpt-4o", messages=MESSAGES, temperature=0)
+    second = client.chat.completions.create(model="gpt-4o", messages=MESSAGES, temperature=0)
+
+    assert fake.calls == 1
+    assert second.cached is True
+    assert second.choices[0].message.content == first.choices[0].message.content
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_expired_entries_are_misses(clock):
+    cache = LLMCache(":memory:", ttl_seconds=60)
+    fake, client = _client(cache)
+    client.chat.completions.create(model="gpt-4o", messages=MESSAGES)
+    clock[0] += 61
+    client.chat.completions.create(model="gpt-4o", messages=MESSAGES)
+
+    assert fake.calls == 2
+    assert cache.stats()["entries"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = LLMCache(":memory:", max_entries=2)
+    for key in ("a", "b"):
+        cache.set(key, {"value": key})
+        clock[0] += 1
+    cache.get("a")
+    clock[0] += 1
+    cache.set("c", {"value": "c"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") == {"value": "a"}
+    assert cache.get("c") == {"value": "c"}
+
+
+def test_finished_stream_is_recorded_and_replayed():
+    cache = LLMCache(":memory:")
+    fake, client = _client(cache)
+    text = _streamed_text(client.chat.completions.create(model="gpt-4o", messages=MESSAGES, stream=True))
+
+    replay = list(client.chat.completions.create(model="gpt-4o", messages=MESSAGES, stream=True))
+    assert fake.calls == 1
+    assert _streamed_text(replay) == text
+    assert replay[0].cached is True
+    # Streamed and plain requests share the entry
+    assert client.chat.completions.create(model="gpt-4o", messages=MESSAGES).choices[0].message.content == text
+
+
+def test_abandoned_or_truncated_streams_are_not_recorded():
+    cache = LLMCache(":memory:")
+    fake, client = _client(cache)
+    stream = client.chat.completions.create(model="gpt-4o", messages=MESSAGES, stream=True)
+    next(iter(stream))
+    stream.close()
+    _streamed_text(client.chat.completions.create(model="gpt-4o", messages=MESSAGES, stream=True, max_tokens=1))
+
+    assert cache.stats()["entries"] == 0
+    assert fake.calls == 2
+
+
+def test_bypass_skips_lookups_but_refreshes_the_entry():
+    cache = LLMCache(":memory:")
+    fake, client = _client(cache)
+    client.chat.completions.create(model="gpt-4o", messages=MESSAGES)
+    client.with_cache_bypass().chat.completions.create(model="gpt-4o", messages=MESSAGES)
+
+    assert fake.calls == 2
+    assert cache.stats()["entries"] == 1
@@ -0,0 +1,132 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import llm_scheduler
+from app.llm_scheduler import ModelBudget, RequestScheduler, parse_duration, retry_after_seconds
+
+
+class StatusError(Exception):
+    """Stands in for openai.APIStatusError: a status code, an error code and the response headers."""
+
+    def __init__(self, status_code, headers=None, code=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.code = code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+class ScriptedClient:
+    """Chat client stub that raises or returns the next scripted outcome on every request."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **params):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(llm_scheduler.time, "sleep", delays.append)
+    return delays
+
+
+def _request(scheduler, **params):
+    return scheduler.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "hi"}], **params)
+
+
+def test_parse_duration():
+    assert parse_duration("6m0s") == 360.0
+    assert parse_duration("1.5s") == 1.5
+    assert parse_duration("20ms") == pytest.approx(0.02)
+    assert parse_duration("soon") is None
+    assert parse_duration(None) is None
+
+
+def test_retry_after_prefers_milliseconds():
+    assert retry_after_seconds({"retry-after-ms": "250", "retry-after": "9"}) == 0.25
+    assert retry_after_seconds({"retry-after": "3"}) == 3.0
+    assert retry_after_seconds({}) is None
+
+
+def test_limit_grows_additively_and_halves_once_per_burst():
+    budget = ModelBudget("gpt-4o", concurrency=4, max_concurrency=5)
+    budget.on_success()
+    assert budget.limit == pytest.approx(4.25)
+    for _ in range(10):
+        budget.on_success()
+    assert budget.limit == 5
+
+    budget.on_rate_limited()
+    budget.on_rate_limited()
+    assert budget.limit == 2.5
+    assert budget.rate_limited == 2
+
+
+def test_remaining_request_header_caps_the_limit():
+    budget = ModelBudget("gpt-4o", concurrency=8, max_concurrency=16)
+    budget.on_success({"x-ratelimit-remaining-requests": "3"})
+    assert budget.limit == 3.0
+
+
+def test_retries_server_errors_with_backoff(sleeps):
+    client = ScriptedClient(StatusError(503), StatusError(500), "done")
+    scheduler = RequestScheduler(client, max_retries=5, base_delay=0.5)
+
+    assert _request(scheduler) == "done"
+    assert client.calls == 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= 0.5 and 0 <= sleeps[1] <= 1.0
+    assert scheduler.budget("gpt-4o").in_flight == 0
+
+
+def test_rate_limit_honours_retry_after_and_halves_concurrency(sleeps):
+    client = ScriptedClient(StatusError(429, headers={"retry-after-ms": "2000"}), "done")
+    scheduler = RequestScheduler(client, base_delay=0.5)
+
+    assert _request(scheduler) == "done"
+    assert 2.0 <= sleeps[0] <= 2.5
+    budget = scheduler.budget("gpt-4o")
+    assert budget.rate_limited == 1
+    assert budget.limit < 4
+
+
+@pytest.mark.parametrize("error", [StatusError(400), StatusError(429, code="insufficient_quota")])
+def test_permanent_errors_are_not_retried(sleeps, error):
+    client = ScriptedClient(error)
+    with pytest.raises(StatusError):
+        _request(RequestScheduler(client))
+    assert client.calls == 1
+    assert sleeps == []
+
+
+def test_gives_up_after_max_retries(sleeps):
+    client = ScriptedClient(*[StatusError(502)] * 3)
+    scheduler = RequestScheduler(client, max_retries=2)
+    with pytest.raises(StatusError):
+        _request(scheduler)
+    assert client.calls == 3
+    assert scheduler.budget("gpt-4o").in_flight == 0
+
+
+def test_stream_holds_its_slot_until_read_or_closed(sleeps):
+    scheduler = RequestScheduler(ScriptedClient(iter(["a", "b"]), iter(["c"])))
+    budget = scheduler.budget("gpt-4o")
+
+    stream = _request(scheduler, stream=True)
+    assert budget.in_flight == 1
+    assert list(stream) == ["a", "b"]
+    assert budget.in_flight == 0
+
+    stream = _request(scheduler, stream=True)
+    stream.close()
+    stream.close()
+    assert budget.in_flight == 0
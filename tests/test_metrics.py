@@ -0,0 +1,107 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import metrics as metrics_module
+from app.metrics import Metrics, MetricsOpenAIClient, export_metrics, propagate, span, trace
+from benchmarks.fake_openai import FakeOpenAIClient
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = Metrics()
+    monkeypatch.setattr(metrics_module, "metrics", registry)
+    return registry
+
+
+def _counter(snapshot, name, **labels):
+    return sum(c["value"] for c in snapshot["counters"]
+               if c["name"] == name and all(c["labels"].get(k) == v for k, v in labels.items()))
+
+
+def test_counters_and_durations():
+    registry = Metrics()
+    registry.inc("documents_total", status="ok")
+    registry.inc("documents_total", 2, status="ok")
+    registry.inc("documents_total", status="failed")
+    registry.observe("step_seconds", 0.2)
+    registry.observe("step_seconds", 0.4)
+
+    snapshot = registry.snapshot()
+    assert _counter(snapshot, "documents_total", status="ok") == 3
+    assert _counter(snapshot, "documents_total", status="failed") == 1
+    durations = {d["name"]: d for d in snapshot["durations"]}
+    assert durations["step_seconds"]["count"] == 2
+    assert durations["step_seconds"]["max"] == pytest.approx(0.4)
+    assert durations["step_seconds"]["avg"] == pytest.approx(0.3)
+
+    registry.reset()
+    assert registry.snapshot()["counters"] == []
+
+
+def test_spans_nest_and_group_by_trace(registry):
+    with trace("doc-1"):
+        with span("convert.document"):
+            with span("convert.section") as attrs:
+                attrs["tokens"] = 12
+        with pytest.raises(RuntimeError):
+            with span("render"):
+                raise RuntimeError("boom")
+
+    snapshot = registry.snapshot()
+    spans = {s["name"]: s for s in snapshot["spans"]}
+    assert spans["convert.section"]["parent"] == "convert.document"
+    assert spans["convert.section"]["tokens"] == 12
+    assert spans["convert.document"]["parent"] is None
+    assert spans["render"]["status"] == "error"
+    assert _counter(snapshot, "stage_errors_total", stage="render") == 1
+    assert snapshot["traces"][0]["trace"] == "doc-1"
+    assert set(snapshot["traces"][0]["stages"]) == {"convert.document", "convert.section", "render"}
+
+
+def test_propagate_carries_the_trace_into_worker_threads(registry):
+    def work(number):
+        with span("worker"):
+            return number
+
+    with trace("doc-2"), span("fanout"):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(propagate(work), range(4)))
+
+    workers = [s for s in registry.snapshot()["spans"] if s["name"] == "worker"]
+    assert len(workers) == 4
+    assert all(s["trace"] == "doc-2" and s["parent"] == "fanout" for s in workers)
+
+
+def test_client_wrapper_records_calls_and_tokens(registry):
+    client = MetricsOpenAIClient(FakeOpenAIClient(latency=0))
+    messages = [{"role": "user", "content": "Describe the portal."}]
+    client.chat.completions.create(model="gpt-4o", messages=messages)
+    chunks = list(client.chat.completions.create(model="gpt-4o", messages=messages, stream=True))
+
+    snapshot = registry.snapshot()
+    assert chunks
+    assert _counter(snapshot, "llm_requests_total", model="gpt-4o", status="ok") == 2
+    assert _counter(snapshot, "llm_prompt_tokens_total", model="gpt-4o") > 0
+    assert _counter(snapshot, "llm_completion_tokens_total", model="gpt-4o") > 0
+    streamed = [s for s in snapshot["spans"] if s["name"] == "llm.request" and s["stream"]]
+    assert len(streamed) == 1 and streamed[0]["completion_tokens"] > 0
+
+
+def test_prometheus_text_and_file_export(registry, tmp_path, monkeypatch):
+    registry.inc("render_failures_total", engine="dot", reason='bad "quote"')
+    registry.observe("stage_duration_seconds", 0.02, stage="render")
+    text = registry.to_prometheus()
+
+    assert "# TYPE designshift_render_failures_total counter" in text
+    assert 'designshift_render_failures_total{engine="dot",reason="bad \\"quote\\""} 1' in text
+    assert 'designshift_stage_duration_seconds_bucket{stage="render",le="0.025"} 1' in text
+    assert 'designshift_stage_duration_seconds_bucket{stage="render",le="+Inf"} 1' in text
+
+    path = export_metrics(str(tmp_path / "out" / "metrics.json"))
+    with open(path, encoding="utf-8") as f:
+        assert _counter(json.load(f), "render_failures_total") == 1
+    assert (tmp_path / "out" / "metrics.prom").read_text() == text
+    monkeypatch.delenv("METRICS_PATH", raising=False)
+    assert export_metrics() is None
@@ -0,0 +1,129 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import section_planner
+from app.model_router import MAX_COMPLETION_TOKENS, ModelRouter
+
+IMAGE_MESSAGES = [{"role": "user", "content": [
+    {"type": "text", "text": "Describe this diagram."},
+    {"type": "image_url", "image_url": {"url": "data:image/png;base64,AAAA", "detail": "low"}},
+]}]
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    monkeypatch.setattr(section_planner, "_encoder", False)
+
+
+class ScriptedClient:
+    """Chat client stub that answers with the next (content, finish_reason) reply and records each request."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **params):
+        self.requests.append(params)
+        content, finish_reason = self.replies.pop(0)
+        choice = SimpleNamespace(message=SimpleNamespace(content=content), finish_reason=finish_reason)
+        return SimpleNamespace(choices=[choice], usage=SimpleNamespace(completion_tokens=len(content or "") // 4))
+
+
+def _section(title, tokens, line="Text of the section."):
+    lines = [line] * max(1, tokens * 4 // (len(line) + 1))
+    return {"title": title, "content": "\n".join(lines)}
+
+
+def test_sections_are_routed_by_size_title_and_structure():
+    router = ModelRouter(fast_model="small", strong_model="large")
+
+    trivial = router.route_section(_section("Introduction", 600))
+    standard = router.route_section(_section("Case lifecycle", 400))
+    complex_title = router.route_section(_section("Integration APIs", 500))
+    long = router.route_section(_section("Case lifecycle", 1200))
+    structured = router.route_section(_section("Case lifecycle", 300, line="- step"))
+
+    assert (trivial["name"], trivial["model"]) == ("section.trivial", "small")
+    assert (standard["name"], standard["model"]) == ("section.standard", "small")
+    assert {complex_title["name"], long["name"], structured["name"]} == {"section.complex"}
+    assert complex_title["model"] == long["model"] == "large"
+    assert trivial["max_tokens"] <= 1500 and long["max_tokens"] <= 3000
+
+
+def test_diagrams_are_routed_by_complexity_and_keep_the_payload_detail():
+    router = ModelRouter(fast_model="small", strong_model="large")
+    low = {"detail": "low"}
+
+    simple = router.route_diagram({"edge_density": 0.02}, low)
+    busy = router.route_diagram({"edge_density": 0.02, "labels": 30}, low)
+    direct = router.route_diagram({"edge_density": 0.08}, {"detail": "high"}, direct=True)
+
+    assert (simple["model"], simple["detail"]) == ("small", "low")
+    assert (busy["name"], busy["model"], busy["detail"]) == ("diagram.complex", "large", "high")
+    assert direct["name"] == "diagram.standard" and direct["max_tokens"] == 900 + 600
+
+
+def test_dot_repair_uses_the_strong_model_for_long_graphs():
+    router = ModelRouter(fast_model="small", strong_model="large")
+    assert router.route_dot_repair("digraph { a -> b }")["model"] == "small"
+    assert router.route_dot_repair("digraph {" + " a -> b;" * 300 + " }")["model"] == "large"
+
+
+def test_disabled_routing_uses_fixed_routes_and_never_escalates():
+    router = ModelRouter(fast_model="small", strong_model="large", enabled=False)
+    route = router.route_section(_section("Integration APIs", 2000))
+
+    assert (route["name"], route["model"], route["max_tokens"]) == ("section.fixed", "small", 1500)
+    assert router.escalate(route, "truncated") is None
+    assert router.config() == {"enabled": False, "fast_model": "small", "strong_model": "large", "policy": 1}
+
+
+def test_escalation_moves_fast_routes_to_the_strong_model():
+    router = ModelRouter(fast_model="small", strong_model="large")
+    route = router.route_diagram({"edge_density": 0.02}, {"detail": "low"})
+    escalated = router.escalate(route, "invalid")
+
+    assert escalated["name"] == "diagram.simple+escalated"
+    assert (escalated["model"], escalated["tier"], escalated["detail"]) == ("large", "strong", "high")
+    assert escalated["max_tokens"] == route["max_tokens"] * 2
+    # Strong routes only grow their limit, and only for cut-off replies
+    assert router.escalate(escalated, "invalid") is None
+    assert router.escalate(escalated, "truncated")["max_tokens"] == route["max_tokens"] * 4
+    assert router.escalate(dict(escalated, max_tokens=MAX_COMPLETION_TOKENS), "truncated") is None
+
+
+def test_complete_escalates_truncated_and_invalid_replies():
+    router = ModelRouter(fast_model="small", strong_model="large")
+    client = ScriptedClient(("not dot", "stop"), ("digraph { a ->", "length"), ("digraph { a -> b }", "stop"))
+    route = router.route_dot("Portal calls the workflow.")
+
+    result, used = router.complete(client, route, validate=lambda text: text if text.endswith("}") else None,
+                                   messages=[{"role": "user", "content": "Draw it"}])
+
+    assert result == "digraph { a -> b }"
+    assert [request["model"] for request in client.requests] == ["small", "large", "large"]
+    assert [request["max_tokens"] for request in client.requests] == [500, 1000, 2000]
+    assert used["name"] == "dot.simple+escalated"
+    stats = {row["route"]: row for row in router.stats()}
+    assert stats["dot.simple"]["escalated"] == 1
+    assert stats["dot.simple+escalated"]["calls"] == 2 and stats["dot.simple+escalated"]["truncated"] == 1
+
+
+def test_complete_returns_the_last_reply_when_nothing_stronger_is_left():
+    router = ModelRouter(fast_model="small", strong_model="large")
+    client = ScriptedClient(("", "stop"), ("", "stop"))
+    assert router.complete(client, router.route_detection(), messages=[])[0] is None
+    assert len(client.requests) == 2
+
+
+def test_call_sends_images_at_the_route_detail():
+    router = ModelRouter(fast_model="small", strong_model="large")
+    client = ScriptedClient(("A portal and a workflow.", "stop"))
+    route = router.route_diagram({"edge_density": 0.2}, {"detail": "low"})
+    router.call(client, route, messages=IMAGE_MESSAGES)
+
+    sent = client.requests[0]["messages"][0]["content"][1]["image_url"]
+    assert sent["detail"] == "high"
+    assert IMAGE_MESSAGES[0]["content"][1]["image_url"]["detail"] == "low"
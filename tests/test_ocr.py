@@ -0,0 +1,58 @@
+import io
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app import ocr
+from app.ocr import diagram_labels, is_rich_ocr_text, ocr_diagram_stats, ocr_images, preprocess_for_ocr
+
+RICH_TEXT = """
+Customer Portal --> Order Service
+Order Service -> Payment Gateway
+Inventory DB      Email Notifier
+"""
+
+
+def _image_bytes(image):
+    output = io.BytesIO()
+    image.save(output, "PNG")
+    return output.getvalue()
+
+
+def test_labels_are_split_at_arrows_and_wide_gaps():
+    assert diagram_labels(RICH_TEXT) == {"customer portal", "order service", "payment gateway", "inventory db",
+                                         "email notifier"}
+    # Border fragments and stray glyphs are not labels
+    assert diagram_labels("|_| -- I1 |\n==>  ab") == set()
+    assert diagram_labels(None) == set()
+
+
+def test_stats_count_labels_arrows_and_words():
+    assert ocr_diagram_stats(RICH_TEXT) == {"labels": 5, "arrows": 2, "words": 10}
+
+
+def test_rich_text_needs_enough_labels_and_words():
+    assert is_rich_ocr_text(RICH_TEXT)
+    assert not is_rich_ocr_text("Start\nEnd")
+    # Arrows lower the label count needed by one
+    assert is_rich_ocr_text("Web Portal -> Order Service -> Billing Engine")
+    assert not is_rich_ocr_text("Web Portal   Order Service   Billing Engine")
+    assert not is_rich_ocr_text("")
+
+
+def test_preprocessing_upscales_and_gives_dark_text_on_white():
+    image = Image.new("RGB", (300, 200), "navy")
+    ImageDraw.Draw(image).rectangle((40, 80, 260, 120), fill="white")
+    processed = preprocess_for_ocr(_image_bytes(image), deskew=False)
+    pixels = np.asarray(processed)
+
+    assert processed.mode == "L"
+    assert min(processed.size) == 600  # capped at MAX_UPSCALE
+    assert set(np.unique(pixels)) <= {0, 255}
+    # The light box on a dark background is inverted: most of the page is white paper
+    assert (pixels == 255).mean() > 0.5
+
+
+def test_ocr_images_keeps_order_and_skips_empty_entries(monkeypatch):
+    monkeypatch.setattr(ocr, "ocr_image", lambda image_bytes: image_bytes.decode())
+    assert ocr_images([b"first", None, b"", b"second"], max_workers=1) == ["first", None, None, "second"]
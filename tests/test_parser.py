@@ -0,0 +1,88 @@
+import glob
+import io
+import os
+
+import pytest
+from docx import Document
+
+from app.parser import iter_docx_sections, parse_docx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DOCUMENTS = sorted(glob.glob(os.path.join(REPO_ROOT, "*_Design.docx")))
+
+
+def _python_docx_sections(path):
+    # The python-docx based parser the streaming one replaced
+    sections = []
+    current = {"title": None, "content": ""}
+    for para in Document(path).paragraphs:
+        if para.style.name.startswith("Heading 1"):
+            if current["title"]:
+                sections.append(current)
+            current = {"title": para.text.strip(), "content": ""}
+        elif current["title"]:
+            current["content"] += para.text + "\n"
+    if current["title"]:
+        sections.append(current)
+    return sections
+
+
+@pytest.mark.parametrize("path", SAMPLE_DOCUMENTS, ids=os.path.basename)
+def test_matches_python_docx_on_sample_documents(path):
+    assert parse_docx(path) == _python_docx_sections(path)
+
+
+def test_matches_python_docx_on_runs_tabs_and_breaks(tmp_path):
+    doc = Document()
+    doc.add_paragraph("Preamble before the first heading is dropped")
+    doc.add_heading("Overview", level=1)
+    para = doc.add_paragraph("Tab")
+    para.add_run().add_tab()
+    para.add_run("and a")
+    para.add_run().add_break()
+    para.add_run("line break")
+    doc.add_heading("Details", level=2)
+    doc.add_paragraph("")
+    doc.add_heading("  Integration  ", level=1)
+    doc.add_paragraph("Last paragraph")
+    path = tmp_path / "runs.docx"
+    doc.save(path)
+
+    sections = parse_docx(str(path))
+    assert sections == _python_docx_sections(str(path))
+    assert [section["title"] for section in sections] == ["Overview", "Integration"]
+    assert sections[0]["content"] == "Tab\tand a\nline break\nDetails\n\n"
+
+
+def test_tables_become_one_line_per_row(tmp_path):
+    doc = Document()
+    doc.add_heading("Data", level=1)
+    doc.add_paragraph("Before")
+    table = doc.add_table(rows=2, cols=2)
+    table.cell(0, 0).text = "Field"
+    table.cell(0, 1).text = "Type"
+    table.cell(1, 0).text = "id"
+    table.cell(1, 1).text = "integer"
+    doc.add_paragraph("After")
+    path = tmp_path / "table.docx"
+    doc.save(path)
+
+    assert parse_docx(str(path)) == [{"title": "Data", "content": "Before\nField | Type\nid | integer\nAfter\n"}]
+
+
+def test_reads_file_objects(tmp_path):
+    doc = Document()
+    doc.add_heading("Only", level=1)
+    doc.add_paragraph("Body")
+    path = tmp_path / "stream.docx"
+    doc.save(path)
+
+    with open(path, "rb") as f:
+        assert list(iter_docx_sections(f)) == [{"title": "Only", "content": "Body\n"}]
+
+
+def test_parses_uploaded_bytes_like_the_file():
+    path = SAMPLE_DOCUMENTS[0]
+    with open(path, "rb") as f:
+        data = f.read()
+    assert parse_docx(io.BytesIO(data)) == parse_docx(path)
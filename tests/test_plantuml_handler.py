@@ -0,0 +1,77 @@
+import os
+import stat
+import sys
+import textwrap
+
+import pytest
+
+from app.plantuml_handler import PlantUMLRenderer
+
+# Stand-in for "java -jar plantuml.jar -pipe ... -pipedelimitor <delimiter>": answers each
+# @enduml with one output and the delimiter, crashes once on "crash" and never answers "hang"
+FAKE_PLANTUML = """
+    import os, sys
+    state = os.environ["FAKE_PLANTUML_DIR"]
+    with open(os.path.join(state, "starts"), "a") as f:
+        f.write("start\\n")
+    delimiter = sys.argv[-1].encode()
+    lines = []
+    for line in sys.stdin:
+        lines.append(line.strip())
+        if lines[-1] != "@enduml":
+            continue
+        body, lines = " ".join(lines[1:-1]), []
+        crashed = os.path.join(state, "crashed")
+        if "crash" in body and not os.path.exists(crashed):
+            open(crashed, "w").close()
+            sys.exit(1)
+        if "hang" not in body:
+            sys.stdout.buffer.write(b"IMG " + body.encode() + b"\\n" + delimiter + b"\\n")
+            sys.stdout.buffer.flush()
+"""
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="uses a shell script as the java executable")
+
+
+@pytest.fixture
+def renderer(tmp_path, monkeypatch):
+    script = tmp_path / "fake_plantuml.py"
+    script.write_text(textwrap.dedent(FAKE_PLANTUML))
+    java = tmp_path / "java"
+    java.write_text(f"#!/bin/sh\nexec {sys.executable} {script} \"$@\"\n")
+    java.chmod(java.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("FAKE_PLANTUML_DIR", str(tmp_path))
+
+    renderer = PlantUMLRenderer(timeout=1, java=str(java))
+    renderer.starts = lambda: (tmp_path / "starts").read_text().count("start")
+    yield renderer
+    renderer.close()
+
+
+def test_one_process_renders_every_diagram(renderer):
+    assert renderer.render("A -> B") == b"IMG A -> B\n"
+    assert renderer.render_batch(["@startuml\nB -> C\n@enduml", "C -> D"]) == [b"IMG B -> C\n", b"IMG C -> D\n"]
+    assert renderer.render_batch([]) == []
+    assert renderer.starts() == 1
+
+
+def test_crashed_process_is_restarted_and_the_batch_retried(renderer):
+    assert renderer.render("A -> B") == b"IMG A -> B\n"
+    assert renderer.render_batch(["crash", "B -> C"]) == [b"IMG crash\n", b"IMG B -> C\n"]
+    assert renderer.starts() == 2
+
+
+def test_killed_process_is_replaced_on_the_next_render(renderer):
+    assert renderer.render("A -> B") == b"IMG A -> B\n"
+    renderer._process.kill()
+    renderer._process.wait()
+
+    assert renderer.render("B -> C") == b"IMG B -> C\n"
+    assert renderer.starts() == 2
+
+
+def test_stuck_render_gives_up_and_recovers(renderer):
+    assert renderer.render("hang") is None
+    # Both attempts timed out, each on its own process; the next render gets a fresh one
+    assert renderer.render("A -> B") == b"IMG A -> B\n"
+    assert renderer.starts() == 3
@@ -0,0 +1,67 @@
+import pytest
+
+from app import section_planner
+from app.section_planner import count_tokens, plan_requests, split_content
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # The character estimate keeps sizes predictable whether or not tiktoken is installed
+    monkeypatch.setattr(section_planner, "_encoder", False)
+
+
+def _section(title, tokens):
+    return {"title": title, "content": "word" * tokens}
+
+
+def test_token_estimate():
+    assert count_tokens("") == 0
+    assert count_tokens("abcd") == 1
+    assert count_tokens("abcde") == 2
+
+
+def test_small_adjacent_sections_are_packed():
+    sections = [_section("A", 50), _section("B", 50), _section("C", 500), _section("D", 50)]
+    plan = plan_requests(sections)
+
+    assert [request["type"] for request in plan] == ["packed", "single", "single"]
+    assert plan[0]["indices"] == [0, 1]
+    assert plan[0]["sections"] == sections[:2]
+    assert plan[2]["indices"] == [3]
+
+
+def test_packs_respect_token_and_count_limits():
+    sections = [_section(str(i), 200) for i in range(6)]
+    assert [r["indices"] for r in plan_requests(sections, pack_token_limit=500)] == [[0, 1], [2, 3], [4, 5]]
+    assert [r["indices"] for r in plan_requests(sections, max_sections_per_pack=4)] == [[0, 1, 2, 3], [4, 5]]
+
+
+def test_empty_sections_break_packs():
+    sections = [_section("A", 50), {"title": "Empty", "content": "  "}, _section("B", 50)]
+    plan = plan_requests(sections)
+    assert [(r["type"], r["indices"]) for r in plan] == [("single", [0]), ("single", [1]), ("single", [2])]
+
+
+def test_oversized_section_is_split_into_ordered_parts():
+    paragraphs = ["p%d " % i + "x" * 1200 for i in range(6)]
+    section = {"title": "Big", "content": "\n".join(paragraphs)}
+    plan = plan_requests([_section("Before", 50), section], max_section_tokens=1000)
+
+    parts = [r for r in plan if r["type"] == "part"]
+    assert plan[0]["type"] == "single"
+    assert [r["part"] for r in parts] == list(range(1, len(parts) + 1))
+    assert all(r["parts"] == len(parts) > 1 and r["indices"] == [1] for r in parts)
+    assert all(r["sections"][0]["title"] == "Big" for r in parts)
+    assert all(count_tokens(r["sections"][0]["content"]) <= 1000 for r in parts)
+    rejoined = "\n".join(r["sections"][0]["content"] for r in parts)
+    assert rejoined == section["content"]
+
+
+def test_run_on_paragraph_is_split_at_sentences():
+    paragraph = " ".join(f"Sentence number {i} is here." for i in range(200))
+    chunks = split_content(paragraph, max_tokens=100)
+
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 100 for chunk in chunks)
+    assert all(chunk.endswith(".") for chunk in chunks)
+    assert " ".join(chunks) == paragraph
@@ -0,0 +1,125 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import section_store, transformer
+from app.section_store import SectionStore, conversion_key, convert_similar, section_hash
+
+SECTION = {"title": "Orders", "content": "The order service stores orders in Postgres.\nTimeout is 30 seconds."}
+SETTINGS = {"model": "gpt-4o", "temperature": 0.3, "max_tokens": 1500}
+
+
+@pytest.fixture
+def store():
+    return SectionStore(":memory:")
+
+
+def test_hash_ignores_trailing_whitespace_only():
+    resaved = {"title": "Orders ", "content": "The order service stores orders in Postgres.   \nTimeout is 30 seconds.\n"}
+    edited = dict(SECTION, content=SECTION["content"].replace("30", "60"))
+    assert section_hash(resaved) == section_hash(SECTION)
+    assert section_hash(edited) != section_hash(SECTION)
+
+
+def test_key_covers_technologies_and_settings():
+    key = conversion_key(SECTION, "Visio", "Mermaid", SETTINGS)
+    assert conversion_key(SECTION, "Visio", "Mermaid", dict(SETTINGS)) == key
+    assert conversion_key(SECTION, "Lucid", "Mermaid", SETTINGS) != key
+    assert conversion_key(SECTION, "Visio", "PlantUML", SETTINGS) != key
+    assert conversion_key(SECTION, "Visio", "Mermaid", dict(SETTINGS, temperature=0.7)) != key
+    routed = dict(SETTINGS, routing={"enabled": True, "fast_model": "gpt-4o-mini"})
+    assert conversion_key(SECTION, "Visio", "Mermaid", routed) != key
+
+
+def test_default_key_follows_the_router_configuration(monkeypatch):
+    def use_router(**config):
+        monkeypatch.setattr(transformer, "get_router", lambda: SimpleNamespace(config=lambda: config))
+
+    use_router(enabled=False, fast_model="gpt-4o-mini", strong_model="gpt-4o", policy=1)
+    key = conversion_key(SECTION, "Visio", "Mermaid")
+    use_router(enabled=True, fast_model="gpt-4o-mini", strong_model="gpt-4o", policy=1)
+    assert conversion_key(SECTION, "Visio", "Mermaid") != key
+
+
+def test_lookup_returns_only_matching_conversions(store):
+    other = {"title": "Billing", "content": "Invoices are sent monthly."}
+    store.save(SECTION, "Visio", "Mermaid", "converted orders", SETTINGS)
+
+    assert store.lookup([other, SECTION], "Visio", "Mermaid", SETTINGS) == {1: "converted orders"}
+    assert store.lookup([SECTION], "Visio", "Mermaid", dict(SETTINGS, model="gpt-4o-mini")) == {}
+    assert (store.hits, store.misses) == (1, 2)
+
+
+def test_failed_conversions_are_not_stored(store):
+    store.save(SECTION, "Visio", "Mermaid", "⚠️ API Error: timeout", SETTINGS)
+    store.save(SECTION, "Visio", "Mermaid", "", SETTINGS)
+    assert store.lookup([SECTION], "Visio", "Mermaid", SETTINGS) == {}
+
+
+def test_least_recently_used_sections_are_evicted():
+    store = SectionStore(":memory:", max_entries=2)
+    sections = [{"title": f"Section {i}", "content": f"Content {i}"} for i in range(3)]
+    for section in sections:
+        store.save(section, "Visio", "Mermaid", section["title"], SETTINGS)
+    assert store.lookup(sections, "Visio", "Mermaid", SETTINGS) == {1: "Section 1", 2: "Section 2"}
+
+
+def test_diff_against_the_last_recorded_version(store):
+    first = [SECTION, {"title": "Billing", "content": "Monthly."}, {"title": "Audit", "content": "Yearly."}]
+    assert store.diff_document("design.docx", "Mermaid", first) == {"previous": False, "changed": [0, 1, 2],
+                                                                      "removed": 0}
+    store.record_document("design.docx", "Mermaid", first)
+
+    second = [SECTION, {"title": "Billing", "content": "Weekly."}]
+    assert store.diff_document("design.docx", "Mermaid", second) == {"previous": True, "changed": [1], "removed": 2}
+    assert store.diff_document("design.docx", "PlantUML", second)["previous"] is False
+
+
+LONG_SECTION = {
+    "title": "Order intake",
+    "content": " ".join(f"Step {i} validates the order, reserves stock in warehouse {i} and notifies billing."
+                        for i in range(1, 13)) + " Requests time out after 30 seconds.",
+}
+
+
+@pytest.fixture
+def revisions(monkeypatch):
+    calls = []
+
+    def revise(section, previous_section, previous_text, source_tech, target_tech, client):
+        calls.append(section)
+        return f"revised from {previous_text}"
+
+    monkeypatch.setattr(section_store, "revise_conversion", revise)
+    return calls
+
+
+def test_whitespace_only_changes_reuse_the_stored_conversion(store, revisions):
+    store.save(LONG_SECTION, "Visio", "Mermaid", "converted intake")
+    rewrapped = dict(LONG_SECTION, content=LONG_SECTION["content"].replace(". ", ".\n    "))
+
+    texts, stats = convert_similar(store, [rewrapped], "Visio", "Mermaid", client=None)
+    assert texts == {0: "converted intake"}
+    assert stats == {"reused": 1, "revised": 0}
+    assert revisions == []
+    assert store.lookup([rewrapped], "Visio", "Mermaid") == {0: "converted intake"}
+
+
+def test_small_edits_are_revised_not_reused(store, revisions):
+    store.save(LONG_SECTION, "Visio", "Mermaid", "converted intake")
+    edited = dict(LONG_SECTION, content=LONG_SECTION["content"].replace("30 seconds", "60 seconds"))
+    assert store.find_similar([edited], "Visio", "Mermaid")[0]["similarity"] > 0.9
+
+    texts, stats = convert_similar(store, [edited], "Visio", "Mermaid", client=None)
+    assert texts == {0: "revised from converted intake"}
+    assert stats == {"reused": 0, "revised": 1}
+    assert revisions == [edited]
+
+
+def test_unrelated_sections_are_left_for_full_conversion(store, revisions):
+    store.save(LONG_SECTION, "Visio", "Mermaid", "converted intake")
+    unrelated = {"title": "Reporting", "content": "Dashboards refresh nightly from the data warehouse export."}
+
+    assert convert_similar(store, [unrelated], "Visio", "Mermaid", client=None) == ({}, {"reused": 0, "revised": 0})
+    assert convert_similar(store, [LONG_SECTION], "Visio", "PlantUML", client=None)[0] == {}
+    assert revisions == []
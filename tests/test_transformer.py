@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import transformer
+from app.transformer import SECTION_MARKER, convert_packed_sections, stream_sections_concurrently
+from benchmarks.fake_openai import FakeOpenAIClient
+
+SECTIONS = [{"title": "Intro", "content": "Purpose of the system."},
+            {"title": "Glossary", "content": "SLA: service level agreement."}]
+
+
+class ReplyClient:
+    """Chat client stub that answers every request with one canned reply."""
+
+    def __init__(self, content, finish_reason="stop"):
+        self.content = content
+        self.finish_reason = finish_reason
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **params):
+        self.requests.append(params)
+        choice = SimpleNamespace(message=SimpleNamespace(content=self.content), finish_reason=self.finish_reason)
+        return SimpleNamespace(choices=[choice], usage=None)
+
+
+@pytest.fixture
+def singles(monkeypatch):
+    converted = []
+
+    def convert_any_to_any(section, source_tech, target_tech, client):
+        converted.append(section["title"])
+        return f"single {section['title']}"
+
+    monkeypatch.setattr(transformer, "convert_any_to_any", convert_any_to_any)
+    return converted
+
+
+def _packed_reply(*texts):
+    return "\n".join(f"{SECTION_MARKER.format(number=n)}\n{text}" for n, text in enumerate(texts, start=1))
+
+
+def test_packed_reply_is_split_by_markers(singles):
+    client = ReplyClient(_packed_reply("intro text", "glossary text"))
+    assert convert_packed_sections(SECTIONS, "Pega", "ServiceNow", client) == ["intro text", "glossary text"]
+    assert singles == []
+
+
+@pytest.mark.parametrize("client", [
+    ReplyClient(None),
+    ReplyClient(""),
+    ReplyClient(_packed_reply("intro text")),
+    ReplyClient(_packed_reply("intro text", "glossary te"), finish_reason="length"),
+], ids=["none", "empty", "missing marker", "truncated"])
+def test_unusable_packed_replies_fall_back_per_section(singles, client):
+    assert convert_packed_sections(SECTIONS, "Pega", "ServiceNow", client) == ["single Intro", "single Glossary"]
+    assert singles == ["Intro", "Glossary"]
+
+
+class FailingClient:
+    """Chat client stub whose every request fails."""
+
+    def __init__(self):
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **params):
+        self.calls += 1
+        raise RuntimeError("connection reset")
+
+
+def test_detection_skips_the_model_when_local_evidence_is_clear():
+    client = FailingClient()
+    text = "Pega case types, flows, flow actions, data pages and Pega rules. " * 5
+    assert transformer.detect_technology_from_text(text, client) == "Pega"
+    assert client.calls == 0
+
+
+def test_detection_falls_back_to_the_local_guess_and_counts_the_failure(monkeypatch):
+    counted = []
+    monkeypatch.setattr(transformer.metrics, "inc", lambda name, *args, **labels: counted.append((name, labels)))
+    client = FailingClient()
+
+    assert transformer.detect_technology_from_text("A short note about Pega.", client) == "Pega"
+    assert client.calls >= 1
+    assert ("detection_failures_total", {"reason": "api_error"}) in counted
+
+
+def test_streamed_sections_end_with_their_full_text():
+    sections = SECTIONS + [{"title": "Design", "content": "The portal calls the workflow service. " * 20}]
+    events = list(stream_sections_concurrently(sections, "Pega", "ServiceNow", FakeOpenAIClient(latency=0),
+                                               pack_sections=False))
+
+    done = {event["index"]: event for event in events if event["type"] == "done"}
+    assert sorted(done) == [0, 1, 2]
+    for index, event in done.items():
+        deltas = [e["text"] for e in events if e["type"] == "delta" and e["index"] == index]
+        assert event["title"] == sections[index]["title"]
+        assert len(deltas) > 1
+        assert "".join(deltas).strip() == event["text"]
+        # No deltas of a section arrive after its done event
+        assert events.index(event) > max(i for i, e in enumerate(events) if e["type"] == "delta" and e["index"] == index)
+
+
+def test_packed_sections_stream_one_done_event_each():
+    events = list(stream_sections_concurrently(SECTIONS, "Pega", "ServiceNow", FakeOpenAIClient(latency=0)))
+    assert [event["type"] for event in events] == ["done", "done"]
+    assert sorted(event["title"] for event in events) == ["Glossary", "Intro"]
+    assert all(event["text"] for event in events)
+
+
+def test_stream_failure_is_reported_as_the_section_text():
+    events = list(stream_sections_concurrently(SECTIONS[:1], "Pega", "ServiceNow", FailingClient()))
+    assert events[-1]["type"] == "done"
+    assert events[-1]["text"].startswith("⚠️ API Error: connection reset")
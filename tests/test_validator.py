@@ -0,0 +1,44 @@
+from app.validator import MIN_CONFIDENCE, build_detection_excerpt, detect_technology_locally, score_technologies
+
+
+def test_keywords_are_weighted_and_matched_case_insensitively():
+    scores = score_technologies("The ASP.NET site calls Apex classes; see the C# and .NET notes.")
+    assert scores == {".NET": 9, "Salesforce": 2}
+    # Keywords inside longer words do not count
+    assert score_technologies("sapphire, javascript, prpcs") == {}
+
+
+def test_clear_evidence_gives_a_confident_match():
+    text = "Salesforce org with Apex triggers, Visualforce pages and SOQL queries. " * 2
+    tech, confidence = detect_technology_locally(text)
+    assert tech == "Salesforce"
+    assert confidence >= MIN_CONFIDENCE
+
+
+def test_single_mention_is_not_confident():
+    tech, confidence = detect_technology_locally("Exported from the Pega case type designer.")
+    assert tech == "Pega"
+    assert 0 < confidence < MIN_CONFIDENCE
+
+
+def test_close_contest_is_not_confident():
+    text = "Migration from SAP ABAP to Salesforce Apex using Visualforce. " * 3
+    tech, confidence = detect_technology_locally(text)
+    assert tech in ("SAP", "Salesforce")
+    assert confidence < MIN_CONFIDENCE
+
+
+def test_no_keywords_is_unknown():
+    assert detect_technology_locally("A document about nothing in particular.") == ("Unknown", 0.0)
+
+
+def test_detection_excerpt_keeps_the_opening_within_budget():
+    text = "OVERVIEW " + "".join(f"section {i:04d} " for i in range(5000))
+    excerpt = build_detection_excerpt(text, max_chars=2000, slices=4)
+
+    assert excerpt.startswith("OVERVIEW ")
+    assert len(excerpt) <= 2000 + 4 * len("\n...\n")
+    assert excerpt.count("\n...\n") == 4
+    # The last slice comes from the final quarter of the document
+    assert "section 37" in excerpt.split("\n...\n")[-1]
+    assert build_detection_excerpt("short", max_chars=2000) == "short"
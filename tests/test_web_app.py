@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from app import llm_client
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEB_APP = os.path.join(REPO_ROOT, "ui", "web_app.py")
+
+
+@pytest.fixture
+def created_clients(monkeypatch, tmp_path):
+    # The stores' SQLite files go to .cache under the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.delenv("METRICS_PORT", raising=False)
+    created = []
+    create = llm_client.create_openai_client
+
+    def counted_create(api_key):
+        created.append(api_key)
+        return create(api_key)
+
+    monkeypatch.setattr(llm_client, "create_openai_client", counted_create)
+    st.cache_resource.clear()
+    yield created
+    st.cache_resource.clear()
+
+
+def test_reruns_reuse_the_client(created_clients):
+    app = AppTest.from_file(WEB_APP, default_timeout=30)
+    app.session_state["authenticated"] = True
+    app.run()
+    app.run()
+
+    assert not app.exception
+    assert [title.value for title in app.title] == ["📄 Design Document Converter"]
+    assert created_clients == ["sk-test"]
+
+
+def test_job_modules_do_not_import_pytesseract():
+    # pytesseract is the slowest import on the UI's path and only needed once OCR runs
+    code = "import sys, app.jobs, app.diagram_pipeline; print('pytesseract' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "False"
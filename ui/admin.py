@@ -1,4 +1,5 @@
 import streamlit as st
+import json
 import os
 import sys
 
@@ -6,6 +7,10 @@ import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from utils import update_env_variable  # Function to update variables in .env file
+from app.artifact_store import get_artifact_store
+from app.jobs import cleanup_jobs
+from app.metrics import metrics
+from app.model_router import get_router
 
 # Dummy admin credentials dictionary (in production use a secure method)
 ADMIN_USERS = {
@@ -72,12 +77,97 @@ def admin_panel():
             except Exception as e:
                 st.error(f"Failed to update .env file: {e}")
 
+    metrics_view()
+
     # Logout button clears admin session and reloads app
     if st.button("Logout"):
         for key in ["admin_authenticated", "admin_username", "admin_username_input", "admin_password_input"]:
             st.session_state.pop(key, None)
         st.rerun()
 
+def _counter_total(snapshot, name, **labels):
+    # Sum a counter over all label sets that match the given labels
+    return sum(c["value"] for c in snapshot["counters"]
+               if c["name"] == name and all(c["labels"].get(k) == v for k, v in labels.items()))
+
+def metrics_view():
+    """
+    Display pipeline metrics recorded in this server process.
+    Shows API usage and cache hit rates, time per stage, time per document (job),
+    latency per model route and the most recent spans, with JSON and Prometheus downloads.
+    """
+    st.header("📈 Pipeline Metrics")
+    snapshot = metrics.snapshot()
+
+    requests = _counter_total(snapshot, "llm_requests_total")
+    cache_hits = _counter_total(snapshot, "llm_cache_hits_total")
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("API calls", requests)
+    col2.metric("Prompt tokens", _counter_total(snapshot, "llm_prompt_tokens_total", cached="false"))
+    col3.metric("Completion tokens", _counter_total(snapshot, "llm_completion_tokens_total", cached="false"))
+    col4.metric("LLM cache hit rate", f"{cache_hits / requests:.0%}" if requests else "–")
+
+    # Time per stage, slowest first
+    stages = [
+        {"stage": d["labels"]["stage"], "calls": d["count"], "total (s)": round(d["sum"], 2),
+         "avg (s)": round(d["avg"], 3), "max (s)": round(d["max"], 3)}
+        for d in snapshot["durations"] if d["name"] == "stage_duration_seconds"
+    ]
+    st.subheader("Time per stage")
+    if stages:
+        st.dataframe(sorted(stages, key=lambda row: row["total (s)"], reverse=True), use_container_width=True)
+    else:
+        st.info("No conversions recorded since the server started.")
+
+    if snapshot["traces"]:
+        st.subheader("Time per document")
+        for trace in snapshot["traces"][:20]:
+            # Stages overlap (sections convert in parallel), so the job span is the wall time
+            total = trace["stages"].get("job", {}).get("seconds", 0.0)
+            with st.expander(f"Job {trace['trace']} — {total:.1f}s"):
+                st.dataframe(
+                    [{"stage": name, "calls": stage["count"], "seconds": round(stage["seconds"], 2)}
+                     for name, stage in sorted(trace["stages"].items(), key=lambda item: -item[1]["seconds"])],
+                    use_container_width=True,
+                )
+
+    other = [c for c in snapshot["counters"] if c["name"] in ("retries_total", "cache_hits_total",
+                                                              "cache_misses_total", "dot_validations_total",
+                                                              "render_failures_total", "diagram_failures_total",
+                                                              "tokenizer_fallbacks_total", "detection_failures_total")]
+    if other:
+        st.subheader("Retries, local caches and failures")
+        st.dataframe([{"metric": c["name"], **c["labels"], "value": c["value"]} for c in other],
+                     use_container_width=True)
+
+    routes = get_router().stats()
+    if routes:
+        st.subheader("Model routes")
+        st.caption("Which model each kind of request was sent to, and how long uncached requests took. "
+                   "Escalated routes are retries of truncated or unusable replies on the stronger model.")
+        st.dataframe(routes, use_container_width=True)
+
+    st.subheader("Artifact storage")
+    storage = get_artifact_store().stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Jobs and sessions", storage["scopes"])
+    col2.metric("Stored files", f"{storage['blobs']} ({storage['artifacts']} refs)")
+    col3.metric("On disk", f"{storage['bytes'] / 1024 ** 2:.1f} MB")
+    col4.metric("In memory", f"{storage['memory_bytes'] / 1024 ** 2:.1f} MB")
+    if st.button("Remove expired jobs and artifacts"):
+        result = cleanup_jobs(force=True)
+        st.success(f"Removed {result['jobs']} job(s) and {result['scopes']} artifact scope(s).")
+
+    with st.expander("Recent spans"):
+        st.dataframe(snapshot["spans"][:200], use_container_width=True)
+
+    col1, col2, col3 = st.columns(3)
+    col1.download_button("Download JSON", json.dumps(snapshot, default=str), file_name="metrics.json")
+    col2.download_button("Download Prometheus text", metrics.to_prometheus(), file_name="metrics.prom")
+    if col3.button("Reset metrics"):
+        metrics.reset()
+        st.rerun()
+
 def main():
     """
     Entry point of the admin script.
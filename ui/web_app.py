@@ -1,9 +1,10 @@
 import streamlit as st
 from dotenv import load_dotenv
+import hashlib
+import io
 import os
 import sys
-import tempfile
-from openai import OpenAI
+import time
 
 from login import login
 
@@ -11,18 +12,45 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 load_dotenv()
 
 from admin import admin_panel  
+from app.diagram_index import DiagramIndex
+from app.diagram_pipeline import DIAGRAM_MODES
+from app.section_store import SectionStore
+from app.jobs import (submit_job, submit_fanout, resume_job, get_job, job_results, job_diagram_images, job_output,
+                      fanout_report, is_valid_id)
+from app.llm_client import create_openai_client
+from app.metrics import start_metrics_server
+from app.model_router import get_router
 from app.parser import parse_docx
-from app.formatter import save_to_docx, insert_images_to_docx
-from app.transformer import detect_technology_from_text, convert_any_to_any
-from app.image_utils import extract_images_from_docx, analyze_and_convert_diagram
-from app.diagram_handler import regenerate_diagram_from_text
+from app.transformer import detect_technology_from_text
 
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     st.error("OpenAI API key is not set. Please set OPENAI_API_KEY in your environment.")
     st.stop()
 
-client = OpenAI(api_key=api_key)
+
+# Clients and stores live for the whole server process, not for one script run
+@st.cache_resource
+def get_client(api_key):
+    start_metrics_server()  # Only serves /metrics when METRICS_PORT is set
+    return create_openai_client(api_key)
+
+
+@st.cache_resource
+def get_stores():
+    return DiagramIndex(), SectionStore()
+
+
+# Keyed by the upload's content hash, so parsing and the paid detection call run once per unique file
+@st.cache_data(show_spinner="Analyzing document...", max_entries=32)
+def analyze_upload(fingerprint, _file_bytes, _client):
+    sections = parse_docx(io.BytesIO(_file_bytes))
+    full_text = "\n".join([sec.get("content", "") for sec in sections])
+    return sections, detect_technology_from_text(full_text, _client)
+
+
+client = get_client(api_key)
+diagram_index, section_store = get_stores()
 
 if "page" not in st.session_state:
     st.session_state.page = "main"
@@ -52,6 +80,10 @@ with st.sidebar:
             if st.button("🔧 Go to Admin Settings"):
                 st.session_state.page = "admin"
 
+    # Cached LLM responses are reused unless the user asks for fresh output
+    if st.checkbox("✨ Fresh AI output (bypass cache)", key="bypass_llm_cache"):
+        client = client.with_cache_bypass()
+
 if st.session_state.page == "admin":
     admin_panel()
     st.stop()
@@ -64,22 +96,19 @@ uploaded_file = st.file_uploader("Upload your Design Document (.docx)", type="do
 detected_source_tech = None
 
 if uploaded_file:
-    file_bytes = uploaded_file.read()
-    st.session_state['uploaded_file'] = file_bytes
-    st.session_state['uploaded_file_name'] = uploaded_file.name
-
-    # Create temp file for processing
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp_file:
-        tmp_file.write(file_bytes)
-        temp_path = tmp_file.name
+    file_bytes = uploaded_file.getvalue()
+    fingerprint = hashlib.sha256(file_bytes).hexdigest()
 
     try:
-        sections = parse_docx(temp_path)
-        full_text = "\n".join([sec.get("content", "") for sec in sections])
-        detected_source_tech = detect_technology_from_text(full_text, client)
-        st.session_state['detected_source_tech'] = detected_source_tech
-        st.session_state['sections'] = sections
-        st.session_state['temp_docx_path'] = temp_path
+        # Widget clicks rerun the script; the same upload is only analyzed once
+        if st.session_state.get('upload_fingerprint') != fingerprint:
+            sections, detected_source_tech = analyze_upload(fingerprint, file_bytes, client)
+            st.session_state['uploaded_file'] = file_bytes
+            st.session_state['uploaded_file_name'] = uploaded_file.name
+            st.session_state['detected_source_tech'] = detected_source_tech
+            st.session_state['sections'] = sections
+            st.session_state['upload_fingerprint'] = fingerprint
+        detected_source_tech = st.session_state['detected_source_tech']
 
         st.success(f"Detected Source Technology: {detected_source_tech}")
     except Exception as e:
@@ -102,10 +131,10 @@ if target_tech == "CustomTech" and detected_source_tech:
                     "Suggest 3 to 5 target technologies appropriate for converting this design document. "
                     "List them as a comma separated list."
                 )
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
+                router = get_router()
+                response = router.call(
+                    client, router.route_suggestion(),
                     messages=[{"role": "user", "content": prompt}],
-                    max_tokens=100,
                     temperature=0.7,
                 )
                 suggestions_text = response.choices[0].message.content.strip()
@@ -137,94 +166,212 @@ can_convert = (
     and final_target_tech is not None and final_target_tech != ""
 )
 
+max_workers = int(os.getenv("CONVERSION_CONCURRENCY", "8"))
+poll_job = False
+
 if can_convert:
+    stream_output = st.checkbox("Show converted text while it is generated", value=True, key="stream_output")
+    default_mode = os.getenv("DIAGRAM_MODE", "two_step")
+    diagram_mode = st.radio(
+        "Diagram conversion mode",
+        DIAGRAM_MODES,
+        index=DIAGRAM_MODES.index(default_mode) if default_mode in DIAGRAM_MODES else 0,
+        format_func=lambda m: {"two_step": "Two-step (describe, then generate)", "direct": "Direct (single call)"}[m],
+        horizontal=True,
+        key="diagram_mode",
+    )
+    ocr_first = st.radio(
+        "Diagram text source",
+        [False, True],
+        index=1 if os.getenv("DIAGRAM_OCR_FIRST", "").lower() in ("1", "true", "yes") else 0,
+        format_func=lambda first: "OCR first (skip vision when labels are readable)" if first else "Vision first",
+        horizontal=True,
+        key="ocr_first",
+    )
+    # Extra targets share one parse and image extraction and are converted side by side
+    extra_targets = st.multiselect(
+        "Also convert to (side by side)",
+        [tech for tech in target_tech_options if tech not in ("CustomTech", final_target_tech)],
+        key="extra_targets",
+    )
     if st.button("Convert Document"):
         sections = st.session_state.get('sections', [])
         detected_source_tech = st.session_state.get('detected_source_tech', 'Unknown')
-        temp_docx_path = st.session_state.get("temp_docx_path")
 
         if not sections:
             st.error("No document sections found to convert.")
             st.stop()
 
-        st.info(f"Converting from {detected_source_tech} to {final_target_tech}")
-
-        converted = {}
-        try:
-            for section in sections:
-                title = section.get("title", "Untitled")
-                converted_text = convert_any_to_any(section, detected_source_tech, final_target_tech, client)
-                converted[title] = converted_text
-        except Exception as e:
-            st.error(f"Error during conversion: {e}")
-            st.stop()
-
-        st.session_state['converted'] = converted
+        # The job keeps its own copy of the document and runs outside this script run
+        if extra_targets:
+            group_id, job_ids = submit_fanout(
+                st.session_state['uploaded_file'], st.session_state.get('uploaded_file_name'),
+                detected_source_tech, [final_target_tech] + extra_targets, client,
+                max_workers=max_workers, diagram_index=diagram_index, diagram_mode=diagram_mode,
+                section_store=section_store, ocr_first=ocr_first,
+            )
+            job_id = job_ids[0]
+            st.session_state['group_id'] = group_id
+            st.query_params["group"] = group_id
+        else:
+            job_id = submit_job(
+                st.session_state['uploaded_file'], st.session_state.get('uploaded_file_name'),
+                detected_source_tech, final_target_tech, client,
+                max_workers=max_workers, diagram_index=diagram_index, diagram_mode=diagram_mode,
+                section_store=section_store, ocr_first=ocr_first,
+            )
+            st.session_state.pop('group_id', None)
+            st.query_params.pop("group", None)
+        st.session_state['job_id'] = job_id
+        st.query_params["job"] = job_id
+        for key in ['converted', 'diagrams', 'output_docx', 'output_name']:
+            st.session_state.pop(key, None)
+
+# --- Background conversion job ---
+
+# The job id is also kept in the URL so a refresh or reconnect finds the running job again
+job_id = st.session_state.get('job_id') or st.query_params.get("job")
+job = get_job(job_id) if job_id else None
+
+if job_id and job is None:
+    st.warning(f"Conversion job {job_id} was not found." if is_valid_id(job_id) else "Invalid conversion job link.")
+    st.session_state.pop('job_id', None)
+    st.query_params.pop("job", None)
+elif job:
+    st.session_state['job_id'] = job_id
+    titles = job.get("titles", [])
+    done_count = sum(1 for i in range(len(titles)) if str(i) in job["converted"])
+    st.info(f"Converting {job.get('filename') or 'document'} from {job['source_tech']} to {job['target_tech']}")
+    reuse = job.get("reuse")
+    if reuse and reuse["reused"]:
+        changed = f"{reuse['changed']} changed since the last conversion, " if reuse["previous"] else ""
+        st.caption(f"♻️ {changed}{reuse['reused']}/{len(job.get('titles', []))} sections reused without an API call")
+    if reuse and (reuse.get("near") or reuse.get("revised")):
+        st.caption(f"♻️ {reuse.get('near', 0)} section(s) matched a near-identical earlier section, "
+                   f"{reuse.get('revised', 0)} converted as a short edit of one")
+
+    if job["status"] in ("queued", "running"):
+        poll_job = True
+        if not titles:
+            st.progress(0.0, text="Starting conversion...")
+        elif done_count < len(titles):
+            st.progress(done_count / len(titles), text=f"Converted {done_count}/{len(titles)} sections")
+        else:
+            st.progress(1.0, text="📊 Checking and updating flow diagrams...")
 
-        # Diagram extraction + regeneration
-        if temp_docx_path and os.path.exists(temp_docx_path):
-            st.info("📊 Checking and updating flow diagrams...")
-            try:
-                diagrams = extract_images_from_docx(temp_docx_path)
-                st.write(f"Extracted {len(diagrams)} diagram(s) from document.")
-                regenerated_diagrams = []
-
-                for image_bytes, image_name in diagrams:
-                    st.write(f"Processing diagram: {image_name}")
-                    description = analyze_and_convert_diagram(
-                        image_bytes, detected_source_tech, final_target_tech, client
-                    )
-                    st.write(f"Diagram description: {description}")
+        if st.session_state.get("stream_output", True):
+            for index, title in enumerate(titles):
+                text = job["converted"].get(str(index)) or job["live"].get(index)
+                if text:
+                    st.expander(title, expanded=index in job["live"]).markdown(text)
 
-                    diagram_image_path = regenerate_diagram_from_text(
-                        description, final_target_tech, client
+    elif job["status"] in ("failed", "interrupted"):
+        if job["status"] == "failed":
+            st.error(f"Conversion failed: {job['error']}")
+        else:
+            st.warning("Conversion was interrupted before it finished.")
+        st.write(f"{done_count}/{len(titles)} sections were converted successfully.")
+        if st.button("🔁 Resume Conversion"):
+            resume_job(job_id, client, max_workers=max_workers, diagram_index=diagram_index,
+                       section_store=section_store)
+            st.rerun()
+
+    if job["status"] in ("completed", "failed") and job.get("output_file"):
+        st.session_state['converted'] = job_results(job)
+        st.session_state['diagrams'] = job_diagram_images(job)
+        st.session_state['output_docx'] = job_output(job)
+        st.session_state['output_name'] = os.path.basename(job["output_file"])
+        final_target_tech = job["target_tech"]
+
+        if job["diagrams"]:
+            st.info("📊 Diagram results")
+            st.write(f"Extracted {len(job['diagrams'])} diagram(s) from document.")
+            for result in job["diagrams"]:
+                if result["status"] == "skipped":
+                    st.write(f"Skipped decorative image: {result['name']}")
+                    continue
+                st.write(f"Processed diagram: {result['name']}")
+                if result["status"] == "reused":
+                    st.write("Reused conversion of an identical earlier diagram.")
+                elif result.get("mode") == "ocr":
+                    st.write("Redrawn from the diagram's OCR text; no vision call was needed.")
+                stats = result.get("payload_stats")
+                if stats:
+                    st.caption(
+                        f"Image payload: {stats['original_bytes'] // 1024} KB → {stats['payload_bytes'] // 1024} KB, "
+                        f"~{stats['tokens_saved']} vision tokens saved"
                     )
+                st.write(f"Diagram description: {result['description']}")
+                if result["status"] == "failed":
+                    st.warning(f"Failed to generate diagram for {result['name']}")
+
+        # Display and Download Generated Diagrams
+        if st.session_state['diagrams']:
+            st.subheader("🖼️ Generated Diagrams")
+            for i, diagram_image in enumerate(st.session_state['diagrams'], start=1):
+                st.image(diagram_image, caption=f"Diagram {i}", use_column_width=True)
+                st.download_button(
+                    label=f"📥 Download Diagram {i}",
+                    data=diagram_image,
+                    file_name=f"diagram_{i}.png",
+                    mime="image/png",
+                    key=f"download_diagram_{i}",
+                )
 
-                    if diagram_image_path and os.path.exists(diagram_image_path):
-                        st.write(f"Diagram generated and saved to: {diagram_image_path}")
-                        regenerated_diagrams.append(diagram_image_path)
-                    else:
-                        st.warning(f"Failed to generate diagram for {image_name}")
-
-                st.session_state['diagrams'] = regenerated_diagrams
-
-                # ===== NEW BLOCK: Display and Download Generated Diagrams =====
-                if 'diagrams' in st.session_state and st.session_state['diagrams']:
-                    st.subheader("🖼️ Generated Diagrams")
-                    for diagram_path in st.session_state['diagrams']:
-                        if os.path.exists(diagram_path):
-                            with open(diagram_path, "rb") as img_file:
-                                st.image(diagram_path, caption=os.path.basename(diagram_path), use_column_width=True)
-                                st.download_button(
-                                    label=f"📥 Download {os.path.basename(diagram_path)}",
-                                    data=img_file,
-                                    file_name=os.path.basename(diagram_path),
-                                    mime="image/png"
-                                )
-                        else:
-                            st.warning(f"Diagram image not found: {diagram_path}")
-                # =============================================================
-
-            except Exception as e:
-                st.error(f"Error processing diagrams: {e}")
+        if job["status"] == "completed":
+            st.success(f"Conversion complete! {st.session_state['output_name']} is ready to download.")
+
+# --- Side-by-side targets ---
+
+group_id = st.session_state.get('group_id') or st.query_params.get("group")
+report = fanout_report(group_id) if group_id else None
+if group_id and report is None:
+    st.session_state.pop('group_id', None)
+    st.query_params.pop("group", None)
+
+if report:
+    st.session_state['group_id'] = group_id
+    st.subheader("🎯 All Target Technologies")
+    tabs = st.tabs([target["target_tech"] for target in report["targets"]])
+    for tab, target in zip(tabs, report["targets"]):
+        target_job = get_job(target["job_id"])
+        if target_job is None:
+            tab.warning(f"Conversion job {target['job_id']} was not found.")
+            continue
+        target_titles = target_job.get("titles", [])
+        target_done = sum(1 for i in range(len(target_titles)) if str(i) in target_job["converted"])
+        if target_job["status"] in ("queued", "running"):
+            poll_job = True
+            tab.progress(target_done / len(target_titles) if target_titles else 0.0,
+                         text=f"Converted {target_done}/{len(target_titles)} sections")
+        elif target_job["status"] == "failed":
+            tab.error(f"Conversion failed: {target_job['error']}")
+        elif target_job["status"] == "interrupted":
+            tab.warning("Conversion was interrupted before it finished.")
         else:
-            st.warning("Temporary DOCX file not found, skipping diagram extraction.")
-
-        # Save converted content + images to DOCX
-        output_file = f"{final_target_tech}_Design.docx"
-        try:
-            insert_images_to_docx(output_file, st.session_state['converted'], st.session_state.get('diagrams', []))
-            st.session_state['output_file'] = output_file
-            st.success(f"Conversion complete! File saved as {output_file}")
-        except Exception as e:
-            st.error(f"Error saving converted document: {e}")
-
-        # Cleanup temp file after processing
-        try:
-            if temp_docx_path and os.path.exists(temp_docx_path):
-                os.remove(temp_docx_path)
-        except Exception:
-            pass
+            tab.success(f"{target_done}/{len(target_titles)} sections converted.")
+
+        for title, content in job_results(target_job).items():
+            if content:
+                tab.expander(title).markdown(content)
+        target_output = job_output(target_job) if target_job.get("output_file") else None
+        if target_output:
+            tab.download_button(
+                f"📥 Download Converted {target['target_tech']} DOCX", target_output,
+                file_name=os.path.basename(target_job["output_file"]),
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                key=f"download_target_{target['job_id']}",
+            )
+
+    # Combined timing report; shared work is done once for every target
+    st.caption("⏱️ Timings (seconds)")
+    rows = [{"target": "shared (parse, images)", "status": "", **report["shared"]}]
+    rows += [{"target": target["target_tech"], "status": target["status"], **target["timings"]}
+             for target in report["targets"]]
+    st.dataframe(rows, use_container_width=True)
+    if report["wall_seconds"] is not None:
+        st.caption(f"All targets finished in {report['wall_seconds']:.1f}s "
+                   f"({report['sequential_seconds']:.1f}s of work when run one after another)")
 
 # --- Show original sections ---
 
@@ -242,16 +389,19 @@ if 'converted' in st.session_state:
 
 # --- Download button ---
 
-if 'output_file' in st.session_state:
-    output_file = st.session_state['output_file']
-    try:
-        with open(output_file, "rb") as f:
-            st.download_button(
-                f"📥 Download Converted {final_target_tech} DOCX", f,
-                file_name=output_file,
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-            )
-    except FileNotFoundError:
+if 'output_docx' in st.session_state:
+    if st.session_state['output_docx']:
+        st.download_button(
+            f"📥 Download Converted {final_target_tech} DOCX", st.session_state['output_docx'],
+            file_name=st.session_state.get('output_name', f"{final_target_tech}_Design.docx"),
+            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+        )
+    else:
         st.error("Converted file not found. Please convert the document again.")
 else:
     st.info("Please upload a document to enable conversion.")
+
+# Poll a running job: re-run the script so progress and streamed text refresh
+if poll_job:
+    time.sleep(1)
+    st.rerun()